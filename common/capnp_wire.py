@@ -0,0 +1,93 @@
+"""
+  Building and reading capnp messages in their wire format with numpy, where going through the capnp API one value at a time
+  is too slow. Single segment messages only, see https://capnproto.org/encoding.html
+"""
+import capnp
+import numpy as np
+
+# list pointer element sizes
+LIST_FOUR_BYTES = 4
+LIST_POINTER = 6
+
+
+def _words(*values):
+  return (np.asarray(v).astype(np.uint64) for v in values)
+
+
+def struct_pointer(offset, data_words, pointer_words):
+  """Struct pointer words, offset is in words from the end of the pointer"""
+  offset, data_words, pointer_words = _words(offset, data_words, pointer_words)
+  return (offset << np.uint64(2)) | (data_words << np.uint64(32)) | (pointer_words << np.uint64(48))
+
+
+def list_pointer(offset, element_size, count):
+  """List pointer words, offset is in words from the end of the pointer"""
+  offset, element_size, count = _words(offset, element_size, count)
+  return np.uint64(1) | (offset << np.uint64(2)) | (element_size << np.uint64(32)) | (count << np.uint64(35))
+
+
+def decode_struct_pointers(w: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """Offsets, data section and pointer section sizes (in words) of the struct pointer words w"""
+  offset = ((w >> np.uint64(2)) & np.uint64(0x3FFFFFFF)).astype(np.int64)
+  offset[offset >= (1 << 29)] -= 1 << 30
+  data_words = (w >> np.uint64(32)).astype(np.int64) & 0xFFFF
+  pointer_words = (w >> np.uint64(48)).astype(np.int64)
+  return offset, data_words, pointer_words
+
+
+def _root(struct_type) -> tuple[np.uint64, int]:
+  """Root pointer of a struct_type message with the struct right after it, and the word after the struct"""
+  node = struct_type.schema.node.struct
+  return struct_pointer(0, node.dataWordCount, node.pointerCount), 1 + node.dataWordCount + node.pointerCount
+
+
+def _pointer_word(struct_type, field: str) -> int:
+  return 1 + struct_type.schema.node.struct.dataWordCount + struct_type.schema.fields[field].proto.slot.offset
+
+
+class FloatListStruct:
+  """
+    A struct of List(Float32) fields in capnp's wire format. The lists are views into one buffer, so arrays are copied in
+    with numpy and capnp copies the whole struct into a message, instead of converting every value to a Python float.
+    fields maps the field names to their length, or to constant values.
+  """
+  def __init__(self, struct_type, fields: dict[str, int | list[float]]):
+    self.struct_type = struct_type
+    lengths = {name: n if isinstance(n, int) else len(n) for name, n in fields.items()}
+    list_words = {name: (n * 4 + 7) // 8 for name, n in lengths.items()}
+
+    root, pos = _root(struct_type)
+    self.buf = np.zeros(pos + sum(list_words.values()), dtype=np.uint64)
+    self.buf[0] = root
+    floats = self.buf.view(np.float32)
+    self.lists: dict[str, np.ndarray] = {}
+    for name, n in lengths.items():
+      ptr = _pointer_word(struct_type, name)
+      self.buf[ptr] = list_pointer(pos - ptr - 1, LIST_FOUR_BYTES, n)
+      self.lists[name] = floats[2 * pos:2 * pos + n]
+      if not isinstance(fields[name], int):
+        self.lists[name][:] = fields[name]
+      pos += list_words[name]
+
+  def __call__(self, **values: np.ndarray) -> capnp._DynamicStructReader:
+    for name, v in values.items():
+      self.lists[name][:] = v
+    # a copy, so the struct stays valid after the next call
+    return self.struct_type.from_segments([self.buf.copy()])
+
+
+def float_rows_struct(struct_type, field: str, rows: np.ndarray) -> capnp._DynamicStructReader:
+  """
+    A struct_type with only field set to rows, for a List(List(Float32)) field. It's built in capnp's wire format with
+    numpy, instead of converting every value to a Python float. Set the other fields after copying it into a message.
+  """
+  n, row_words = len(rows), (rows.shape[1] * 4 + 7) // 8
+  root, lists = _root(struct_type)
+  buf = np.zeros(lists + n * (1 + row_words), dtype=np.uint64)
+  buf[0] = root
+  ptr = _pointer_word(struct_type, field)
+  buf[ptr] = list_pointer(lists - ptr - 1, LIST_POINTER, n)
+  # a pointer to each row, the rows follow all the pointers
+  buf[lists:lists + n] = list_pointer((n - 1) + np.arange(n) * (row_words - 1), LIST_FOUR_BYTES, rows.shape[1])
+  buf[lists + n:].view(np.float32).reshape(n, 2 * row_words)[:, :rows.shape[1]] = rows
+  return struct_type.from_segments([buf])
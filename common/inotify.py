@@ -0,0 +1,67 @@
+import os
+import sys
+import ctypes
+import ctypes.util
+import struct
+
+# inotify constants from /usr/include/linux/inotify.h
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+
+class Inotify:
+  """Non-blocking inotify instance, raises OSError where inotify isn't available"""
+  def __init__(self):
+    if not sys.platform.startswith('linux'):
+      raise OSError("inotify is only available on Linux")
+
+    self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self._fd < 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, os.strerror(errno))
+
+  def __del__(self) -> None:
+    self.close()
+
+  def close(self) -> None:
+    if hasattr(self, '_fd') and self._fd >= 0:
+      os.close(self._fd)
+      self._fd = -1
+
+  def add_watch(self, path: str, mask: int) -> int:
+    wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+    if wd < 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, os.strerror(errno), path)
+    return wd
+
+  def rm_watch(self, wd: int) -> None:
+    # the watch is gone already if its path was deleted, that's fine
+    self._libc.inotify_rm_watch(self._fd, wd)
+
+  def read(self) -> list[tuple[int, int, str]]:
+    """All the pending events as (watch descriptor, mask, name), without blocking"""
+    events = []
+    while True:
+      try:
+        buf = os.read(self._fd, _READ_SIZE)
+      except BlockingIOError:
+        return events
+
+      i = 0
+      while i < len(buf):
+        wd, mask, _, name_len = _EVENT_HEADER.unpack_from(buf, i)
+        i += _EVENT_HEADER.size
+        name = os.fsdecode(buf[i:i + name_len].rstrip(b'\0'))
+        i += name_len
+        events.append((wd, mask, name))
@@ -25,7 +25,8 @@ class OpenpilotPrefix:
     if self.create_dirs_on_enter:
       self.create_dirs()
 
-    if self.shared_download_cache:
+    self.original_comma_cache = os.environ.get("COMMA_CACHE", None)
+    if self.shared_download_cache and not self.original_comma_cache:
       os.environ["COMMA_CACHE"] = DEFAULT_DOWNLOAD_CACHE_ROOT
 
     return self
@@ -33,6 +34,11 @@ class OpenpilotPrefix:
   def __exit__(self, exc_type, exc_obj, exc_tb):
     if self.clean_dirs_on_exit:
       self.clean_dirs()
+    if self.shared_download_cache:
+      if self.original_comma_cache is None:
+        os.environ.pop("COMMA_CACHE", None)
+      else:
+        os.environ["COMMA_CACHE"] = self.original_comma_cache
     try:
       del os.environ['OPENPILOT_PREFIX']
       if self.original_prefix is not None:
@@ -0,0 +1,47 @@
+import numpy as np
+
+from cereal import log
+from openpilot.common.capnp_wire import FloatListStruct, decode_struct_pointers, float_rows_struct, list_pointer, struct_pointer
+
+
+class TestCapnpWire:
+  def test_struct_pointer_roundtrip(self):
+    offsets = np.array([0, 1, 1000, -1, -1000])
+    w = struct_pointer(offsets & 0x3FFFFFFF, 3, 5)
+    assert ((w & np.uint64(3)) == 0).all()
+    offset, data_words, pointer_words = decode_struct_pointers(w)
+    assert offset.tolist() == offsets.tolist()
+    assert data_words.tolist() == [3] * len(offsets)
+    assert pointer_words.tolist() == [5] * len(offsets)
+
+  def test_pointers_match_capnp(self):
+    # the root pointer and the first list pointer of a message capnp built
+    msg = log.XYZTData.new_message()
+    msg.t = [1., 2., 3.]
+    words = np.frombuffer(msg.to_segments()[0], dtype=np.uint64)
+    node = log.XYZTData.schema.node.struct
+    assert words[0] == struct_pointer(0, node.dataWordCount, node.pointerCount)
+    ptr = 1 + node.dataWordCount + log.XYZTData.schema.fields['t'].proto.slot.offset
+    assert words[ptr] == list_pointer(words.size - 2 - ptr - 1, 4, 3)
+
+  def test_float_list_struct(self):
+    rng = np.random.default_rng(0)
+    xyzt = FloatListStruct(log.XYZTData, {'t': [0., 1., 2.], 'x': 3, 'y': 3, 'z': 0})
+    for _ in range(3):
+      x, y = rng.standard_normal((2, 3), dtype=np.float32)
+      expected = log.XYZTData.new_message(t=[0., 1., 2.], x=x.tolist(), y=y.tolist(), z=[])
+      assert xyzt(x=x, y=y).to_dict() == expected.to_dict()
+
+  def test_float_list_struct_valid_after_next_call(self):
+    xyzt = FloatListStruct(log.XYZTData, {'x': 3})
+    first = xyzt(x=np.ones(3, dtype=np.float32))
+    xyzt(x=np.zeros(3, dtype=np.float32))
+    assert list(first.x) == [1., 1., 1.]
+
+  def test_float_rows_struct(self):
+    rng = np.random.default_rng(0)
+    for n, cols in [(0, 2), (1, 2), (7, 2), (5, 3)]:
+      rows = rng.standard_normal((n, cols), dtype=np.float32)
+      msg = log.LiveTorqueParametersData.new_message()
+      msg.points = rows.tolist()
+      assert float_rows_struct(log.LiveTorqueParametersData, 'points', rows).to_dict() == msg.to_dict()
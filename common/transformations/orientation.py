@@ -1,13 +1,21 @@
 import numpy as np
 from collections.abc import Callable
 
-from openpilot.common.transformations.transformations import (ecef_euler_from_ned_single,
+from openpilot.common.transformations.transformations import (ecef_euler_from_ned_batch,
+                                                    ecef_euler_from_ned_single,
+                                                    euler2quat_batch,
                                                     euler2quat_single,
+                                                    euler2rot_batch,
                                                     euler2rot_single,
+                                                    ned_euler_from_ecef_batch,
                                                     ned_euler_from_ecef_single,
+                                                    quat2euler_batch,
                                                     quat2euler_single,
+                                                    quat2rot_batch,
                                                     quat2rot_single,
+                                                    rot2euler_batch,
                                                     rot2euler_single,
+                                                    rot2quat_batch,
                                                     rot2quat_single)
 
 
@@ -33,14 +41,28 @@ def numpy_wrap(function, input_shape, output_shape) -> Callable[..., np.ndarray]
   return f
 
 
-euler2quat = numpy_wrap(euler2quat_single, (3,), (4,))
-quat2euler = numpy_wrap(quat2euler_single, (4,), (3,))
-quat2rot = numpy_wrap(quat2rot_single, (4,), (3, 3))
-rot2quat = numpy_wrap(rot2quat_single, (3, 3), (4,))
-euler2rot = numpy_wrap(euler2rot_single, (3,), (3, 3))
-rot2euler = numpy_wrap(rot2euler_single, (3, 3), (3,))
-ecef_euler_from_ned = numpy_wrap(ecef_euler_from_ned_single, (3,), (3,))
-ned_euler_from_ecef = numpy_wrap(ned_euler_from_ecef_single, (3,), (3,))
+def batch_wrap(single, batch, input_shape) -> Callable[..., np.ndarray]:
+  """
+  Combine the single and batched versions of a function to take either an input or an array of inputs. A single input,
+  with all leading arguments single too, goes to the single function, which has less overhead for one input.
+  """
+  def f(*inps):
+    *args, inp = inps
+    inp = np.asarray(inp)
+    if inp.ndim == len(input_shape) and all(np.ndim(arg) <= 1 for arg in args):
+      return single(*args, inp)
+    return batch(*args, inp)
+  return f
+
+
+euler2quat = batch_wrap(euler2quat_single, euler2quat_batch, (3,))
+quat2euler = batch_wrap(quat2euler_single, quat2euler_batch, (4,))
+quat2rot = batch_wrap(quat2rot_single, quat2rot_batch, (4,))
+rot2quat = batch_wrap(rot2quat_single, rot2quat_batch, (3, 3))
+euler2rot = batch_wrap(euler2rot_single, euler2rot_batch, (3,))
+rot2euler = batch_wrap(rot2euler_single, rot2euler_batch, (3, 3))
+ecef_euler_from_ned = batch_wrap(ecef_euler_from_ned_single, ecef_euler_from_ned_batch, (3,))
+ned_euler_from_ecef = batch_wrap(ned_euler_from_ecef_single, ned_euler_from_ecef_batch, (3,))
 
 quats_from_rotations = rot2quat
 quat_from_rot = rot2quat
@@ -103,6 +103,17 @@ class TestNED:
                                                            ecef_positions_offset_batch,
                                                            rtol=1e-9, atol=1e-7)
 
+  def test_batch_matches_single(self):
+    batch_geodetic = np.stack([geodetic_positions, geodetic_positions + [0.01, -0.01, 10]])
+    batch_ecef = coord.geodetic2ecef(batch_geodetic)
+    np.testing.assert_allclose(batch_ecef, [[coord.geodetic2ecef(g) for g in row] for row in batch_geodetic], rtol=1e-15)
+    np.testing.assert_allclose(coord.ecef2geodetic(batch_ecef), [[coord.ecef2geodetic(e) for e in row] for row in batch_ecef], rtol=1e-12, atol=1e-8)
+
+    converter = coord.LocalCoord.from_ecef(ecef_init_batch)
+    for f, inputs in [(converter.ecef2ned, batch_ecef), (converter.ned2ecef, np.stack([ned_offsets, ned_offsets_batch])),
+                      (converter.geodetic2ned, batch_geodetic), (converter.ned2geodetic, np.stack([ned_offsets, ned_offsets_batch]))]:
+      np.testing.assert_allclose(f(inputs), [[f(x) for x in row] for row in inputs], rtol=1e-12, atol=1e-7)
+
   def test_errors(self):
     # Test wrong shape/type for geodetic2ecef
     # numpy_wrap raises IndexError for scalar input
@@ -3,7 +3,7 @@ import pytest
 
 from openpilot.common.transformations.orientation import euler2quat, quat2euler, euler2rot, rot2euler, \
                                                rot2quat, quat2rot, \
-                                               ned_euler_from_ecef
+                                               ned_euler_from_ecef, ecef_euler_from_ned
 
 eulers = np.array([[ 1.46520501,  2.78688383,  2.92780854],
        [ 4.86909526,  3.60618161,  4.30648981],
@@ -59,7 +59,22 @@ class TestOrientation:
     for i in range(len(eulers)):
       np.testing.assert_allclose(ned_eulers[i], ned_euler_from_ecef(ecef_positions[i], eulers[i]), rtol=1e-7)
       #np.testing.assert_allclose(eulers[i], ecef_euler_from_ned(ecef_positions[i], ned_eulers[i]), rtol=1e-7)
-    # np.testing.assert_allclose(ned_eulers, ned_euler_from_ecef(ecef_positions, eulers), rtol=1e-7)
+    np.testing.assert_allclose(ned_eulers, ned_euler_from_ecef(ecef_positions, eulers), rtol=1e-7)
+
+  def test_batch_matches_single(self):
+    rng = np.random.default_rng(0)
+    batch_eulers = rng.uniform(-np.pi, np.pi, (2, 50, 3))
+    rots = euler2rot(batch_eulers)
+    # all cases of the conversion to quaternions
+    rots[0, :4] = [np.eye(3), np.diag([1., -1., -1.]), np.diag([-1., 1., -1.]), np.diag([-1., -1., 1.])]
+    for f, inputs in [(euler2quat, batch_eulers), (quat2euler, euler2quat(batch_eulers)), (quat2rot, euler2quat(batch_eulers)),
+                      (rot2quat, rots), (euler2rot, batch_eulers), (rot2euler, rots)]:
+      expected = np.array([[f(x) for x in row] for row in inputs])
+      np.testing.assert_allclose(f(inputs), expected, rtol=1e-12, atol=1e-15)
+
+    for f in [ned_euler_from_ecef, ecef_euler_from_ned]:
+      expected = np.array([f(ecef_positions[0], e) for e in batch_eulers[0]])
+      np.testing.assert_allclose(f(ecef_positions[0], batch_eulers[0]), expected, rtol=1e-7, atol=1e-7)
 
   def test_inputs(self):
     with pytest.raises(ValueError):
@@ -247,6 +247,30 @@ class LocalCoord:
     ecef = self.ned2ecef_single(ned)
     return ecef2geodetic_single(ecef)
 
+  def ecef2ned_batch(self, ecef):
+    """
+    Convert ECEF points of shape (..., 3) to NED coordinates relative to the origin.
+    """
+    return _matvec(self.ecef2ned_matrix, np.asarray(ecef) - self.init_ecef)
+
+  def ned2ecef_batch(self, ned):
+    """
+    Convert NED points of shape (..., 3) to ECEF coordinates.
+    """
+    return _matvec(self.ned2ecef_matrix, ned) + self.init_ecef
+
+  def geodetic2ned_batch(self, geodetic):
+    """
+    Convert geodetic points of shape (..., 3) to NED coordinates.
+    """
+    return self.ecef2ned_batch(geodetic2ecef_batch(geodetic))
+
+  def ned2geodetic_batch(self, ned):
+    """
+    Convert NED points of shape (..., 3) to geodetic coordinates.
+    """
+    return ecef2geodetic_batch(self.ned2ecef_batch(ned))
+
   @property
   def ned_from_ecef_matrix(self):
     """
@@ -340,3 +364,268 @@ def ned_euler_from_ecef_single(ecef_init, ecef_pose):
   phi_out = np.arctan2(np.dot(y3, z2), np.dot(y3, y2))
 
   return np.array([phi_out, theta_out, psi_out])
+
+
+# Batched transforms, over any leading dimensions of the inputs
+
+
+def _components(v, n):
+  """
+  The n components along the last axis of an array of shape (..., n).
+  """
+  v = np.asarray(v)
+  if v.shape[-1] != n:
+    raise ValueError(f"Last dimension must be size {n}, not {v.shape[-1]}")
+  return tuple(v[..., i] for i in range(n))
+
+
+def _dot(u, v):
+  return np.einsum('...i,...i->...', u, v)
+
+
+def _matvec(m, v):
+  return np.einsum('...ij,...j->...i', m, v)
+
+
+def _rot_from_components(*rows):
+  """
+  Stack the 9 components of 3x3 matrices, given row by row, into an array of shape (..., 3, 3).
+  """
+  return np.stack(np.broadcast_arrays(*rows), axis=-1).reshape(np.broadcast_shapes(*(np.shape(r) for r in rows)) + (3, 3))
+
+
+def _positive_w(w, x, y, z):
+  sign = np.where(w < 0, -1.0, 1.0)
+  return np.stack([sign * w, sign * x, sign * y, sign * z], axis=-1)
+
+
+def geodetic2ecef_batch(g):
+  """
+  Convert geodetic coordinates (latitude, longitude, altitude) of shape (..., 3) to ECEF.
+  """
+  g = np.asarray(g)
+  if g.shape[-1] != 3:
+    raise ValueError("Geodetic must be size 3")
+
+  lat = np.radians(g[..., 0])
+  lon = np.radians(g[..., 1])
+  alt = g[..., 2]
+  xi = np.sqrt(1.0 - esq * np.sin(lat)**2)
+  x = (a / xi + alt) * np.cos(lat) * np.cos(lon)
+  y = (a / xi + alt) * np.cos(lat) * np.sin(lon)
+  z = (a / xi * (1.0 - esq) + alt) * np.sin(lat)
+  return np.stack([x, y, z], axis=-1)
+
+
+def ecef2geodetic_batch(e):
+  """
+  Convert ECEF of shape (..., 3) to geodetic coordinates using Ferrari's solution.
+  """
+  x, y, z = _components(e, 3)
+  r = np.sqrt(x**2 + y**2)
+  Esq = a**2 - b**2
+  F = 54 * b**2 * z**2
+  G = r**2 + (1 - esq) * z**2 - esq * Esq
+  C = (esq**2 * F * r**2) / (G**3)
+  S = np.cbrt(1 + C + np.sqrt(C**2 + 2 * C))
+  P = F / (3 * (S + 1 / S + 1)**2 * G**2)
+  Q = np.sqrt(1 + 2 * esq**2 * P)
+  r_0 = -(P * esq * r) / (1 + Q) + np.sqrt(0.5 * a**2 * (1 + 1.0 / Q) - P * (1 - esq) * z**2 / (Q * (1 + Q)) - 0.5 * P * r**2)
+  U = np.sqrt((r - esq * r_0)**2 + z**2)
+  V = np.sqrt((r - esq * r_0)**2 + (1 - esq) * z**2)
+  Z_0 = b**2 * z / (a * V)
+  h = U * (1 - b**2 / (a * V))
+  lat = np.arctan((z + e1sq * Z_0) / r)
+  lon = np.arctan2(y, x)
+  return np.stack([np.degrees(lat), np.degrees(lon), h], axis=-1)
+
+
+def euler2quat_batch(euler):
+  """
+  Convert Euler angles (roll, pitch, yaw) of shape (..., 3) to quaternions.
+  Rotation order: Z-Y-X (yaw, pitch, roll).
+  """
+  phi, theta, psi = _components(euler, 3)
+
+  c_phi, s_phi = np.cos(phi / 2), np.sin(phi / 2)
+  c_theta, s_theta = np.cos(theta / 2), np.sin(theta / 2)
+  c_psi, s_psi = np.cos(psi / 2), np.sin(psi / 2)
+
+  w = c_phi * c_theta * c_psi + s_phi * s_theta * s_psi
+  x = s_phi * c_theta * c_psi - c_phi * s_theta * s_psi
+  y = c_phi * s_theta * c_psi + s_phi * c_theta * s_psi
+  z = c_phi * c_theta * s_psi - s_phi * s_theta * c_psi
+  return _positive_w(w, x, y, z)
+
+
+def quat2euler_batch(q):
+  """
+  Convert quaternions of shape (..., 4) to Euler angles (roll, pitch, yaw).
+  """
+  w, x, y, z = _components(q, 4)
+  gamma = np.arctan2(2 * (w * x + y * z), 1 - 2 * (x**2 + y**2))
+  sin_arg = 2 * (w * y - z * x)
+  sin_arg = np.clip(sin_arg, -1.0, 1.0)
+  theta = np.arcsin(sin_arg)
+  psi = np.arctan2(2 * (w * z + x * y), 1 - 2 * (y**2 + z**2))
+  return np.stack([gamma, theta, psi], axis=-1)
+
+
+def _quat2rot(w, x, y, z):
+  xx, yy, zz = x * x, y * y, z * z
+  xy, xz, yz = x * y, x * z, y * z
+  wx, wy, wz = w * x, w * y, w * z
+
+  return _rot_from_components(
+    1 - 2 * (yy + zz), 2 * (xy - wz), 2 * (xz + wy),
+    2 * (xy + wz), 1 - 2 * (xx + zz), 2 * (yz - wx),
+    2 * (xz - wy), 2 * (yz + wx), 1 - 2 * (xx + yy),
+  )
+
+
+def quat2rot_batch(q):
+  """
+  Convert quaternions of shape (..., 4) to 3x3 rotation matrices.
+  """
+  return _quat2rot(*_components(q, 4))
+
+
+def rot2quat_batch(rot):
+  """
+  Convert 3x3 rotation matrices of shape (..., 3, 3) to quaternions.
+  """
+  rot = np.asarray(rot)
+  r = [[rot[..., i, j].reshape(-1) for j in range(3)] for i in range(3)]
+  trace = r[0][0] + r[1][1] + r[2][2]
+
+  # the same cases as rot2quat_single, each one is only evaluated where it applies
+  cases = [trace > 0]
+  cases.append(~cases[0] & (r[0][0] > r[1][1]) & (r[0][0] > r[2][2]))
+  cases.append(~cases[0] & ~cases[1] & (r[1][1] > r[2][2]))
+  cases.append(~cases[0] & ~cases[1] & ~cases[2])
+
+  w, x, y, z = (np.empty(trace.shape) for _ in range(4))
+  for case, mask in enumerate(cases):
+    m = [[r[i][j][mask] for j in range(3)] for i in range(3)]
+    if case == 0:
+      s = 0.5 / np.sqrt(trace[mask] + 1.0)
+      w[mask] = 0.25 / s
+      x[mask] = (m[2][1] - m[1][2]) * s
+      y[mask] = (m[0][2] - m[2][0]) * s
+      z[mask] = (m[1][0] - m[0][1]) * s
+    elif case == 1:
+      s = 2.0 * np.sqrt(1.0 + m[0][0] - m[1][1] - m[2][2])
+      w[mask] = (m[2][1] - m[1][2]) / s
+      x[mask] = 0.25 * s
+      y[mask] = (m[0][1] + m[1][0]) / s
+      z[mask] = (m[0][2] + m[2][0]) / s
+    elif case == 2:
+      s = 2.0 * np.sqrt(1.0 + m[1][1] - m[0][0] - m[2][2])
+      w[mask] = (m[0][2] - m[2][0]) / s
+      x[mask] = (m[0][1] + m[1][0]) / s
+      y[mask] = 0.25 * s
+      z[mask] = (m[1][2] + m[2][1]) / s
+    else:
+      s = 2.0 * np.sqrt(1.0 + m[2][2] - m[0][0] - m[1][1])
+      w[mask] = (m[1][0] - m[0][1]) / s
+      x[mask] = (m[0][2] + m[2][0]) / s
+      y[mask] = (m[1][2] + m[2][1]) / s
+      z[mask] = 0.25 * s
+  return _positive_w(w, x, y, z).reshape(rot.shape[:-2] + (4,))
+
+
+def euler2rot_batch(euler):
+  """
+  Convert Euler angles (roll, pitch, yaw) of shape (..., 3) to 3x3 rotation matrices.
+  Rotation order: Z-Y-X (yaw, pitch, roll).
+  """
+  phi, theta, psi = _components(euler, 3)
+
+  cx, sx = np.cos(phi), np.sin(phi)
+  cy, sy = np.cos(theta), np.sin(theta)
+  cz, sz = np.cos(psi), np.sin(psi)
+
+  Rx = _rot_from_components(1, 0, 0, 0, cx, -sx, 0, sx, cx)
+  Ry = _rot_from_components(cy, 0, sy, 0, 1, 0, -sy, 0, cy)
+  Rz = _rot_from_components(cz, -sz, 0, sz, cz, 0, 0, 0, 1)
+
+  return Rz @ Ry @ Rx
+
+
+def rot2euler_batch(rot):
+  """
+  Convert 3x3 rotation matrices of shape (..., 3, 3) to Euler angles (roll, pitch, yaw).
+  """
+  return quat2euler_batch(rot2quat_batch(rot))
+
+
+def axis_angle_to_rot_batch(axis, angle):
+  """
+  Convert axis-angle representations, axes of shape (..., 3) and angles of shape (...), to 3x3 rotation matrices.
+  """
+  c = np.cos(angle / 2)
+  s = np.sin(angle / 2)
+  x, y, z = _components(axis, 3)
+  return _quat2rot(c, s * x, s * y, s * z)
+
+
+def ned2ecef_matrix_batch(geodetic):
+  """
+  Rotation matrices from NED to ECEF at geodetic coordinates of shape (..., 3).
+  """
+  lat, lon, _ = _components(geodetic, 3)
+  lat = np.radians(lat)
+  lon = np.radians(lon)
+  return _rot_from_components(
+    -np.sin(lat) * np.cos(lon), -np.sin(lon), -np.cos(lat) * np.cos(lon),
+    -np.sin(lat) * np.sin(lon), np.cos(lon), -np.cos(lat) * np.sin(lon),
+    np.cos(lat), 0, -np.sin(lat),
+  )
+
+
+def _euler_in_frame(from_axes, to_axes, euler):
+  """
+  Convert Euler angles (roll, pitch, yaw) in the frame with from_axes to the frame with to_axes. The axes are the rows of
+  arrays of shape (..., 3, 3), in a common frame.
+  """
+  x0, y0, z0 = from_axes[..., 0, :], from_axes[..., 1, :], from_axes[..., 2, :]
+  phi, theta, psi = _components(euler, 3)
+
+  r = axis_angle_to_rot_batch(z0, psi)
+  x1, y1 = _matvec(r, x0), _matvec(r, y0)
+
+  r = axis_angle_to_rot_batch(y1, theta)
+  x2, y2 = _matvec(r, x1), _matvec(r, y1)
+
+  r = axis_angle_to_rot_batch(x2, phi)
+  x3, y3 = _matvec(r, x2), _matvec(r, y2)
+
+  x0, y0, z0 = to_axes[..., 0, :], to_axes[..., 1, :], to_axes[..., 2, :]
+
+  psi_out = np.arctan2(_dot(x3, y0), _dot(x3, x0))
+  theta_out = np.arctan2(-_dot(x3, z0), np.sqrt(_dot(x3, x0)**2 + _dot(x3, y0)**2))
+
+  y2 = _matvec(axis_angle_to_rot_batch(z0, psi_out), y0)
+  z2 = _matvec(axis_angle_to_rot_batch(y2, theta_out), z0)
+
+  phi_out = np.arctan2(_dot(y3, z2), _dot(y3, y2))
+
+  return np.stack(np.broadcast_arrays(phi_out, theta_out, psi_out), axis=-1)
+
+
+def ecef_euler_from_ned_batch(ecef_init, ned_pose):
+  """
+  Convert NED Euler angles (roll, pitch, yaw) of shape (..., 3) at ECEF origins of shape (..., 3)
+  to equivalent ECEF Euler angles.
+  """
+  ned_axes = np.swapaxes(ned2ecef_matrix_batch(ecef2geodetic_batch(ecef_init)), -1, -2)
+  return _euler_in_frame(ned_axes, np.eye(3), ned_pose)
+
+
+def ned_euler_from_ecef_batch(ecef_init, ecef_pose):
+  """
+  Convert ECEF Euler angles (roll, pitch, yaw) of shape (..., 3) at ECEF origins of shape (..., 3)
+  to equivalent NED Euler angles.
+  """
+  ned_axes = np.swapaxes(ned2ecef_matrix_batch(ecef2geodetic_batch(ecef_init)), -1, -2)
+  return _euler_in_frame(np.eye(3), ned_axes, ecef_pose)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import time
+import numpy as np
+
+from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.selfdrive.modeld.modeld import InputQueues
+
+N_FRAMES = 20000
+POLICY_INPUT_SHAPES = {
+  'desire_pulse': (1, 25, ModelConstants.DESIRE_LEN),
+  'features_buffer': (1, 25, ModelConstants.FEATURE_LEN),
+}
+
+
+class ShiftingInputQueues(InputQueues):
+  """The previous InputQueues, which shifts the whole queue on every enqueue"""
+  def reset(self) -> None:
+    self.q = {k: np.zeros(self.shapes[k], dtype=self.dtypes[k]) for k in self.dtypes.keys()}
+
+  def enqueue(self, inputs: dict[str, np.ndarray]) -> None:
+    for k in inputs.keys():
+      input_shape = list(self.shapes[k])
+      input_shape[1] = -1
+      single_input = inputs[k].reshape(tuple(input_shape))
+      sz = single_input.shape[1]
+      self.q[k][:,:-sz] = self.q[k][:,sz:]
+      self.q[k][:,-sz:] = single_input
+
+  def get(self, *names) -> dict[str, np.ndarray]:
+    out = {}
+    for k in names:
+      shape = self.shapes[k]
+      if 'pulse' in k:
+        out[k] = self.q[k].reshape((shape[0], shape[1] * self.model_fps // self.env_fps, self.env_fps // self.model_fps, -1)).max(axis=2)
+      else:
+        idxs = np.arange(-1, -shape[1], -self.env_fps // self.model_fps)[::-1]
+        out[k] = self.q[k][:, idxs]
+    return out
+
+
+def run(queues: InputQueues, features: np.ndarray, desires: np.ndarray) -> tuple[float, dict[str, np.ndarray]]:
+  """CPU time per frame of the policy input handling in ModelState.run"""
+  numpy_inputs = {k: np.zeros(v, dtype=np.float32) for k, v in POLICY_INPUT_SHAPES.items()}
+  for k in numpy_inputs:
+    queues.update_dtypes_and_shapes({k: numpy_inputs[k].dtype}, {k: numpy_inputs[k].shape})
+  queues.reset()
+
+  start_t = time.process_time_ns()
+  for i in range(len(features)):
+    queues.enqueue({'features_buffer': features[i], 'desire_pulse': desires[i]})
+    for k in ['desire_pulse', 'features_buffer']:
+      numpy_inputs[k][:] = queues.get(k)[k]
+  return (time.process_time_ns() - start_t) * 1e-3 / len(features), numpy_inputs
+
+
+if __name__ == '__main__':
+  rng = np.random.default_rng(0)
+  features = rng.standard_normal((N_FRAMES, 1, ModelConstants.FEATURE_LEN), dtype=np.float32)
+  desires = (rng.random((N_FRAMES, ModelConstants.DESIRE_LEN)) > 0.9).astype(np.float32)
+
+  args = (ModelConstants.MODEL_CONTEXT_FREQ, ModelConstants.MODEL_RUN_FREQ, ModelConstants.N_FRAMES)
+  shifting_us, shifting_inputs = run(ShiftingInputQueues(*args), features, desires)
+  ring_us, ring_inputs = run(InputQueues(*args), features, desires)
+  assert all(np.array_equal(shifting_inputs[k], ring_inputs[k]) for k in POLICY_INPUT_SHAPES)
+
+  print(f'{N_FRAMES} frames')
+  print(f'shifting queues: {shifting_us:.2f} us / frame')
+  print(f'ring buffer queues: {ring_us:.2f} us / frame')
+  print(f'saved: {shifting_us - ring_us:.2f} us / frame')
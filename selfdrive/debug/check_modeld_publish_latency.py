@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import argparse
+import pickle
+import time
+from functools import partial
+import numpy as np
+
+from cereal import log, messaging
+from openpilot.selfdrive.modeld.constants import ModelConstants, Plan
+from openpilot.selfdrive.modeld.fill_model_msg import PublishState, fill_model_msg, fill_pose_msg, fill_xyzt
+from openpilot.selfdrive.modeld.modeld import POLICY_METADATA_PATH, VISION_METADATA_PATH
+from openpilot.selfdrive.modeld.parse_model_outputs import Parser
+
+PLAN_FIELDS = [('velocity', Plan.VELOCITY), ('acceleration', Plan.ACCELERATION),
+               ('orientation', Plan.T_FROM_CURRENT_EULER), ('orientationRate', Plan.ORIENTATION_RATE)]
+
+
+def get_outputs(n: int, seed: int = 0) -> list[dict[str, np.ndarray]]:
+  # random raw outputs of the current models, parsed like in modeld
+  outputs = []
+  rng = np.random.default_rng(seed)
+  for path in (VISION_METADATA_PATH, POLICY_METADATA_PATH):
+    with open(path, 'rb') as f:
+      metadata = pickle.load(f)
+    raw = rng.standard_normal((n, metadata['output_shapes']['outputs'][1]), dtype=np.float32)
+    outputs.append([{k: raw[i:i+1, s] for k, s in metadata['output_slices'].items()} for i in range(n)])
+  parser = Parser()
+  return [{**parser.parse_vision_outputs(v), **parser.parse_policy_outputs(p)} for v, p in zip(*outputs, strict=True)]
+
+
+def publish(outputs: dict[str, np.ndarray], publish_state: PublishState, frame_id: int) -> list[bytes]:
+  """What modeld does with the outputs of a frame, up to the serialized messages pm.send gets"""
+  driving_model_data = messaging.new_message('drivingModelData')
+  model_v2 = messaging.new_message('modelV2')
+  camera_odometry = messaging.new_message('cameraOdometry')
+  action = log.ModelDataV2.Action.new_message()
+  fill_model_msg(driving_model_data, model_v2, outputs, action, publish_state, frame_id, frame_id, frame_id, 0., 0, 0.01, True)
+  fill_pose_msg(camera_odometry, outputs, frame_id, 0, 0, True)
+  return [msg.to_bytes() for msg in (driving_model_data, model_v2, camera_odometry)]
+
+
+def plan_by_list(model_v2, outputs: dict[str, np.ndarray]) -> None:
+  """The plan filled one list at a time"""
+  fill_xyzt(model_v2.position, ModelConstants.T_IDXS, *outputs['plan'][0,:,Plan.POSITION].T, *outputs['plan_stds'][0,:,Plan.POSITION].T)
+  for field, plan_slice in PLAN_FIELDS:
+    fill_xyzt(getattr(model_v2, field), ModelConstants.T_IDXS, *outputs['plan'][0,:,plan_slice].T)
+
+
+def plan_by_struct(publish_state: PublishState, model_v2, outputs: dict[str, np.ndarray]) -> None:
+  """The plan copied in as whole structs, like fill_model_msg"""
+  position, position_std = outputs['plan'][0,:,Plan.POSITION].T, outputs['plan_stds'][0,:,Plan.POSITION].T
+  model_v2.position = publish_state.plan_xyzt_std(x=position[0], y=position[1], z=position[2], xStd=position_std[0], yStd=position_std[1], zStd=position_std[2])
+  for field, plan_slice in PLAN_FIELDS:
+    x, y, z = outputs['plan'][0,:,plan_slice].T
+    setattr(model_v2, field, publish_state.plan_xyzt(x=x, y=y, z=z))
+
+
+def time_plan(fill, outputs: list[dict[str, np.ndarray]]) -> tuple[float, list[dict]]:
+  msgs = [messaging.new_message('modelV2') for _ in outputs]
+  st = time.perf_counter()
+  for msg, out in zip(msgs, outputs, strict=True):
+    fill(msg.modelV2, out)
+  return (time.perf_counter() - st) * 1e6 / len(outputs), [msg.modelV2.to_dict() for msg in msgs]
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Time from model outputs to serialized modeld messages on this machine")
+  parser.add_argument("--frames", type=int, default=2000)
+  args = parser.parse_args()
+
+  outputs = get_outputs(args.frames)
+  publish_state = PublishState()
+  latencies = np.empty(args.frames)
+  for i, out in enumerate(outputs):
+    st = time.perf_counter()
+    publish(out, publish_state, i)
+    latencies[i] = time.perf_counter() - st
+  latencies *= 1e6
+
+  by_list_us, by_list = time_plan(plan_by_list, outputs)
+  by_struct_us, by_struct = time_plan(partial(plan_by_struct, PublishState()), outputs)
+
+  print(f'{args.frames} frames')
+  print(f'publish latency: mean {latencies.mean():.1f} us, median {np.median(latencies):.1f} us, max {latencies.max():.1f} us')
+  print(f'plan filled by list: {by_list_us:.1f} us / frame')
+  print(f'plan filled by struct: {by_struct_us:.1f} us / frame')
+  print('plans identical' if by_list == by_struct else 'plans differ')
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+import argparse
+import time
+from collections import defaultdict
+import numpy as np
+
+import cereal.messaging as messaging
+from cereal import car, log
+from openpilot.common.realtime import DT_MDL
+from openpilot.selfdrive.locationd.helpers import NPQueue
+from openpilot.selfdrive.locationd.torqued import POINTS_PER_BUCKET, STEER_BUCKET_BOUNDS, TorqueBuckets, TorqueEstimator
+
+
+class AppendNPQueue(NPQueue):
+  """The previous NPQueue, which grows with np.append and then shifts the whole array on every point"""
+  def __init__(self, maxlen: int, rowsize: int, buf: np.ndarray | None = None) -> None:
+    self.maxlen = maxlen
+    self._arr = np.empty((0, rowsize))
+
+  def __len__(self) -> int:
+    return len(self._arr)
+
+  @property
+  def arr(self) -> np.ndarray:
+    return self._arr
+
+  def append(self, pt: list[float]) -> None:
+    if len(self._arr) < self.maxlen:
+      self._arr = np.append(self._arr, [pt], axis=0)
+    else:
+      self._arr[:-1] = self._arr[1:]
+      self._arr[-1] = pt
+
+
+class AppendTorqueBuckets(TorqueBuckets):
+  """The previous point store: buckets stacked for every fit and points loaded one at a time"""
+  def __init__(self, *args, **kwargs) -> None:
+    super().__init__(*args, **kwargs)
+    self.buckets = {bounds: AppendNPQueue(POINTS_PER_BUCKET, 3) for bounds in self.x_bounds}
+
+  def get_points(self, num_points=None):
+    points = np.vstack([x.arr for x in self.buckets.values()])
+    if num_points is None:
+      return points
+    return points[np.random.choice(np.arange(len(points)), min(len(points), num_points), replace=False)]
+
+  def load_points(self, points) -> None:
+    for point in points:
+      self.add_point(*point)
+
+
+def get_msgs(n_frames: int, seed: int = 0) -> list[tuple[float, str, log.Event]]:
+  """A drive at 20Hz with the lateral control engaged, every livePose adds a point to the buckets"""
+  rng = np.random.default_rng(seed)
+  calib = messaging.new_message('liveCalibration')
+  calib.liveCalibration.calStatus = log.LiveCalibrationData.Status.calibrated
+  calib.liveCalibration.rpyCalib = [0., 0., 0.]
+  msgs = [(0., 'liveCalibration', calib.as_reader())]
+  for i in range(n_frames):
+    t = i * DT_MDL
+    lat_acc = rng.uniform(-1, 1)
+    v_ego = 25.
+
+    cc = messaging.new_message('carControl')
+    cc.carControl.latActive = True
+    co = messaging.new_message('carOutput')
+    co.carOutput.actuatorsOutput.torque = -float(np.clip(0.4 * lat_acc + rng.normal(0, 0.05), -0.49, 0.49))
+    cs = messaging.new_message('carState')
+    cs.carState.vEgo = v_ego
+    lp = messaging.new_message('livePose')
+    lp.livePose.angularVelocityDevice.z = lat_acc / v_ego
+    msgs += [(t, m.which(), m.as_reader()) for m in (cc, co, cs, lp)]
+  return msgs
+
+
+def compare_point_stores(n_points: int) -> None:
+  rng = np.random.default_rng(0)
+  x, y = rng.uniform(-0.5, 0.5, n_points), rng.normal(0, 0.5, n_points)
+  kwargs = dict(x_bounds=STEER_BUCKET_BOUNDS, min_points=[0] * len(STEER_BUCKET_BOUNDS), min_points_total=0, points_per_bucket=POINTS_PER_BUCKET, rowsize=3)
+  for name, store in [('previous', AppendTorqueBuckets(**kwargs)), ('ring buffer', TorqueBuckets(**kwargs))]:
+    st = time.perf_counter()
+    for pt in zip(x, y, strict=True):
+      store.add_point(*pt)
+    add_t = (time.perf_counter() - st) / n_points
+
+    np.random.seed(0)
+    st = time.perf_counter()
+    for _ in range(100):
+      store.get_points(2000)
+    fit_t = (time.perf_counter() - st) / 100
+
+    print(f'{name}: add_point {add_t * 1e6:.1f} us, get_points(2000) {fit_t * 1e6:.1f} us, {len(store)} points')
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Per message cost of torqued with full point buckets on this machine")
+  parser.add_argument("--frames", type=int, default=20000)
+  args = parser.parse_args()
+
+  msgs = get_msgs(args.frames)
+  est = TorqueEstimator(car.CarParams(brand='toyota'))
+  times: dict[str, list[float]] = defaultdict(list)
+  frame = 0
+  for t, which, msg in msgs:
+    st = time.perf_counter()
+    est.handle_log(t, which, getattr(msg, which))
+    times[which].append(time.perf_counter() - st)
+
+    if which == 'livePose':
+      # like torqued, driven by livePose
+      frame += 1
+      if frame % 5 == 0:
+        st = time.perf_counter()
+        est.get_msg(valid=True)
+        times['get_msg'].append(time.perf_counter() - st)
+      if frame % 240 == 0:
+        st = time.perf_counter()
+        cache = est.get_msg(valid=True, with_points=True).to_bytes()
+        times['get_msg with points'].append(time.perf_counter() - st)
+
+  with log.Event.from_bytes(cache) as evt:
+    restored = TorqueBuckets(x_bounds=STEER_BUCKET_BOUNDS, min_points=[0] * len(STEER_BUCKET_BOUNDS), min_points_total=0,
+                             points_per_bucket=POINTS_PER_BUCKET, rowsize=3)
+    st = time.perf_counter()
+    restored.load_points(evt.liveTorqueParameters.points)
+    times['restore points'].append(time.perf_counter() - st)
+
+  print(f'{args.frames} frames, {len(est.filtered_points)} points in the buckets')
+  for name, ts in times.items():
+    print(f'{name}: mean {np.mean(ts) * 1e6:.1f} us, max {np.max(ts) * 1e6:.1f} us, {len(ts)} calls')
+  compare_point_stores(args.frames)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import argparse
+import time
+import numpy as np
+
+import openpilot.common.transformations.coordinates as coord
+import openpilot.common.transformations.orientation as orient
+import openpilot.common.transformations.transformations as tf
+from openpilot.common.transformations.orientation import numpy_wrap
+
+# inputs converted one at a time, like the live processes do
+N_ONE = 1000
+
+
+def get_inputs(n: int, seed: int = 0) -> dict[str, np.ndarray]:
+  rng = np.random.default_rng(seed)
+  eulers = rng.uniform(-np.pi, np.pi, (n, 3))
+  geodetic = np.stack([rng.uniform(-89, 89, n), rng.uniform(-180, 180, n), rng.uniform(-100, 3000, n)], axis=-1)
+  return {
+    'euler': eulers,
+    'quat': orient.euler2quat(eulers),
+    'rot': orient.euler2rot(eulers),
+    'geodetic': geodetic,
+    'ecef': coord.geodetic2ecef(geodetic),
+    'ned': rng.normal(0, 100, (n, 3)),
+  }
+
+
+def get_cases(inputs: dict[str, np.ndarray]) -> list[tuple]:
+  """name, function, the function for one input it replaced, extra leading arguments, input"""
+  origin = inputs['ecef'][0]
+  local = coord.LocalCoord.from_ecef(origin)
+  return [
+    ('euler2quat', orient.euler2quat, tf.euler2quat_single, (), inputs['euler']),
+    ('quat2euler', orient.quat2euler, tf.quat2euler_single, (), inputs['quat']),
+    ('quat2rot', orient.quat2rot, tf.quat2rot_single, (), inputs['quat']),
+    ('rot2quat', orient.rot2quat, tf.rot2quat_single, (), inputs['rot']),
+    ('euler2rot', orient.euler2rot, tf.euler2rot_single, (), inputs['euler']),
+    ('rot2euler', orient.rot2euler, tf.rot2euler_single, (), inputs['rot']),
+    ('geodetic2ecef', coord.geodetic2ecef, tf.geodetic2ecef_single, (), inputs['geodetic']),
+    ('ecef2geodetic', coord.ecef2geodetic, tf.ecef2geodetic_single, (), inputs['ecef']),
+    ('ned_euler_from_ecef', orient.ned_euler_from_ecef, tf.ned_euler_from_ecef_single, (origin,), inputs['euler']),
+    ('ecef_euler_from_ned', orient.ecef_euler_from_ned, tf.ecef_euler_from_ned_single, (origin,), inputs['euler']),
+    ('LocalCoord.ecef2ned', local.ecef2ned, local.ecef2ned_single, (), inputs['ecef']),
+    ('LocalCoord.ned2ecef', local.ned2ecef, local.ned2ecef_single, (), inputs['ned']),
+    ('LocalCoord.geodetic2ned', local.geodetic2ned, local.geodetic2ned_single, (), inputs['geodetic']),
+    ('LocalCoord.ned2geodetic', local.ned2geodetic, local.ned2geodetic_single, (), inputs['ned']),
+  ]
+
+
+def one_by_one(f, extra: tuple, inp: np.ndarray) -> list[np.ndarray]:
+  return [f(*extra, x) for x in inp]
+
+
+def timed(f, *args, runs: int = 1) -> tuple[float, np.ndarray]:
+  """Output of f and its best time over runs, in seconds"""
+  best = float('inf')
+  for _ in range(runs):
+    st = time.perf_counter()
+    out = f(*args)
+    best = min(best, time.perf_counter() - st)
+  return best, out
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Transformations on arrays of inputs and on one input, against calling the single input ones row by row")
+  parser.add_argument("--samples", type=int, default=100000)
+  parser.add_argument("--runs", type=int, default=3)
+  args = parser.parse_args()
+
+  print(f'{args.samples} samples, best of {args.runs} runs')
+  print(f'{"":24s} {"row by row":>12s} {"batched":>12s} {"speedup":>8s} {"max diff":>9s} | {"one input":>10s} {"before":>10s}')
+  for name, batched, single, extra, inp in get_cases(get_inputs(args.samples)):
+    # the previous path: numpy_wrap looping over the rows
+    looped = numpy_wrap(single, inp.shape[1:], batched(*extra, inp[0]).shape)
+    loop_t, expected = timed(looped, *extra, inp, runs=args.runs)
+    batch_t, out = timed(batched, *extra, inp, runs=args.runs)
+
+    n_one = min(N_ONE, len(inp))
+    one_t, _ = timed(one_by_one, batched, extra, inp[:n_one], runs=args.runs)
+    one_loop_t, _ = timed(one_by_one, looped, extra, inp[:n_one], runs=args.runs)
+
+    batch_cols = f'{loop_t * 1e3:10.1f}ms {batch_t * 1e3:10.1f}ms {loop_t / batch_t:7.0f}x {np.max(np.abs(out - expected)):9.1e}'
+    print(f'{name:24s} {batch_cols} | {one_t / n_one * 1e6:8.1f}us {one_loop_t / n_one * 1e6:8.1f}us')
@@ -52,25 +52,47 @@ def rotate_std(rot_matrix, std_in):
 
 
 class NPQueue:
-  def __init__(self, maxlen: int, rowsize: int) -> None:
+  """
+    Rows in a fixed size ring buffer, the oldest row is dropped once it's full. The ring is stored twice, so the rows
+    are always a contiguous view of the buffer, oldest first.
+  """
+  def __init__(self, maxlen: int, rowsize: int, buf: np.ndarray | None = None) -> None:
     self.maxlen = maxlen
-    self.arr = np.empty((0, rowsize))
+    self.buf = np.empty((2 * maxlen, rowsize)) if buf is None else buf
+    self.start = 0
+    self.count = 0
 
   def __len__(self) -> int:
-    return len(self.arr)
+    return self.count
+
+  @property
+  def arr(self) -> np.ndarray:
+    return self.buf[self.start:self.start + self.count]
 
   def append(self, pt: list[float]) -> None:
-    if len(self.arr) < self.maxlen:
-      self.arr = np.append(self.arr, [pt], axis=0)
+    i = (self.start + self.count) % self.maxlen
+    self.buf[i] = self.buf[i + self.maxlen] = pt
+    if self.count < self.maxlen:
+      self.count += 1
     else:
-      self.arr[:-1] = self.arr[1:]
-      self.arr[-1] = pt
+      self.start = (self.start + 1) % self.maxlen
+
+  def extend(self, pts: np.ndarray) -> None:
+    """Appends the rows of pts in order"""
+    kept = pts[-self.maxlen:]
+    idxs = (self.start + self.count + len(pts) - len(kept) + np.arange(len(kept))) % self.maxlen
+    self.buf[idxs] = self.buf[idxs + self.maxlen] = kept
+    end = (self.start + self.count + len(pts)) % self.maxlen
+    self.count = min(self.count + len(pts), self.maxlen)
+    self.start = (end - self.count) % self.maxlen
 
 
 class PointBuckets:
   def __init__(self, x_bounds: list[tuple[float, float]], min_points: list[float], min_points_total: int, points_per_bucket: int, rowsize: int) -> None:
     self.x_bounds = x_bounds
-    self.buckets = {bounds: NPQueue(maxlen=points_per_bucket, rowsize=rowsize) for bounds in x_bounds}
+    # all buckets share one preallocated array, so points are sampled across them without stacking them first
+    self.storage = np.empty((len(x_bounds), 2 * points_per_bucket, rowsize))
+    self.buckets = {bounds: NPQueue(maxlen=points_per_bucket, rowsize=rowsize, buf=buf) for bounds, buf in zip(x_bounds, self.storage, strict=True)}
     self.buckets_min_points = dict(zip(x_bounds, min_points, strict=True))
     self.min_points_total = min_points_total
 
@@ -94,15 +116,26 @@ class PointBuckets:
   def add_point(self, x: float, y: float) -> None:
     raise NotImplementedError
 
+  def add_points(self, x: np.ndarray, y: np.ndarray) -> None:
+    for point in zip(x, y, strict=True):
+      self.add_point(*point)
+
   def get_points(self, num_points: int | None = None) -> Any:
-    points = np.vstack([x.arr for x in self.buckets.values()])
+    """All points, bucket by bucket and oldest first, or num_points of them sampled at random"""
     if num_points is None:
-      return points
-    return points[np.random.choice(np.arange(len(points)), min(len(points), num_points), replace=False)]
+      return np.concatenate([x.arr for x in self.buckets.values()])
+
+    lens = np.array([len(x) for x in self.buckets.values()])
+    ends = np.cumsum(lens)
+    idxs = np.random.choice(np.arange(ends[-1]), min(ends[-1], num_points), replace=False)
+    bucket = np.searchsorted(ends, idxs, side='right')
+    # row of each point in the storage of all buckets
+    offsets = np.array([x.start for x in self.buckets.values()]) - ends + lens + np.arange(len(lens)) * self.storage.shape[1]
+    return np.take(self.storage.reshape(-1, self.storage.shape[2]), idxs + offsets[bucket], axis=0)
 
   def load_points(self, points: list[list[float]]) -> None:
-    for point in points:
-      self.add_point(*point)
+    points = np.array([tuple(point) for point in points], dtype=np.float64).reshape(-1, 2)
+    self.add_points(points[:, 0], points[:, 1])
 
 
 class ParameterEstimator:
@@ -2,7 +2,6 @@
 import os
 import numpy as np
 import capnp
-from collections import deque
 from functools import partial
 
 import cereal.messaging as messaging
@@ -90,28 +89,106 @@ def masked_normalized_cross_correlation(expected_sig: np.ndarray, actual_sig: np
 
 
 class Points:
+  """The last num_points points, in ring buffers stored twice so the window is always a contiguous view, oldest first"""
   def __init__(self, num_points: int):
-    self.times = deque[float]([0.0] * num_points, maxlen=num_points)
-    self.okay = deque[bool]([False] * num_points, maxlen=num_points)
-    self.desired = deque[float]([0.0] * num_points, maxlen=num_points)
-    self.actual = deque[float]([0.0] * num_points, maxlen=num_points)
+    self.window_len = num_points
+    self.start = 0
+    self.times = np.zeros(2 * num_points)
+    self.okay = np.zeros(2 * num_points, dtype=bool)
+    self.desired = np.zeros(2 * num_points)
+    self.actual = np.zeros(2 * num_points)
 
   @property
   def num_points(self):
-    return len(self.desired)
+    return self.window_len
 
   @property
   def num_okay(self):
-    return np.count_nonzero(self.okay)
+    return np.count_nonzero(self.get()[3])
 
   def update(self, t: float, desired: float, actual: float, okay: bool):
-    self.times.append(t)
-    self.okay.append(okay)
-    self.desired.append(desired)
-    self.actual.append(actual)
+    i, j = self.start, self.start + self.window_len
+    self.times[i] = self.times[j] = t
+    self.okay[i] = self.okay[j] = okay
+    self.desired[i] = self.desired[j] = desired
+    self.actual[i] = self.actual[j] = actual
+    self.start = (self.start + 1) % self.window_len
 
   def get(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
-    return np.array(self.times), np.array(self.desired), np.array(self.actual), np.array(self.okay)
+    window = np.s_[self.start:self.start + self.window_len]
+    return self.times[window], self.desired[window], self.actual[window], self.okay[window]
+
+
+# rows of SlidingMaskedCorrelation.buf multiplied together for each of its sums
+PAIR_EXPECTED_ROWS = np.array([0, 0, 1, 1, 0, 2])
+PAIR_ACTUAL_ROWS = np.array([3, 4, 3, 4, 5, 3])
+
+
+class SlidingMaskedCorrelation:
+  """
+  masked_normalized_cross_correlation of the last window_len points at a few lags, in samples. It's made of sums over
+  the pairs of points at each lag, which are updated as points come in and drop out of the window, so the cost of a
+  point is proportional to the number of lags instead of the window length. The sums are redone every window_len points,
+  so rounding errors don't add up.
+  """
+  def __init__(self, window_len: int, lags: np.ndarray):
+    self.window_len = window_len
+    self.lags = lags
+    # mask, masked expected and its square, mask, masked actual and its square of the window, stored twice like Points
+    self.start = 0
+    self.buf = np.zeros((6, 2 * window_len))
+    # index of the expected and actual point of the first pair at each lag
+    self.expected_first = np.maximum(-lags, 0)
+    self.actual_first = np.maximum(lags, 0)
+    self.sums = np.zeros((6, len(lags)))
+    self.since_resum = 0
+
+  def pair_terms(self, expected_idxs: np.ndarray, actual_idxs: np.ndarray) -> np.ndarray:
+    # of the pairs' overlap, masked actual, masked expected, correlation, actual squared and expected squared
+    return self.buf[PAIR_EXPECTED_ROWS[:, None], expected_idxs] * self.buf[PAIR_ACTUAL_ROWS[:, None], actual_idxs]
+
+  def update(self, expected: float, actual: float, okay: bool):
+    # the pairs with the oldest point leave, the pairs with the new one come in
+    removed = self.pair_terms(self.start + self.expected_first, self.start + self.actual_first)
+    self.buf[:, self.start] = self.buf[:, self.start + self.window_len] = \
+      (1.0, expected, expected ** 2, 1.0, actual, actual ** 2) if okay else (0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+    self.start = (self.start + 1) % self.window_len
+    last = self.start + self.window_len - 1
+    self.sums += self.pair_terms(last - self.actual_first, last - self.expected_first) - removed
+
+    self.since_resum += 1
+    if self.since_resum == self.window_len:
+      self.sums = self.window_sums()
+      self.since_resum = 0
+
+  def window_sums(self) -> np.ndarray:
+    window = self.buf[:, self.start:self.start + self.window_len]
+    sums = np.empty_like(self.sums)
+    for i, (e0, a0) in enumerate(zip(self.expected_first, self.actual_first, strict=True)):
+      n = self.window_len - e0 - a0
+      sums[:, i] = np.sum(window[PAIR_EXPECTED_ROWS, e0:e0 + n] * window[PAIR_ACTUAL_ROWS, a0:a0 + n], axis=1)
+    return sums
+
+  def get(self) -> np.ndarray:
+    """The normalized cross correlation at each lag, like masked_normalized_cross_correlation"""
+    eps = np.finfo(np.float64).eps
+    overlap, masked_actual, masked_expected, correlated, actual_squared, expected_squared = self.sums
+
+    number_overlap_masked_samples = np.fmax(np.round(overlap), eps)
+    numerator = correlated - masked_actual * masked_expected / number_overlap_masked_samples
+    actual_sig_denom = np.fmax(actual_squared - masked_actual ** 2 / number_overlap_masked_samples, 0.0)
+    expected_sig_denom = np.fmax(expected_squared - masked_expected ** 2 / number_overlap_masked_samples, 0.0)
+    denom = np.sqrt(actual_sig_denom * expected_sig_denom)
+
+    # zero-out samples with very small denominators, relative to the lags at hand instead of all of them
+    tol = 1e3 * eps * np.max(np.abs(denom), keepdims=True)
+    nonzero_indices = denom > tol
+
+    ncc = np.zeros_like(denom, dtype=np.float64)
+    ncc[nonzero_indices] = numerator[nonzero_indices] / denom[nonzero_indices]
+    np.clip(ncc, -1, 1, out=ncc)
+
+    return ncc
 
 
 class BlockAverage:
@@ -196,6 +273,9 @@ class LateralLagEstimator:
   def reset(self, initial_lag: float, valid_blocks: int):
     window_len = int(self.window_sec / self.dt)
     self.points = Points(window_len)
+    # only lags from 0 to MAX_LAG are considered, with some around them to tell how sharp the peak is
+    lags = np.arange(-CORR_BORDER_OFFSET, int(MAX_LAG / self.dt) + CORR_BORDER_OFFSET)
+    self.correlation = SlidingMaskedCorrelation(window_len, lags)
     self.block_avg = BlockAverage(self.block_count, self.block_size, valid_blocks, initial_lag)
 
   def get_msg(self, valid: bool, debug: bool = False) -> capnp._DynamicStructBuilder:
@@ -286,19 +366,21 @@ class LateralLagEstimator:
            fast and turning and has_recovered and calib_valid and sensors_valid and la_valid
 
     self.points.update(self.t, la_desired, la_actual_pose, okay)
+    self.correlation.update(la_desired, la_actual_pose, okay)
 
   def update_estimate(self):
     if not self.points_enough():
       return
 
-    times, desired, actual, okay = self.points.get()
+    times, _, _, okay = self.points.get()
     # check if there are any new valid data points since the last update
     is_valid = self.points_valid()
     if self.last_estimate_t != 0 and times[0] <= self.last_estimate_t:
-      new_values_start_idx = next(-i for i, t in enumerate(reversed(times)) if t <= self.last_estimate_t)
+      new_values_start_idx = -np.count_nonzero(times > self.last_estimate_t)
       is_valid = is_valid and not (new_values_start_idx == 0 or not np.any(okay[new_values_start_idx:]))
 
-    delay, corr, confidence = self.actuator_delay(desired, actual, okay, self.dt, MAX_LAG)
+    extended_roi_ncc = self.correlation.get()
+    delay, corr, confidence = self.delay_from_ncc(extended_roi_ncc[CORR_BORDER_OFFSET:-CORR_BORDER_OFFSET], extended_roi_ncc, self.dt)
     if corr < self.min_ncc or confidence < self.min_confidence or not is_valid:
       return
 
@@ -316,9 +398,11 @@ class LateralLagEstimator:
     # only consider lags from 0 to max_lag
     roi = np.s_[len(expected_sig) - 1: len(expected_sig) - 1 + max_lag_samples]
     extended_roi = np.s_[roi.start - CORR_BORDER_OFFSET: roi.stop + CORR_BORDER_OFFSET]
-    roi_ncc = ncc[roi]
-    extended_roi_ncc = ncc[extended_roi]
+    return LateralLagEstimator.delay_from_ncc(ncc[roi], ncc[extended_roi], dt)
 
+  @staticmethod
+  def delay_from_ncc(roi_ncc: np.ndarray, extended_roi_ncc: np.ndarray, dt: float) -> tuple[float, float, float]:
+    """Delay, correlation and confidence from the ncc at lags of 0 to max lag samples, and at CORR_BORDER_OFFSET more lags on each side"""
     max_corr_index = np.argmax(roi_ncc)
     corr = roi_ncc[max_corr_index]
     lag = parabolic_peak_interp(roi_ncc, max_corr_index) * dt
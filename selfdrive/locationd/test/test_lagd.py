@@ -5,7 +5,7 @@ import pytest
 
 from cereal import messaging, log, car
 from openpilot.selfdrive.locationd.lagd import LateralLagEstimator, retrieve_initial_lag, masked_normalized_cross_correlation, \
-                                               BLOCK_NUM_NEEDED, BLOCK_SIZE, MIN_OKAY_WINDOW_SEC
+                                               BLOCK_NUM_NEEDED, BLOCK_SIZE, CORR_BORDER_OFFSET, MAX_LAG, MIN_OKAY_WINDOW_SEC
 from openpilot.selfdrive.test.process_replay.migration import migrate, migrate_carParams
 from openpilot.selfdrive.locationd.test.test_locationd_scenarios import TEST_ROUTE
 from openpilot.common.params import Params
@@ -16,8 +16,8 @@ MAX_ERR_FRAMES = 1
 DT = 0.05
 
 
-def process_messages(estimator, lag_frames, n_frames, vego=20.0, rejection_threshold=0.0):
-  for i in range(n_frames):
+def process_messages(estimator, lag_frames, n_frames, vego=20.0, rejection_threshold=0.0, start_frame=0):
+  for i in range(start_frame, start_frame + n_frames):
     t = i * estimator.dt
     desired_la = np.cos(10 * t) * 0.1
     actual_la = np.cos(10 * (t - lag_frames * estimator.dt)) * 0.1
@@ -119,6 +119,35 @@ class TestLagd:
     assert np.allclose(msg.liveDelay.lateralDelayEstimateStd, 0.0, atol=0.01)
     assert msg.liveDelay.calPerc == 100
 
+  @pytest.mark.parametrize("seed", range(10))
+  def test_sliding_correlation(self, seed):
+    random.seed(seed)
+    mocked_CP, lag_frames = car.CarParams(steerActuatorDelay=0.8), random.randint(1, 19)
+    estimator = LateralLagEstimator(mocked_CP, DT, window_sec=10.0, min_recovery_buffer_sec=0.0, min_yr=0.0)
+    window_len = estimator.points.num_points
+    max_lag_samples = int(MAX_LAG / DT)
+    roi = np.s_[window_len - 1:window_len - 1 + max_lag_samples]
+    extended_roi = np.s_[roi.start - CORR_BORDER_OFFSET:roi.stop + CORR_BORDER_OFFSET]
+    delays_checked = 0
+    # over a few windows, so the sums are also checked after being redone
+    for start_frame in range(0, 5 * window_len, 7):
+      process_messages(estimator, lag_frames, 7, rejection_threshold=0.4, start_frame=start_frame)
+      _, desired, actual, okay = estimator.points.get()
+      # padded so the extended roi doesn't wrap around
+      ncc = masked_normalized_cross_correlation(desired, actual, okay, 2 * window_len)
+      extended_roi_ncc = estimator.correlation.get()
+      # lags with only a pair or two of points are zeroed by the small-denominator tolerance, which differs
+      overlap = estimator.correlation.sums[0]
+      np.testing.assert_allclose(extended_roi_ncc[overlap > 2], ncc[extended_roi][overlap > 2], atol=1e-9)
+
+      # rounding picks between tied lags
+      top_two = np.sort(ncc[roi])[-2:]
+      if overlap.min() > 2 and top_two[1] - top_two[0] > 1e-6:
+        delays_checked += 1
+        np.testing.assert_allclose(estimator.delay_from_ncc(extended_roi_ncc[CORR_BORDER_OFFSET:-CORR_BORDER_OFFSET], extended_roi_ncc, DT),
+                                   estimator.delay_from_ncc(ncc[roi], ncc[extended_roi], DT), atol=1e-9)
+    assert delays_checked > 50
+
   @pytest.mark.skipif(PC, reason="only on device")
   def test_estimator_performance(self):
     mocked_CP = car.CarParams(steerActuatorDelay=0.8)
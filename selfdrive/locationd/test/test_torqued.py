@@ -1,5 +1,8 @@
-from cereal import car
-from openpilot.selfdrive.locationd.torqued import TorqueEstimator
+import numpy as np
+from collections import deque
+
+from cereal import car, log
+from openpilot.selfdrive.locationd.torqued import POINTS_PER_BUCKET, TorqueEstimator
 
 
 def test_cal_percent():
@@ -23,3 +26,43 @@ def test_cal_percent():
 
   msg = est.get_msg()
   assert msg.liveTorqueParameters.calPerc == 100
+
+
+def test_point_buckets():
+  rng = np.random.default_rng(0)
+  est = TorqueEstimator(car.CarParams())
+  points = est.filtered_points
+  expected = {bounds: deque(maxlen=POINTS_PER_BUCKET) for bounds in points.buckets}
+  for x, y in zip(rng.uniform(-0.5, 0.5, 20000), rng.normal(size=20000), strict=True):
+    points.add_point(x, y)
+    for (low, high), bucket in expected.items():
+      if low <= x < high:
+        bucket.append([x, 1.0, y])
+
+  all_points = np.concatenate([np.array(bucket) for bucket in expected.values()])
+  assert len(points) == len(all_points)
+  assert np.array_equal(points.get_points(), all_points)
+  # the same sample as picking from the stacked buckets
+  np.random.seed(0)
+  sample = points.get_points(est.fit_points)
+  np.random.seed(0)
+  assert np.array_equal(sample, all_points[np.random.choice(np.arange(len(all_points)), est.fit_points, replace=False)])
+
+
+def test_cached_points():
+  rng = np.random.default_rng(0)
+  est = TorqueEstimator(car.CarParams())
+  est.filtered_points.load_points(np.column_stack([rng.uniform(-0.5, 0.5, 5000), rng.normal(size=5000)]).tolist())
+
+  with log.Event.from_bytes(est.get_msg(with_points=True).to_bytes()) as evt:
+    cached = evt.liveTorqueParameters
+    assert cached.totalBucketPoints == len(est.filtered_points)
+    np.testing.assert_array_equal(np.array([list(p) for p in cached.points]), est.filtered_points.get_points()[:, [0, 2]].astype(np.float32))
+
+    restored = TorqueEstimator(car.CarParams())
+    restored.filtered_points.load_points(cached.points)
+  np.testing.assert_array_equal(restored.filtered_points.get_points(), est.filtered_points.get_points().astype(np.float32))
+
+  est.reset()
+  with log.Event.from_bytes(est.get_msg(with_points=True).to_bytes()) as evt:
+    assert len(evt.liveTorqueParameters.points) == 0
@@ -10,6 +10,7 @@ from openpilot.common.params import Params
 from openpilot.common.realtime import config_realtime_process, DT_MDL
 from openpilot.common.filter_simple import FirstOrderFilter
 from openpilot.common.swaglog import cloudlog
+from openpilot.common.capnp_wire import float_rows_struct
 from openpilot.selfdrive.locationd.helpers import PointBuckets, ParameterEstimator, PoseCalibrator, Pose
 
 HISTORY = 5  # secs
@@ -49,6 +50,11 @@ class TorqueBuckets(PointBuckets):
         self.buckets[(bound_min, bound_max)].append([x, 1.0, y])
         break
 
+  def add_points(self, x, y):
+    for (bound_min, bound_max), bucket in self.buckets.items():
+      in_bucket = (x >= bound_min) & (x < bound_max)
+      bucket.extend(np.column_stack([x[in_bucket], np.ones(np.count_nonzero(in_bucket)), y[in_bucket]]))
+
 
 class TorqueEstimator(ParameterEstimator):
   def __init__(self, CP, decimated=False, track_all_points=False):
@@ -205,6 +211,9 @@ class TorqueEstimator(ParameterEstimator):
   def get_msg(self, valid=True, with_points=False):
     msg = messaging.new_message('liveTorqueParameters')
     msg.valid = valid
+    if with_points:
+      # copied in as a struct with only the points set, before the other fields
+      msg.liveTorqueParameters = float_rows_struct(log.LiveTorqueParametersData, 'points', self.filtered_points.get_points()[:, [0, 2]])
     liveTorqueParameters = msg.liveTorqueParameters
     liveTorqueParameters.version = VERSION
     liveTorqueParameters.useParams = self.use_params
@@ -227,9 +236,6 @@ class TorqueEstimator(ParameterEstimator):
           frictionCoeff = np.clip(frictionCoeff, self.min_friction, self.max_friction)
           self.update_params({'latAccelFactor': latAccelFactor, 'latAccelOffset': latAccelOffset, 'frictionCoefficient': frictionCoeff})
 
-    if with_points:
-      liveTorqueParameters.points = self.filtered_points.get_points()[:, [0, 2]].tolist()
-
     liveTorqueParameters.latAccelFactorFiltered = float(self.filtered_params['latAccelFactor'].x)
     liveTorqueParameters.latAccelOffsetFiltered = float(self.filtered_params['latAccelOffset'].x)
     liveTorqueParameters.frictionCoefficientFiltered = float(self.filtered_params['frictionCoefficient'].x)
@@ -1,7 +1,9 @@
 import os
 import capnp
 import numpy as np
+from functools import cache
 from cereal import log
+from openpilot.common.capnp_wire import FloatListStruct
 from openpilot.selfdrive.modeld.constants import ModelConstants, Plan, Meta
 
 SEND_RAW_PRED = os.getenv('SEND_RAW_PRED')
@@ -9,11 +11,23 @@ SEND_RAW_PRED = os.getenv('SEND_RAW_PRED')
 ConfidenceClass = log.ModelDataV2.ConfidenceClass
 
 
+# times at X_IDXS of edges and lines aren't used
+LINE_T_IDXS: list[float] = []
+
+
 class PublishState:
   def __init__(self):
     self.disengage_buffer = np.zeros(ModelConstants.CONFIDENCE_BUFFER_LEN*ModelConstants.DISENGAGE_WIDTH, dtype=np.float32)
     self.prev_brake_5ms2_probs = np.zeros(ModelConstants.FCW_5MS2_PROBS_WIDTH, dtype=np.float32)
     self.prev_brake_3ms2_probs = np.zeros(ModelConstants.FCW_3MS2_PROBS_WIDTH, dtype=np.float32)
+    plan = {'t': ModelConstants.T_IDXS, **dict.fromkeys(['x', 'y', 'z'], ModelConstants.IDX_N)}
+    self.plan_xyzt = FloatListStruct(log.XYZTData, plan)
+    self.plan_xyzt_std = FloatListStruct(log.XYZTData, {**plan, **dict.fromkeys(['xStd', 'yStd', 'zStd'], ModelConstants.IDX_N)})
+    self.line_xyzt = FloatListStruct(log.XYZTData, {'t': LINE_T_IDXS, 'x': ModelConstants.X_IDXS, 'y': ModelConstants.IDX_N, 'z': ModelConstants.IDX_N})
+    self.lead_xyvat = FloatListStruct(log.ModelDataV2.LeadDataV3, {
+      't': ModelConstants.LEAD_T_IDXS,
+      **dict.fromkeys(['x', 'y', 'v', 'a', 'xStd', 'yStd', 'vStd', 'aStd'], ModelConstants.LEAD_TRAJ_LEN),
+    })
 
 def fill_xyzt(builder, t, x, y, z, x_std=None, y_std=None, z_std=None):
   builder.t = t
@@ -42,9 +56,14 @@ def fill_xyvat(builder, t, x, y, v, a, x_std=None, y_std=None, v_std=None, a_std
   if a_std is not None:
     builder.aStd = a_std.tolist()
 
+@cache
+def poly_fit_matrix(degree: int) -> np.ndarray:
+  """Least squares polynomial fit to values at T_IDXS as a matrix, the coefficients are the product with the values"""
+  return np.polynomial.polynomial.polyfit(ModelConstants.T_IDXS, np.eye(len(ModelConstants.T_IDXS)), deg=degree)
+
 def fill_xyz_poly(builder, degree, x, y, z):
   xyz = np.stack([x, y, z], axis=1)
-  coeffs = np.polynomial.polynomial.polyfit(ModelConstants.T_IDXS, xyz, deg=degree)
+  coeffs = poly_fit_matrix(degree) @ xyz
   builder.xCoefficients = coeffs[:, 0].tolist()
   builder.yCoefficients = coeffs[:, 1].tolist()
   builder.zCoefficients = coeffs[:, 2].tolist()
@@ -83,45 +102,43 @@ def fill_model_msg(base_msg: capnp._DynamicStructBuilder, extended_msg: capnp._D
   modelV2.modelExecutionTime = model_execution_time
 
   # plan
-  fill_xyzt(modelV2.position, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.POSITION].T, *net_output_data['plan_stds'][0,:,Plan.POSITION].T)
-  fill_xyzt(modelV2.velocity, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.VELOCITY].T)
-  fill_xyzt(modelV2.acceleration, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.ACCELERATION].T)
-  fill_xyzt(modelV2.orientation, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.T_FROM_CURRENT_EULER].T)
-  fill_xyzt(modelV2.orientationRate, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.ORIENTATION_RATE].T)
+  plan = net_output_data['plan'][0]
+  position, position_std = plan[:,Plan.POSITION].T, net_output_data['plan_stds'][0,:,Plan.POSITION].T
+  modelV2.position = publish_state.plan_xyzt_std(x=position[0], y=position[1], z=position[2], xStd=position_std[0], yStd=position_std[1], zStd=position_std[2])
+  for field, plan_slice in [('velocity', Plan.VELOCITY), ('acceleration', Plan.ACCELERATION),
+                            ('orientation', Plan.T_FROM_CURRENT_EULER), ('orientationRate', Plan.ORIENTATION_RATE)]:
+    x, y, z = plan[:,plan_slice].T
+    setattr(modelV2, field, publish_state.plan_xyzt(x=x, y=y, z=z))
 
   # poly path
-  fill_xyz_poly(driving_model_data.path, ModelConstants.POLY_PATH_DEGREE, *net_output_data['plan'][0,:,Plan.POSITION].T)
+  fill_xyz_poly(driving_model_data.path, ModelConstants.POLY_PATH_DEGREE, *position)
 
   # action
   modelV2.action = action
 
-  # times at X_IDXS of edges and lines aren't used
-  LINE_T_IDXS: list[float] = []
-
   # lane lines
-  modelV2.init('laneLines', 4)
+  lane_lines = modelV2.init('laneLines', 4)
   for i in range(4):
-    lane_line = modelV2.laneLines[i]
-    fill_xyzt(lane_line, LINE_T_IDXS, np.array(ModelConstants.X_IDXS), net_output_data['lane_lines'][0,i,:,0], net_output_data['lane_lines'][0,i,:,1])
+    lane_lines[i] = publish_state.line_xyzt(y=net_output_data['lane_lines'][0,i,:,0], z=net_output_data['lane_lines'][0,i,:,1])
   modelV2.laneLineStds = net_output_data['lane_lines_stds'][0,:,0,0].tolist()
   modelV2.laneLineProbs = net_output_data['lane_lines_prob'][0,1::2].tolist()
 
   fill_lane_line_meta(driving_model_data.laneLineMeta, modelV2.laneLines, modelV2.laneLineProbs)
 
   # road edges
-  modelV2.init('roadEdges', 2)
+  road_edges = modelV2.init('roadEdges', 2)
   for i in range(2):
-    road_edge = modelV2.roadEdges[i]
-    fill_xyzt(road_edge, LINE_T_IDXS, np.array(ModelConstants.X_IDXS), net_output_data['road_edges'][0,i,:,0], net_output_data['road_edges'][0,i,:,1])
+    road_edges[i] = publish_state.line_xyzt(y=net_output_data['road_edges'][0,i,:,0], z=net_output_data['road_edges'][0,i,:,1])
   modelV2.roadEdgeStds = net_output_data['road_edges_stds'][0,:,0,0].tolist()
 
   # leads
-  modelV2.init('leadsV3', 3)
+  leads = modelV2.init('leadsV3', 3)
   for i in range(3):
-    lead = modelV2.leadsV3[i]
-    fill_xyvat(lead, ModelConstants.LEAD_T_IDXS, *net_output_data['lead'][0,i].T, *net_output_data['lead_stds'][0,i].T)
-    lead.prob = net_output_data['lead_prob'][0,i].tolist()
-    lead.probTime = ModelConstants.LEAD_T_OFFSETS[i]
+    x, y, v, a = net_output_data['lead'][0,i].T
+    x_std, y_std, v_std, a_std = net_output_data['lead_stds'][0,i].T
+    leads[i] = publish_state.lead_xyvat(x=x, y=y, v=v, a=a, xStd=x_std, yStd=y_std, vStd=v_std, aStd=a_std)
+    leads[i].prob = net_output_data['lead_prob'][0,i].item()
+    leads[i].probTime = ModelConstants.LEAD_T_OFFSETS[i]
 
   # meta
   meta = modelV2.meta
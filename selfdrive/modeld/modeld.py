@@ -81,6 +81,10 @@ class FrameMeta:
       self.frame_id, self.timestamp_sof, self.timestamp_eof = vipc.frame_id, vipc.timestamp_sof, vipc.timestamp_eof
 
 class InputQueues:
+  """
+    Queues of the last inputs. Each queue is a ring buffer stored twice back to back, so an enqueue only writes the new
+    inputs and the current contents are always a contiguous view, which the policy inputs are sliced from without copies.
+  """
   def __init__ (self, model_fps, env_fps, n_frames_input):
     assert env_fps % model_fps == 0
     assert env_fps >= model_fps
@@ -90,7 +94,9 @@ class InputQueues:
 
     self.dtypes = {}
     self.shapes = {}
+    self.selectors: dict[str, slice | np.ndarray] = {}
     self.q = {}
+    self.head: dict[str, int] = {}
 
   def update_dtypes_and_shapes(self, input_dtypes, input_shapes) -> None:
     self.dtypes.update(input_dtypes)
@@ -102,12 +108,20 @@ class InputQueues:
         if 'img' in k:
           n_channels = shape[1] // self.n_frames_input
           shape[1] = (self.env_fps // self.model_fps + (self.n_frames_input - 1)) * n_channels
+          # channels of the first and last frame
+          starts = np.linspace(0, shape[1] - n_channels, self.n_frames_input, dtype=int)
+          self.selectors[k] = np.concatenate([np.arange(s, s + n_channels) for s in starts])
         else:
           shape[1] = (self.env_fps // self.model_fps) * shape[1]
+          if 'pulse' not in k:
+            # every model_fps frame up to the latest
+            step = self.env_fps // self.model_fps
+            self.selectors[k] = slice(shape[1] - 1 - (len(range(1, shape[1], step)) - 1) * step, None, step)
         self.shapes[k] = tuple(shape)
 
   def reset(self) -> None:
-    self.q = {k: np.zeros(self.shapes[k], dtype=self.dtypes[k]) for k in self.dtypes.keys()}
+    self.q = {k: np.zeros((self.shapes[k][0], 2 * self.shapes[k][1], *self.shapes[k][2:]), dtype=self.dtypes[k]) for k in self.dtypes.keys()}
+    self.head = dict.fromkeys(self.dtypes.keys(), 0)
 
   def enqueue(self, inputs:dict[str, np.ndarray]) -> None:
     for k in inputs.keys():
@@ -117,25 +131,33 @@ class InputQueues:
       input_shape[1] = -1
       single_input = inputs[k].reshape(tuple(input_shape))
       sz = single_input.shape[1]
-      self.q[k][:,:-sz] = self.q[k][:,sz:]
-      self.q[k][:,-sz:] = single_input
+      n, head = self.shapes[k][1], self.head[k]
+      # the new inputs replace the oldest ones, in both copies of the ring
+      m = min(sz, n - head)
+      self.q[k][:, head:head+m] = self.q[k][:, head+n:head+n+m] = single_input[:, :m]
+      if m < sz:
+        self.q[k][:, :sz-m] = self.q[k][:, n:n+sz-m] = single_input[:, m:]
+      self.head[k] = (head + sz) % n
+
+  def window(self, k: str) -> np.ndarray:
+    """Contents of queue k, oldest first. A view that changes with the next enqueue"""
+    return self.q[k][:, self.head[k]:self.head[k] + self.shapes[k][1]]
 
   def get(self, *names) -> dict[str, np.ndarray]:
+    """Model inputs from the queues, which can be views that change with the next enqueue"""
     if self.env_fps == self.model_fps:
-      return {k: self.q[k] for k in names}
+      return {k: self.window(k) for k in names}
     else:
       out = {}
       for k in names:
         shape = self.shapes[k]
         if 'img' in k:
-          n_channels = shape[1] // (self.env_fps // self.model_fps + (self.n_frames_input - 1))
-          out[k] = np.concatenate([self.q[k][:, s:s+n_channels] for s in np.linspace(0, shape[1] - n_channels, self.n_frames_input, dtype=int)], axis=1)
+          out[k] = self.window(k).take(self.selectors[k], axis=1)
         elif 'pulse' in k:
           # any pulse within interval counts
-          out[k] = self.q[k].reshape((shape[0], shape[1] * self.model_fps // self.env_fps, self.env_fps // self.model_fps, -1)).max(axis=2)
+          out[k] = self.window(k).reshape((shape[0], shape[1] * self.model_fps // self.env_fps, self.env_fps // self.model_fps, -1)).max(axis=2)
         else:
-          idxs = np.arange(-1, -shape[1], -self.env_fps // self.model_fps)[::-1]
-          out[k] = self.q[k][:, idxs]
+          out[k] = self.window(k)[:, self.selectors[k]]
       return out
 
 class ModelState:
@@ -3,10 +3,16 @@ from openpilot.selfdrive.modeld.constants import ModelConstants
 
 def safe_exp(x, out=None):
   # -11 is around 10**14, more causes float16 overflow
-  return np.exp(np.clip(x, -np.inf, 11), out=out)
+  if out is None:
+    return np.exp(np.minimum(x, 11), out=out)
+  np.minimum(x, 11, out=out)
+  return np.exp(out, out=out)
 
 def sigmoid(x):
-  return 1. / (1. + safe_exp(-x))
+  y = np.negative(x)
+  safe_exp(y, out=y)
+  y += 1.
+  return np.divide(1., y, out=y)
 
 def softmax(x, axis=-1):
   x -= np.max(x, axis=axis, keepdims=True)
@@ -52,28 +58,25 @@ class Parser:
     pred_std = safe_exp(raw[:,:,n_values: 2*n_values])
 
     if in_N > 1:
-      weights = np.zeros((raw.shape[0], in_N, out_N), dtype=raw.dtype)
-      for i in range(out_N):
-        weights[:,:,i - out_N] = softmax(raw[:,:,i - out_N], axis=-1)
+      # the weights of each selection are the last out_N values, softmax over the hypotheses
+      weights = softmax(raw[:,:,-out_N:], axis=1).copy()
+      fidxs = np.arange(raw.shape[0])[:,np.newaxis]
 
       if out_N == 1:
-        for fidx in range(weights.shape[0]):
-          idxs = np.argsort(weights[fidx][:,0])[::-1]
-          weights[fidx] = weights[fidx][idxs]
-          pred_mu[fidx] = pred_mu[fidx][idxs]
-          pred_std[fidx] = pred_std[fidx][idxs]
+        # hypotheses by descending weight
+        idxs = np.argsort(weights[:,:,0], axis=1)[:,::-1]
+        weights = weights[fidxs, idxs]
+        pred_mu[:] = pred_mu[fidxs, idxs]
+        pred_std = pred_std[fidxs, idxs]
       full_shape = tuple([raw.shape[0], in_N] + list(out_shape))
       outs[name + '_weights'] = weights
       outs[name + '_hypotheses'] = pred_mu.reshape(full_shape)
       outs[name + '_stds_hypotheses'] = pred_std.reshape(full_shape)
 
-      pred_mu_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
-      pred_std_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
-      for fidx in range(weights.shape[0]):
-        for hidx in range(out_N):
-          idxs = np.argsort(weights[fidx,:,hidx])[::-1]
-          pred_mu_final[fidx, hidx] = pred_mu[fidx, idxs[0]]
-          pred_std_final[fidx, hidx] = pred_std[fidx, idxs[0]]
+      # most likely hypothesis of each selection, sorted rather than argmax to break ties the same way
+      best = np.argsort(weights, axis=1)[:,-1]
+      pred_mu_final = pred_mu[fidxs, best]
+      pred_std_final = pred_std[fidxs, best]
     else:
       pred_mu_final = pred_mu
       pred_std_final = pred_std
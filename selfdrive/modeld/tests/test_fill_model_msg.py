@@ -0,0 +1,57 @@
+import numpy as np
+
+from cereal import log
+from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.selfdrive.modeld.fill_model_msg import PublishState, fill_xyvat, fill_xyz_poly, fill_xyzt
+
+
+class TestFillModelMsg:
+  def test_float_list_struct_matches_lists(self):
+    state = PublishState()
+    rng = np.random.default_rng(0)
+    for _ in range(3):
+      x, y, z, x_std, y_std, z_std = rng.standard_normal((6, ModelConstants.IDX_N), dtype=np.float32)
+      expected = log.XYZTData.new_message()
+      fill_xyzt(expected, ModelConstants.T_IDXS, x, y, z, x_std, y_std, z_std)
+      assert state.plan_xyzt_std(x=x, y=y, z=z, xStd=x_std, yStd=y_std, zStd=z_std).to_dict() == expected.to_dict()
+
+      # an empty list isn't null, it's still in the message
+      expected = log.XYZTData.new_message()
+      fill_xyzt(expected, [], np.array(ModelConstants.X_IDXS), y, z)
+      line = state.line_xyzt(y=y, z=z)
+      assert line.to_dict() == expected.to_dict()
+      assert line.to_dict()['t'] == []
+
+      lead = rng.standard_normal((8, ModelConstants.LEAD_TRAJ_LEN), dtype=np.float32)
+      expected = log.ModelDataV2.LeadDataV3.new_message()
+      fill_xyvat(expected, ModelConstants.LEAD_T_IDXS, *lead)
+      assert state.lead_xyvat(**dict(zip(['x', 'y', 'v', 'a', 'xStd', 'yStd', 'vStd', 'aStd'], lead, strict=True))).to_dict() == expected.to_dict()
+
+  def test_float_list_struct_in_message(self):
+    state = PublishState()
+    model_v2 = log.ModelDataV2.new_message()
+    lines = model_v2.init('laneLines', 2)
+    ys = np.arange(2 * ModelConstants.IDX_N, dtype=np.float32).reshape(2, -1)
+    for i in range(2):
+      lines[i] = state.line_xyzt(y=ys[i], z=-ys[i])
+    # the struct is copied into the message, the next one doesn't change it
+    assert [list(line.y) for line in model_v2.laneLines] == ys.tolist()
+    assert list(model_v2.laneLines[0].z) == (-ys[0]).tolist()
+
+  def test_publish_states_independent(self):
+    # each modeld (or offline caller) has its own buffers, and a struct stays valid after the next call
+    ys = np.arange(2 * ModelConstants.IDX_N, dtype=np.float32).reshape(2, -1)
+    s1, s2 = PublishState(), PublishState()
+    line = s1.line_xyzt(y=ys[0], z=ys[0])
+    other = s2.line_xyzt(y=ys[1], z=ys[1])
+    s1.line_xyzt(y=ys[1], z=ys[1])
+    assert list(line.y) == ys[0].tolist()
+    assert list(other.y) == ys[1].tolist()
+
+  def test_poly_fit(self):
+    rng = np.random.default_rng(0)
+    xyz = rng.standard_normal((3, ModelConstants.IDX_N), dtype=np.float32)
+    path = log.DrivingModelData.PolyPath.new_message()
+    fill_xyz_poly(path, ModelConstants.POLY_PATH_DEGREE, *xyz)
+    expected = np.polynomial.polynomial.polyfit(ModelConstants.T_IDXS, xyz.T, deg=ModelConstants.POLY_PATH_DEGREE)
+    np.testing.assert_allclose(np.array([path.xCoefficients, path.yCoefficients, path.zCoefficients]), expected.T.astype(np.float32), rtol=1e-6, atol=1e-6)
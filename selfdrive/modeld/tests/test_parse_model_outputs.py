@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.selfdrive.modeld.parse_model_outputs import Parser, safe_exp, sigmoid, softmax
+
+
+def ref_safe_exp(x):
+  return np.exp(np.clip(x, -np.inf, 11))
+
+
+class LoopParser(Parser):
+  """parse_mdn with a loop per frame and hypothesis, what the vectorized one has to match bit for bit"""
+  def parse_mdn(self, name, outs, in_N=0, out_N=1, out_shape=None):
+    if self.check_missing(outs, name):
+      return
+    raw = outs[name]
+    raw = raw.reshape((raw.shape[0], max(in_N, 1), -1))
+
+    n_values = (raw.shape[2] - out_N)//2
+    pred_mu = raw[:,:,:n_values]
+    pred_std = ref_safe_exp(raw[:,:,n_values: 2*n_values])
+
+    if in_N > 1:
+      weights = np.zeros((raw.shape[0], in_N, out_N), dtype=raw.dtype)
+      for i in range(out_N):
+        weights[:,:,i - out_N] = softmax(raw[:,:,i - out_N], axis=-1)
+
+      if out_N == 1:
+        for fidx in range(weights.shape[0]):
+          idxs = np.argsort(weights[fidx][:,0])[::-1]
+          weights[fidx] = weights[fidx][idxs]
+          pred_mu[fidx] = pred_mu[fidx][idxs]
+          pred_std[fidx] = pred_std[fidx][idxs]
+      full_shape = tuple([raw.shape[0], in_N] + list(out_shape))
+      outs[name + '_weights'] = weights
+      outs[name + '_hypotheses'] = pred_mu.reshape(full_shape)
+      outs[name + '_stds_hypotheses'] = pred_std.reshape(full_shape)
+
+      pred_mu_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
+      pred_std_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
+      for fidx in range(weights.shape[0]):
+        for hidx in range(out_N):
+          idxs = np.argsort(weights[fidx,:,hidx])[::-1]
+          pred_mu_final[fidx, hidx] = pred_mu[fidx, idxs[0]]
+          pred_std_final[fidx, hidx] = pred_std[fidx, idxs[0]]
+    else:
+      pred_mu_final = pred_mu
+      pred_std_final = pred_std
+
+    if out_N > 1:
+      final_shape = tuple([raw.shape[0], out_N] + list(out_shape))
+    else:
+      final_shape = tuple([raw.shape[0],] + list(out_shape))
+    outs[name] = pred_mu_final.reshape(final_shape)
+    outs[name + '_stds'] = pred_std_final.reshape(final_shape)
+
+
+MC = ModelConstants
+MDN_HEADS = [
+  # in_N, out_N, out_shape
+  (0, 0, (MC.NUM_LANE_LINES, MC.IDX_N, MC.LANE_LINES_WIDTH)),
+  (MC.PLAN_MHP_N, MC.PLAN_MHP_SELECTION, (MC.IDX_N, MC.PLAN_WIDTH)),
+  (MC.LEAD_MHP_N, MC.LEAD_MHP_SELECTION, (MC.LEAD_TRAJ_LEN, MC.LEAD_WIDTH)),
+]
+
+
+class TestParseModelOutputs:
+  @pytest.mark.parametrize("in_N, out_N, out_shape", MDN_HEADS)
+  @pytest.mark.parametrize("batch", [1, 4])
+  def test_parse_mdn(self, in_N, out_N, out_shape, batch):
+    rng = np.random.default_rng(0)
+    size = max(in_N, 1) * (2 * int(np.prod(out_shape)) + out_N)
+    for scale in [0.1, 3., 300.]:
+      raw = (rng.standard_normal((batch, size)) * scale).astype(np.float32)
+      if in_N > 1 and scale == 3.:
+        # tied weights
+        raw.reshape(batch, in_N, -1)[:, :, -out_N:] = 0.5
+
+      outs, ref_outs = {'x': raw.copy()}, {'x': raw.copy()}
+      Parser().parse_mdn('x', outs, in_N, out_N, out_shape)
+      LoopParser().parse_mdn('x', ref_outs, in_N, out_N, out_shape)
+      assert outs.keys() == ref_outs.keys()
+      for k in outs:
+        assert outs[k].shape == ref_outs[k].shape and outs[k].tobytes() == ref_outs[k].tobytes(), k
+
+  def test_activations(self):
+    x = np.random.default_rng(0).standard_normal(101).astype(np.float32)[::3] * 30
+    assert safe_exp(x).tobytes() == ref_safe_exp(x).tobytes()
+    out = np.empty_like(x)
+    assert safe_exp(x, out=out) is out and out.tobytes() == ref_safe_exp(x).tobytes()
+    assert sigmoid(x).tobytes() == (1. / (1. + ref_safe_exp(-x))).tobytes()
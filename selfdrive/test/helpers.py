@@ -118,9 +118,9 @@ def read_segment_list(segment_list_path):
 
 
 @contextlib.contextmanager
-def http_server_context(handler, setup=None):
+def http_server_context(handler, setup=None, server_class=http.server.HTTPServer):
   host = '127.0.0.1'
-  server = http.server.HTTPServer((host, 0), handler)
+  server = server_class((host, 0), handler)
   port = server.server_port
   t = threading.Thread(target=server.serve_forever)
   t.start()
@@ -3,8 +3,11 @@ import sys
 import math
 import capnp
 import numbers
-from collections import Counter
+import numpy as np
+from collections import Counter, defaultdict
+from typing import NamedTuple
 
+from openpilot.common.capnp_wire import decode_struct_pointers
 from openpilot.tools.lib.logreader import LogReader
 
 EPSILON = sys.float_info.epsilon
@@ -13,6 +16,12 @@ _DynamicStructReader = capnp.lib.capnp._DynamicStructReader
 _DynamicListReader = capnp.lib.capnp._DynamicListReader
 _DynamicEnum = capnp.lib.capnp._DynamicEnum
 
+NO_DISCRIMINANT = 0xFFFF
+SLOT_BITS = {
+  'bool': 1, 'int8': 8, 'uint8': 8, 'int16': 16, 'uint16': 16,
+  'int32': 32, 'uint32': 32, 'float32': 32, 'int64': 64, 'uint64': 64, 'float64': 64,
+}
+
 
 def remove_ignored_fields(msg, ignore):
   msg = msg.as_builder()
@@ -42,6 +51,108 @@ def remove_ignored_fields(msg, ignore):
   return msg
 
 
+class _FieldMask(NamedTuple):
+  """Location of an ignored scalar field in a serialized message"""
+  pointers: tuple[int, ...]  # pointer indices to follow from the root struct
+  byte_offset: int  # in the data section of the last struct
+  size: int  # bytes
+  bits: int  # bits of each byte to clear
+
+
+def _compile_field_mask(schema, which, keys):
+  """
+    The mask of an ignored field for messages of type which, None if it can't be masked in the serialized message
+    (list indices, lists, nested unions or groups along the path) and the message needs the detailed comparison.
+  """
+  pointers = []
+  for i, k in enumerate(keys):
+    if k.isdigit() or k not in schema.fieldnames:
+      return None
+
+    proto = schema.fields[k].proto
+    if proto.which() != 'slot':
+      return None
+    # only the message union of the Event is known to be set
+    if proto.discriminantValue != NO_DISCRIMINANT and not (i == 0 and k == which):
+      return None
+
+    slot_type = proto.slot.type.which()
+    if i < len(keys) - 1:
+      if slot_type != 'struct':
+        return None
+      pointers.append(proto.slot.offset)
+      schema = schema.fields[k].schema
+    elif slot_type in SLOT_BITS:
+      bits = SLOT_BITS[slot_type]
+      if bits == 1:
+        return _FieldMask(tuple(pointers), proto.slot.offset // 8, 1, 1 << (proto.slot.offset % 8))
+      return _FieldMask(tuple(pointers), proto.slot.offset * bits // 8, bits // 8, 0xFF)
+  return None
+
+
+def _compile_plan(schema, which, ignore_fields):
+  """Masks of the ignored fields that apply to messages of type which, None if any of them can't be masked"""
+  plan = []
+  for key in ignore_fields:
+    keys = key.split(".")
+    if which != keys[0] and len(keys) > 1:
+      continue
+
+    mask = _compile_field_mask(schema, which, keys)
+    if mask is None:
+      return None
+    plan.append(mask)
+  return plan
+
+
+def _serialize(log):
+  """Concatenated single segment serializations of the messages and their start offsets"""
+  # sized first segment, so even large messages don't need far pointers
+  dat = [m.as_builder(num_first_segment_words=m.total_size.word_count + 1).to_bytes() for m in log]
+  sizes = np.array([len(d) for d in dat], dtype=np.int64)
+  starts = np.zeros(len(dat), dtype=np.int64)
+  np.cumsum(sizes[:-1], out=starts[1:])
+  return np.frombuffer(b"".join(dat), dtype=np.uint8).copy(), starts, sizes
+
+
+def _follow_struct_pointers(words, pos, roots, ends, valid):
+  """
+    Decodes the struct pointers at word positions pos of the messages spanning words roots to ends. Returns the data
+    section starts, the section sizes in words and whether the pointers are set. Anything unexpected isn't valid.
+  """
+  w = words[np.clip(pos, roots, ends - 1)]
+  present = w != 0
+  offset, data_words, ptr_words = decode_struct_pointers(w)
+  struct_start = pos + 1 + offset
+
+  # only struct pointers to within the message
+  valid &= ~present | (((w & np.uint64(3)) == 0) & (struct_start > roots) & (struct_start + data_words + ptr_words <= ends))
+  return struct_start, data_words, ptr_words, present
+
+
+def _apply_masks(buf, starts, sizes, plan, valid):
+  """Clears the ignored fields of the messages at starts in place, messages that can't be masked are marked not valid"""
+  words = buf.view(np.uint64)
+  # words of the segment table, the root pointer and the end of each message
+  table, ends = starts // 8, (starts + sizes) // 8
+  roots = table + 1
+  # single segment messages only
+  valid &= (words[table] & np.uint64(0xFFFFFFFF)) == 0
+  for mask in plan:
+    struct_start, data_words, ptr_words, present = _follow_struct_pointers(words, roots, roots, ends, valid)
+    for p in mask.pointers:
+      present &= p < ptr_words
+      pos = np.where(present, struct_start + data_words + p, roots)
+      struct_start, data_words, ptr_words, ptr_present = _follow_struct_pointers(words, pos, roots, ends, valid)
+      present &= ptr_present
+
+    # fields past the data section were written with an older schema and aren't set
+    present &= valid & (mask.byte_offset + mask.size <= data_words * 8)
+    field_starts = struct_start[present] * 8 + mask.byte_offset
+    for i in range(mask.size):
+      buf[field_starts + i] &= ~np.uint8(mask.bits)
+
+
 def _diff_capnp(r1, r2, path, tolerance):
   """Walk two capnp struct readers and yield (action, dotted_path, value) diffs.
 
@@ -114,13 +225,43 @@ def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=Non
     cnt2 = Counter(m.which() for m in log2)
     raise Exception(f"logs are not same length: {len(log1)} VS {len(log2)}\n\t\t{cnt1}\n\t\t{cnt2}")
 
-  diff = []
-  for msg1, msg2 in zip(log1, log2, strict=True):
-    if msg1.which() != msg2.which():
+  types = defaultdict(list)
+  for i, (msg1, msg2) in enumerate(zip(log1, log2, strict=True)):
+    which = msg1.which()
+    if which != msg2.which():
       raise Exception("msgs not aligned between logs")
+    types[which].append(i)
+
+  if not len(log1):
+    return []
+
+  # Compare the serialized messages in bulk with the ignored fields cleared in place. Only messages
+  # that differ, or whose ignored fields can't be cleared, need the detailed field by field diff.
+  (buf1, starts1, sizes1), (buf2, starts2, sizes2) = _serialize(log1), _serialize(log2)
+  valid = np.ones(len(log1), dtype=bool)
+  schema = log1[0].schema
+  for which, idxs in types.items():
+    idxs = np.array(idxs)
+    plan = _compile_plan(schema, which, ignore_fields)
+    if plan is None:
+      valid[idxs] = False
+      continue
+
+    for buf, starts, sizes in ((buf1, starts1, sizes1), (buf2, starts2, sizes2)):
+      type_valid = valid[idxs]
+      _apply_masks(buf, starts[idxs], sizes[idxs], plan, type_valid)
+      valid[idxs] = type_valid
 
-    msg1 = remove_ignored_fields(msg1, ignore_fields)
-    msg2 = remove_ignored_fields(msg2, ignore_fields)
+  if np.array_equal(sizes1, sizes2):
+    equal = ~np.logical_or.reduceat(buf1 != buf2, starts1)
+  else:
+    dat1, dat2 = buf1.tobytes(), buf2.tobytes()
+    equal = np.array([dat1[s1:s1 + n1] == dat2[s2:s2 + n2] for s1, n1, s2, n2 in zip(starts1, sizes1, starts2, sizes2, strict=True)])
+
+  diff = []
+  for i in np.flatnonzero(~(equal & valid)):
+    msg1 = remove_ignored_fields(log1[i], ignore_fields)
+    msg2 = remove_ignored_fields(log2[i], ignore_fields)
 
     if msg1.to_bytes() != msg2.to_bytes():
       dd = list(_diff_capnp(msg1.as_reader(), msg2.as_reader(), (), tolerance))
@@ -0,0 +1,119 @@
+import queue
+import threading
+import weakref
+from collections.abc import Iterable
+from typing import Any
+
+import numpy as np
+
+from openpilot.system.camerad.cameras.nv12_info import get_nv12_info
+
+# frames laid out ahead of the replay per camera, each buffer is a full VisionIPC frame
+PREFETCH_FRAMES = 8
+
+# frame readers aren't thread safe, readers shared by feeders of different processes take turns
+_reader_locks: weakref.WeakKeyDictionary[Any, threading.Lock] = weakref.WeakKeyDictionary()
+_reader_locks_lock = threading.Lock()
+
+
+def _reader_lock(fr) -> threading.Lock:
+  with _reader_locks_lock:
+    return _reader_locks.setdefault(fr, threading.Lock())
+
+
+class NV12Layout:
+  """The stride padded NV12 layout of camerad's VisionIPC buffers for a w x h frame"""
+  def __init__(self, w: int, h: int):
+    self.w, self.h = w, h
+    self.stride, y_height, _, self.size = get_nv12_info(w, h)
+    self.uv_offset = self.stride * y_height
+
+  def new_buffer(self) -> np.ndarray:
+    return np.zeros(self.size, dtype=np.uint8)
+
+  def fill(self, buf: np.ndarray, frame: np.ndarray) -> np.ndarray:
+    """Copies a packed NV12 frame into buf. The padding is never written, so it stays zero"""
+    w, h, stride = self.w, self.h, self.stride
+    buf[:stride * h].reshape(h, stride)[:, :w] = frame[:w * h].reshape(h, w)
+    buf[self.uv_offset:self.uv_offset + stride * (h // 2)].reshape(h // 2, stride)[:, :w] = frame[w * h:].reshape(h // 2, w)
+    return buf
+
+
+class _CameraFeeder:
+  def __init__(self, fr, frame_ids: list[int], pool_size: int):
+    self.fr = fr
+    self.lock = _reader_lock(fr)
+    self.layout = NV12Layout(fr.w, fr.h)
+    self.frame_ids = frame_ids
+    # one buffer is held by the consumer, the rest are queued up or being filled
+    self.free: queue.SimpleQueue[np.ndarray | None] = queue.SimpleQueue()
+    for _ in range(pool_size):
+      self.free.put(self.layout.new_buffer())
+    self.ready: queue.SimpleQueue[tuple[int, np.ndarray | None, BaseException | None]] = queue.SimpleQueue()
+    self.current: np.ndarray = self.layout.new_buffer()
+    self.done = False
+    self.stopped = threading.Event()
+    self.thread = threading.Thread(target=self._run, name="frame feeder", daemon=True)
+    self.thread.start()
+
+  def _read(self, buf: np.ndarray, frame_id: int) -> np.ndarray:
+    with self.lock:
+      frame = self.fr.get(frame_id)
+    return self.layout.fill(buf, frame)
+
+  def _run(self) -> None:
+    for frame_id in self.frame_ids:
+      buf = self.free.get()
+      if buf is None or self.stopped.is_set():
+        return
+      try:
+        self.ready.put((frame_id, self._read(buf, frame_id), None))
+      except BaseException as e:
+        self.ready.put((frame_id, None, e))
+        return
+    self.ready.put((-1, None, None))
+
+  def get(self, frame_id: int) -> np.ndarray:
+    # frames are requested in the order they were prefetched, each request takes the next one
+    if not self.done:
+      fid, buf, err = self.ready.get()
+      if err is not None:
+        self.done = True
+        raise err
+      if buf is None:
+        self.done = True
+      else:
+        self.free.put(self.current)
+        self.current = buf
+        if fid == frame_id:
+          return buf
+
+    # not prefetched, the frames were requested out of log order
+    return self._read(self.current, frame_id)
+
+  def stop(self) -> None:
+    self.stopped.set()
+    self.free.put(None)
+    self.thread.join()
+
+
+class FrameFeeder:
+  """
+    Camera frames in VisionIPC layout, ready to be sent. Frames are read in log order by a background thread per camera
+    and copied once into a pool of preallocated buffers, so the replay doesn't wait for decoding or repacking.
+  """
+  def __init__(self, frs: dict[str, Any], msgs: Iterable, camera_states: Iterable[str], pool_size: int = PREFETCH_FRAMES):
+    camera_states = list(camera_states)
+    frame_ids: dict[str, list[int]] = {cs: [] for cs in camera_states}
+    for msg in msgs:
+      if (cs := msg.which()) in frame_ids:
+        frame_ids[cs].append(getattr(msg, cs).frameId)
+    self.cameras = {cs: _CameraFeeder(frs[cs], frame_ids[cs], pool_size) for cs in camera_states}
+
+  def get(self, camera_state: str, frame_id: int) -> np.ndarray:
+    """Frame frame_id of camera_state. The buffer is reused once the next frame of this camera is requested"""
+    return self.cameras[camera_state].get(frame_id)
+
+  def stop(self) -> None:
+    for camera in self.cameras.values():
+      camera.stop()
@@ -1,8 +1,9 @@
-from collections import defaultdict
-from collections.abc import Callable
-from typing import cast
+from collections import defaultdict, deque
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any, cast
 import capnp
 import functools
+import heapq
 import traceback
 
 from cereal import messaging, car, log
@@ -18,18 +19,29 @@ from openpilot.selfdrive.controls.lib.longitudinal_planner import get_accel_from
 from openpilot.system.manager.process_config import managed_processes
 from openpilot.tools.lib.logreader import LogIterable
 
-MessageWithIndex = tuple[int, capnp.lib.capnp._DynamicStructReader]
-MigrationOps = tuple[list[tuple[int, capnp.lib.capnp._DynamicStructReader]], list[capnp.lib.capnp._DynamicStructReader], list[int]]
-MigrationFunc = Callable[[list[MessageWithIndex]], MigrationOps]
+Message = capnp.lib.capnp._DynamicStructReader
+# (replacement or None to keep the message, added messages, whether to delete the message)
+MigrationResult = tuple[Message | None, list[Message], bool]
+MigrationFunc = Callable[[Message, 'MigrationContext'], MigrationResult]
+
+# messages are migrated once the log has been read this far (in ns of logMonoTime) past them.
+# carParams is logged every 50 seconds, so it's always known to migrations that need it
+MIGRATION_LOOKAHEAD = 60 * 10**9
 
 
 # rules for migration functions
 # 1. must use the decorator @migration(inputs=[...], product="...") and MigrationFunc signature
-# 2. it only gets the messages that are in the inputs list
+# 2. it's called for each message of the inputs types in log order, and returns what to do with it (replace, add, delete)
 # 3. product is the message type created by the migration function, and the function will be skipped if product type already exists in lr
-# 4. it must return a list of operations to be applied to the logreader (replace, add, delete)
+# 4. anything else it needs from the log comes from the context: the first message of a type, the messages in the lookahead,
+#    state kept across messages, and messages of other types passed to an observer as they're read
 # 5. all migration functions must be independent of each other
 def migrate_all(lr: LogIterable, manager_states: bool = False, panda_states: bool = False, camera_states: bool = False):
+  return list(migrate_all_stream(lr, manager_states, panda_states, camera_states, lookahead=None))
+
+
+def migrate_all_stream(lr: LogIterable, manager_states: bool = False, panda_states: bool = False, camera_states: bool = False,
+                       lookahead: int | None = MIGRATION_LOOKAHEAD) -> Iterator[Message]:
   migrations = [
     migrate_sensorEvents,
     migrate_carParams,
@@ -53,37 +65,122 @@ def migrate_all(lr: LogIterable, manager_states: bool = False, panda_states: boo
   if camera_states:
     migrations.append(migrate_cameraStates)
 
-  return migrate(lr, migrations)
+  return migrate_stream(lr, migrations, lookahead)
 
 
 def migrate(lr: LogIterable, migration_funcs: list[MigrationFunc]):
-  lr = list(lr)
-  grouped = defaultdict(list)
-  for i, msg in enumerate(lr):
-    grouped[msg.which()].append(i)
+  return list(migrate_stream(lr, migration_funcs, lookahead=None))
+
+
+class MigrationContext:
+  """What a migration function knows about the log besides the message it's migrating"""
+
+  def __init__(self, first: dict[str, Message], ahead: dict[str, deque[Message]]):
+    self._first = first
+    self._ahead = ahead
+    self.state: dict[str, Any] = {}
+
+  def first(self, which: str) -> Message | None:
+    """The first message of type which read so far"""
+    return self._first.get(which)
 
-  replace_ops, add_ops, del_ops = [], [], []
+  def ahead(self, which: str) -> Iterable[Message]:
+    """The messages of type which in the lookahead, after the one being migrated"""
+    return self._ahead.get(which, ())
+
+
+def migrate_stream(lr: LogIterable, migration_funcs: list[MigrationFunc], lookahead: int | None = MIGRATION_LOOKAHEAD) -> Iterator[Message]:
+  """
+    Migrates the log in a single pass and yields the messages sorted by logMonoTime. Only lookahead ns of the log are
+    held in memory, decisions about the whole log (e.g. whether a product already exists) are made on its first lookahead ns.
+    The log has to be sorted within the lookahead, a message older than one already yielded raises an AssertionError.
+    With lookahead None, the whole log is read first.
+  """
   for migration in migration_funcs:
     assert hasattr(migration, "inputs") and hasattr(migration, "product"), "Migration functions must use @migration decorator"
-    if migration.product in grouped: # skip if product already exists
-      continue
-
-    sorted_indices = sorted(ii for i in cast(list[str], migration.inputs) for ii in grouped.get(i, []))
-    msg_gen = [(i, lr[i]) for i in sorted_indices]
-    r_ops, a_ops, d_ops = migration(msg_gen)
-    replace_ops.extend(r_ops)
-    add_ops.extend(a_ops)
-    del_ops.extend(d_ops)
 
-  for index, msg in replace_ops:
-    lr[index] = msg
-  for index in sorted(del_ops, reverse=True):
-    del lr[index]
-  for msg in add_ops:
-    lr.append(msg)
-  lr = sorted(lr, key=lambda x: x.logMonoTime)
+  msgs = iter(lr)
+  # (logMonoTime, type, message) of the messages read but not migrated yet, in read order
+  window: deque[tuple[int, str, Message]] = deque()
+  # (logMonoTime, read order) of the oldest messages in the window, oldest first
+  window_min: deque[tuple[int, int]] = deque()
+  first: dict[str, Message] = {}
+  ahead: defaultdict[str, deque[Message]] = defaultdict(deque)
+  contexts = {migration: MigrationContext(first, ahead) for migration in migration_funcs}
+  observers = defaultdict(list)
+  for migration in migration_funcs:
+    for which in migration.observes:
+      observers[which].append(migration)
+
+  newest = 0
+  read_count = 0
+  # logMonoTime of the last message yielded
+  last_yielded = 0
+
+  def fill():
+    nonlocal newest, read_count
+    for msg in msgs:
+      t, which = msg.logMonoTime, msg.which()
+      assert t >= last_yielded, f"log is out of order by more than the lookahead: {which} at {t} after {last_yielded}"
+      first.setdefault(which, msg)
+      window.append((t, which, msg))
+      ahead[which].append(msg)
+      newest = max(newest, t)
+      while window_min and window_min[-1][0] >= t:
+        window_min.pop()
+      window_min.append((t, read_count))
+      read_count += 1
+      for migration in observers.get(which, []):
+        migration.observe(msg, contexts[migration])
+
+      if lookahead is not None and newest >= window[0][0] + lookahead:
+        break
+
+  fill()
+  by_input = defaultdict(list)
+  for i, migration in enumerate(migration_funcs):
+    if migration.product in first:  # skip if product already exists
+      continue
+    for which in cast(list[str], migration.inputs):
+      by_input[which].append((i, migration))
+
+  # migrated messages waiting to be yielded in (logMonoTime, added, migration, read order) order,
+  # which is a stable sort of the kept messages followed by the added messages
+  pending: list[tuple[int, int, int, int, Message]] = []
+  count = 0
+  migrated_count = 0
+  while window:
+    t, which, msg = window.popleft()
+    ahead[which].popleft()
+    if window_min[0][1] == migrated_count:
+      window_min.popleft()
+    migrated_count += 1
+
+    new_msg, delete = None, False
+    for i, migration in by_input.get(which, []):
+      replacement, added, deleted = migration(msg, contexts[migration])
+      new_msg = new_msg if replacement is None else replacement
+      delete |= deleted
+      for added_msg in added:
+        heapq.heappush(pending, (added_msg.logMonoTime, 1, i, count, added_msg))
+        count += 1
+    if not delete:
+      heapq.heappush(pending, (t, 0, 0, count, msg) if new_msg is None else (new_msg.logMonoTime, 0, 0, count, new_msg))
+      count += 1
+
+    if lookahead is None:
+      continue
+    if not window or newest < window[0][0] + lookahead:
+      fill()
+    # the log is assumed to be sorted within the lookahead, so messages older than that
+    # and than any message left to migrate are final
+    final = newest - lookahead if not window_min else min(newest - lookahead, window_min[0][0])
+    while pending and pending[0][0] < final:
+      last_yielded = pending[0][0]
+      yield heapq.heappop(pending)[-1]
 
-  return lr
+  while pending:
+    yield heapq.heappop(pending)[-1]
 
 
 def migration(inputs: list[str], product: str|None=None):
@@ -93,184 +190,164 @@ def migration(inputs: list[str], product: str|None=None):
       return func(*args, **kwargs)
     wrapper.inputs = inputs
     wrapper.product = product
+    wrapper.observes = []
+
+    def observer(types: list[str]):
+      """Registers a function called with each message of types as it's read, before any later message is migrated"""
+      def register(observe):
+        wrapper.observes = types
+        wrapper.observe = observe
+        return observe
+      return register
+    wrapper.observer = observer
     return wrapper
   return decorator
 
 
-@migration(inputs=["longitudinalPlan", "carParams"])
-def migrate_longitudinalPlan(msgs):
-  ops = []
+@migration(inputs=["longitudinalPlan"])
+def migrate_longitudinalPlan(msg, ctx):
+  # logs from before aTarget have it at 0.0 throughout. A plan is only migrated while no nonzero aTarget
+  # has been read, which is the whole log without a lookahead, and otherwise up to the lookahead past it
+  CP = ctx.first("carParams")
+  if ctx.state.get("has_a_target", False) or CP is None:
+    return None, [], False
 
-  needs_migration = all(msg.longitudinalPlan.aTarget == 0.0 for _, msg in msgs if msg.which() == 'longitudinalPlan')
-  CP = next((m.carParams for _, m in msgs if m.which() == 'carParams'), None)
-  if not needs_migration or CP is None:
-    return [], [], []
+  new_msg = msg.as_builder()
+  a_target, should_stop = get_accel_from_plan(msg.longitudinalPlan.speeds, msg.longitudinalPlan.accels, CONTROL_N_T_IDX)
+  new_msg.longitudinalPlan.aTarget, new_msg.longitudinalPlan.shouldStop = float(a_target), bool(should_stop)
+  return new_msg.as_reader(), [], False
 
-  for index, msg in msgs:
-    if msg.which() != 'longitudinalPlan':
-      continue
-    new_msg = msg.as_builder()
-    a_target, should_stop = get_accel_from_plan(msg.longitudinalPlan.speeds, msg.longitudinalPlan.accels, CONTROL_N_T_IDX)
-    new_msg.longitudinalPlan.aTarget, new_msg.longitudinalPlan.shouldStop = float(a_target), bool(should_stop)
-    ops.append((index, new_msg.as_reader()))
-  return ops, [], []
+
+@migrate_longitudinalPlan.observer(["longitudinalPlan"])
+def observe_longitudinalPlan(msg, ctx):
+  if msg.longitudinalPlan.aTarget != 0.0:
+    ctx.state["has_a_target"] = True
 
 
 @migration(inputs=["longitudinalPlan"], product="driverAssistance")
-def migrate_driverAssistance(msgs):
-  add_ops = []
-  for _, msg in msgs:
-    new_msg = messaging.new_message('driverAssistance', valid=True, logMonoTime=msg.logMonoTime)
-    add_ops.append(new_msg.as_reader())
-  return [], add_ops, []
+def migrate_driverAssistance(msg, ctx):
+  new_msg = messaging.new_message('driverAssistance', valid=True, logMonoTime=msg.logMonoTime)
+  return None, [new_msg.as_reader()], False
 
 
 @migration(inputs=["modelV2"], product="drivingModelData")
-def migrate_drivingModelData(msgs):
-  add_ops = []
-  for _, msg in msgs:
-    dmd = messaging.new_message('drivingModelData', valid=msg.valid, logMonoTime=msg.logMonoTime)
-    for field in ["frameId", "frameIdExtra", "frameDropPerc", "modelExecutionTime", "action"]:
-      setattr(dmd.drivingModelData, field, getattr(msg.modelV2, field))
-    for meta_field in ["laneChangeState", "laneChangeState"]:
-      setattr(dmd.drivingModelData.meta, meta_field, getattr(msg.modelV2.meta, meta_field))
-    if len(msg.modelV2.laneLines) and len(msg.modelV2.laneLineProbs):
-      fill_lane_line_meta(dmd.drivingModelData.laneLineMeta, msg.modelV2.laneLines, msg.modelV2.laneLineProbs)
-    if all(len(a) for a in [msg.modelV2.position.x, msg.modelV2.position.y, msg.modelV2.position.z]):
-      fill_xyz_poly(dmd.drivingModelData.path, ModelConstants.POLY_PATH_DEGREE, msg.modelV2.position.x, msg.modelV2.position.y, msg.modelV2.position.z)
-    add_ops.append( dmd.as_reader())
-  return [], add_ops, []
+def migrate_drivingModelData(msg, ctx):
+  dmd = messaging.new_message('drivingModelData', valid=msg.valid, logMonoTime=msg.logMonoTime)
+  for field in ["frameId", "frameIdExtra", "frameDropPerc", "modelExecutionTime", "action"]:
+    setattr(dmd.drivingModelData, field, getattr(msg.modelV2, field))
+  for meta_field in ["laneChangeState", "laneChangeState"]:
+    setattr(dmd.drivingModelData.meta, meta_field, getattr(msg.modelV2.meta, meta_field))
+  if len(msg.modelV2.laneLines) and len(msg.modelV2.laneLineProbs):
+    fill_lane_line_meta(dmd.drivingModelData.laneLineMeta, msg.modelV2.laneLines, msg.modelV2.laneLineProbs)
+  if all(len(a) for a in [msg.modelV2.position.x, msg.modelV2.position.y, msg.modelV2.position.z]):
+    fill_xyz_poly(dmd.drivingModelData.path, ModelConstants.POLY_PATH_DEGREE, msg.modelV2.position.x, msg.modelV2.position.y, msg.modelV2.position.z)
+  return None, [dmd.as_reader()], False
 
 
 @migration(inputs=["liveTracksDEPRECATED"], product="liveTracks")
-def migrate_liveTracks(msgs):
-  ops = []
-  for index, msg in msgs:
-    new_msg = messaging.new_message('liveTracks')
-    new_msg.valid = msg.valid
-    new_msg.logMonoTime = msg.logMonoTime
+def migrate_liveTracks(msg, ctx):
+  new_msg = messaging.new_message('liveTracks')
+  new_msg.valid = msg.valid
+  new_msg.logMonoTime = msg.logMonoTime
 
-    pts = []
-    for track in msg.liveTracksDEPRECATED:
-      pt = car.RadarData.RadarPoint()
-      pt.trackId = track.trackId
+  pts = []
+  for track in msg.liveTracksDEPRECATED:
+    pt = car.RadarData.RadarPoint()
+    pt.trackId = track.trackId
 
-      pt.dRel = track.dRel
-      pt.yRel = track.yRel
-      pt.vRel = track.vRel
-      pt.aRel = track.aRel
-      pt.measured = True
-      pts.append(pt)
+    pt.dRel = track.dRel
+    pt.yRel = track.yRel
+    pt.vRel = track.vRel
+    pt.aRel = track.aRel
+    pt.measured = True
+    pts.append(pt)
 
-    new_msg.liveTracks.points = pts
-    ops.append((index, new_msg.as_reader()))
-  return ops, [], []
+  new_msg.liveTracks.points = pts
+  return new_msg.as_reader(), [], False
 
 
 @migration(inputs=["liveLocationKalmanDEPRECATED"], product="livePose")
-def migrate_liveLocationKalman(msgs):
+def migrate_liveLocationKalman(msg, ctx):
   nans = [float('nan')] * 3
-  ops = []
-  for index, msg in msgs:
-    m = messaging.new_message('livePose')
-    m.valid = msg.valid
-    m.logMonoTime = msg.logMonoTime
-    for field in ["orientationNED", "velocityDevice", "accelerationDevice", "angularVelocityDevice"]:
-      lp_field, llk_field = getattr(m.livePose, field), getattr(msg.liveLocationKalmanDEPRECATED, field)
-      lp_field.x, lp_field.y, lp_field.z = llk_field.value or nans
-      lp_field.xStd, lp_field.yStd, lp_field.zStd = llk_field.std or nans
-      lp_field.valid = llk_field.valid
-    for flag in ["inputsOK", "posenetOK", "sensorsOK"]:
-      setattr(m.livePose, flag, getattr(msg.liveLocationKalmanDEPRECATED, flag))
-    ops.append((index, m.as_reader()))
-  return ops, [], []
+  m = messaging.new_message('livePose')
+  m.valid = msg.valid
+  m.logMonoTime = msg.logMonoTime
+  for field in ["orientationNED", "velocityDevice", "accelerationDevice", "angularVelocityDevice"]:
+    lp_field, llk_field = getattr(m.livePose, field), getattr(msg.liveLocationKalmanDEPRECATED, field)
+    lp_field.x, lp_field.y, lp_field.z = llk_field.value or nans
+    lp_field.xStd, lp_field.yStd, lp_field.zStd = llk_field.std or nans
+    lp_field.valid = llk_field.valid
+  for flag in ["inputsOK", "posenetOK", "sensorsOK"]:
+    setattr(m.livePose, flag, getattr(msg.liveLocationKalmanDEPRECATED, flag))
+  return m.as_reader(), [], False
 
 
 @migration(inputs=["controlsState"], product="selfdriveState")
-def migrate_controlsState(msgs):
-  add_ops = []
-  for _, msg in msgs:
-    m = messaging.new_message('selfdriveState')
-    m.valid = msg.valid
-    m.logMonoTime = msg.logMonoTime
-    ss = m.selfdriveState
-    for field in ("enabled", "active", "state", "engageable", "alertText1", "alertText2",
-                  "alertStatus", "alertSize", "alertType", "experimentalMode",
-                  "personality"):
-      setattr(ss, field, getattr(msg.controlsState, field+"DEPRECATED"))
-    add_ops.append(m.as_reader())
-  return [], add_ops, []
+def migrate_controlsState(msg, ctx):
+  m = messaging.new_message('selfdriveState')
+  m.valid = msg.valid
+  m.logMonoTime = msg.logMonoTime
+  ss = m.selfdriveState
+  for field in ("enabled", "active", "state", "engageable", "alertText1", "alertText2",
+                "alertStatus", "alertSize", "alertType", "experimentalMode",
+                "personality"):
+    setattr(ss, field, getattr(msg.controlsState, field+"DEPRECATED"))
+  return None, [m.as_reader()], False
 
 
 @migration(inputs=["carState", "controlsState"])
-def migrate_carState(msgs):
-  ops = []
-  last_cs = None
-  for index, msg in msgs:
-    if msg.which() == 'controlsState':
-      last_cs = msg
-    elif msg.which() == 'carState' and last_cs is not None:
-      if last_cs.controlsState.vCruiseDEPRECATED - msg.carState.vCruise > 0.1:
-        msg = msg.as_builder()
-        msg.carState.vCruise = last_cs.controlsState.vCruiseDEPRECATED
-        msg.carState.vCruiseCluster = last_cs.controlsState.vCruiseClusterDEPRECATED
-        ops.append((index, msg.as_reader()))
-  return ops, [], []
+def migrate_carState(msg, ctx):
+  if msg.which() == 'controlsState':
+    ctx.state["last_cs"] = msg
+    return None, [], False
+
+  last_cs = ctx.state.get("last_cs")
+  if last_cs is not None and last_cs.controlsState.vCruiseDEPRECATED - msg.carState.vCruise > 0.1:
+    msg = msg.as_builder()
+    msg.carState.vCruise = last_cs.controlsState.vCruiseDEPRECATED
+    msg.carState.vCruiseCluster = last_cs.controlsState.vCruiseClusterDEPRECATED
+    return msg.as_reader(), [], False
+  return None, [], False
 
 
 @migration(inputs=["managerState"])
-def migrate_managerState(msgs):
-  ops = []
-  for index, msg in msgs:
-    new_msg = msg.as_builder()
-    new_msg.managerState.processes = [{'name': name, 'running': True} for name in managed_processes]
-    ops.append((index, new_msg.as_reader()))
-  return ops, [], []
+def migrate_managerState(msg, ctx):
+  new_msg = msg.as_builder()
+  new_msg.managerState.processes = [{'name': name, 'running': True} for name in managed_processes]
+  return new_msg.as_reader(), [], False
 
 
 @migration(inputs=["gpsLocation", "gpsLocationExternal"])
-def migrate_gpsLocation(msgs):
-  ops = []
-  for index, msg in msgs:
-    new_msg = msg.as_builder()
-    g = getattr(new_msg, new_msg.which())
-    # hasFix is a newer field
-    if not g.hasFix and g.flags == 1:
-      g.hasFix = True
-    ops.append((index, new_msg.as_reader()))
-  return ops, [], []
-
-
-@migration(inputs=["deviceState", "initData"])
-def migrate_deviceState(msgs):
-  init_data = next((m.initData for _, m in msgs if m.which() == 'initData'), None)
-  device_state = next((m.deviceState for _, m in msgs if m.which() == 'deviceState'), None)
-  if init_data is None or device_state is None:
-    return [], [], []
-
-  ops = []
-  for i, msg in msgs:
-    if msg.which() == 'deviceState':
-      n = msg.as_builder()
-      n.deviceState.deviceType = init_data.deviceType
-      ops.append((i, n.as_reader()))
-  return ops, [], []
+def migrate_gpsLocation(msg, ctx):
+  new_msg = msg.as_builder()
+  g = getattr(new_msg, new_msg.which())
+  # hasFix is a newer field
+  if not g.hasFix and g.flags == 1:
+    g.hasFix = True
+  return new_msg.as_reader(), [], False
+
+
+@migration(inputs=["deviceState"])
+def migrate_deviceState(msg, ctx):
+  init_data = ctx.first("initData")
+  if init_data is None:
+    return None, [], False
+
+  n = msg.as_builder()
+  n.deviceState.deviceType = init_data.initData.deviceType
+  return n.as_reader(), [], False
 
 
 @migration(inputs=["carControl"], product="carOutput")
-def migrate_carOutput(msgs):
-  add_ops = []
-  for _, msg in msgs:
-    co = messaging.new_message('carOutput')
-    co.valid = msg.valid
-    co.logMonoTime = msg.logMonoTime
-    co.carOutput.actuatorsOutput = msg.carControl.actuatorsOutputDEPRECATED
-    add_ops.append(co.as_reader())
-  return [], add_ops, []
+def migrate_carOutput(msg, ctx):
+  co = messaging.new_message('carOutput')
+  co.valid = msg.valid
+  co.logMonoTime = msg.logMonoTime
+  co.carOutput.actuatorsOutput = msg.carControl.actuatorsOutputDEPRECATED
+  return None, [co.as_reader()], False
 
 
-@migration(inputs=["pandaStates", "pandaStateDEPRECATED", "carParams"])
-def migrate_pandaStates(msgs):
+def get_safety_param(CP):
   # TODO: safety param migration should be handled automatically
   safety_param_migration = {
     "TOYOTA_PRIUS": EPS_SCALE["TOYOTA_PRIUS"] | ToyotaSafetyFlags.STOCK_LONGITUDINAL,
@@ -283,191 +360,170 @@ def migrate_pandaStates(msgs):
   safety_param_migration |= dict.fromkeys((set(FORD) - FORD.with_flags(FordFlags.CANFD)), FordSafetyFlags.LONG_CONTROL)
 
   # Migrate safety param base on carParams
-  CP = next((m.carParams for _, m in msgs if m.which() == 'carParams'), None)
-  assert CP is not None, "carParams message not found"
   fingerprint = MIGRATION.get(CP.carFingerprint, CP.carFingerprint)
   if fingerprint in safety_param_migration:
-    safety_param = safety_param_migration[fingerprint].value
+    return safety_param_migration[fingerprint].value
   elif len(CP.safetyConfigs):
     safety_param = CP.safetyConfigs[0].safetyParam
     if CP.safetyConfigs[0].safetyParamDEPRECATED != 0:
       safety_param = CP.safetyConfigs[0].safetyParamDEPRECATED
+    return safety_param
   else:
-    safety_param = CP.safetyParamDEPRECATED
-
-  ops = []
-  for index, msg in msgs:
-    if msg.which() == 'pandaStateDEPRECATED':
-      new_msg = messaging.new_message('pandaStates', 1)
-      new_msg.valid = msg.valid
-      new_msg.logMonoTime = msg.logMonoTime
-      new_msg.pandaStates[0] = msg.pandaStateDEPRECATED
-      new_msg.pandaStates[0].safetyParam = safety_param
-      ops.append((index, new_msg.as_reader()))
-    elif msg.which() == 'pandaStates':
-      new_msg = msg.as_builder()
-      new_msg.pandaStates[-1].safetyParam = safety_param
-      # Clear DISABLE_DISENGAGE_ON_GAS bit to fix controls mismatch
-      new_msg.pandaStates[-1].alternativeExperience &= ~1
-      ops.append((index, new_msg.as_reader()))
-  return ops, [], []
+    return CP.safetyParamDEPRECATED
 
 
-@migration(inputs=["pandaStates", "pandaStateDEPRECATED"], product="peripheralState")
-def migrate_peripheralState(msgs):
-  add_ops = []
+@migration(inputs=["pandaStates", "pandaStateDEPRECATED"])
+def migrate_pandaStates(msg, ctx):
+  if "safety_param" not in ctx.state:
+    CP = ctx.first("carParams")
+    assert CP is not None, "carParams message not found"
+    ctx.state["safety_param"] = get_safety_param(CP.carParams)
+  safety_param = ctx.state["safety_param"]
 
-  which = "pandaStates" if any(msg.which() == "pandaStates" for _, msg in msgs) else "pandaStateDEPRECATED"
-  for _, msg in msgs:
-    if msg.which() != which:
-      continue
-    new_msg = messaging.new_message("peripheralState")
+  if msg.which() == 'pandaStateDEPRECATED':
+    new_msg = messaging.new_message('pandaStates', 1)
     new_msg.valid = msg.valid
     new_msg.logMonoTime = msg.logMonoTime
-    add_ops.append(new_msg.as_reader())
-  return [], add_ops, []
+    new_msg.pandaStates[0] = msg.pandaStateDEPRECATED
+    new_msg.pandaStates[0].safetyParam = safety_param
+  else:
+    new_msg = msg.as_builder()
+    new_msg.pandaStates[-1].safetyParam = safety_param
+    # Clear DISABLE_DISENGAGE_ON_GAS bit to fix controls mismatch
+    new_msg.pandaStates[-1].alternativeExperience &= ~1
+  return new_msg.as_reader(), [], False
 
 
-@migration(inputs=["roadEncodeIdx", "wideRoadEncodeIdx", "driverEncodeIdx", "roadCameraState", "wideRoadCameraState", "driverCameraState"])
-def migrate_cameraStates(msgs):
-  add_ops, del_ops = [], []
-  frame_to_encode_id = defaultdict(dict)
-  # just for encodeId fallback mechanism
-  min_frame_id = defaultdict(lambda: float('inf'))
+@migration(inputs=["pandaStates", "pandaStateDEPRECATED"], product="peripheralState")
+def migrate_peripheralState(msg, ctx):
+  which = "pandaStates" if ctx.first("pandaStates") is not None else "pandaStateDEPRECATED"
+  if msg.which() != which:
+    return None, [], False
+
+  new_msg = messaging.new_message("peripheralState")
+  new_msg.valid = msg.valid
+  new_msg.logMonoTime = msg.logMonoTime
+  return None, [new_msg.as_reader()], False
 
-  for _, msg in msgs:
-    if msg.which() not in ["roadEncodeIdx", "wideRoadEncodeIdx", "driverEncodeIdx"]:
-      continue
 
-    encode_index = getattr(msg, msg.which())
-    meta = meta_from_encode_index(msg.which())
+@migration(inputs=["roadCameraState", "wideRoadCameraState", "driverCameraState"])
+def migrate_cameraStates(msg, ctx):
+  frame_to_encode_id = ctx.state.setdefault("frame_to_encode_id", defaultdict(dict))
+  # just for encodeId fallback mechanism
+  min_frame_id = ctx.state.setdefault("min_frame_id", defaultdict(lambda: float('inf')))
+
+  camera_state = getattr(msg, msg.which())
+  min_frame_id[msg.which()] = min(min_frame_id[msg.which()], camera_state.frameId)
+
+  encode_id = frame_to_encode_id[msg.which()].get(camera_state.frameId)
+  if encode_id is None:
+    print(f"Missing encoded frame for camera feed {msg.which()} with frameId: {camera_state.frameId}")
+    if len(frame_to_encode_id[msg.which()]) != 0:
+      return None, [], True
+
+    # fallback mechanism for logs without encodeIdx (e.g. logs from before 2022 with dcamera recording disabled)
+    # try to fake encode_id by subtracting lowest frameId
+    encode_id = camera_state.frameId - min_frame_id[msg.which()]
+    print(f"Faking encodeId to {encode_id} for camera feed {msg.which()} with frameId: {camera_state.frameId}")
+
+  new_msg = messaging.new_message(msg.which())
+  new_camera_state = getattr(new_msg, new_msg.which())
+  new_camera_state.sensor = camera_state.sensor
+  new_camera_state.frameId = encode_id
+  new_camera_state.encodeId = encode_id
+  # timestampSof was added later so it might be missing on some old segments
+  if camera_state.timestampSof == 0 and camera_state.timestampEof > 25000000:
+    new_camera_state.timestampSof = camera_state.timestampEof - 18000000
+  else:
+    new_camera_state.timestampSof = camera_state.timestampSof
+  new_camera_state.timestampEof = camera_state.timestampEof
+  new_msg.logMonoTime = msg.logMonoTime
+  new_msg.valid = msg.valid
 
-    assert encode_index.segmentId < 1200, f"Encoder index segmentId greater that 1200: {msg.which()} {encode_index.segmentId}"
-    frame_to_encode_id[meta.camera_state][encode_index.frameId] = encode_index.segmentId
+  return None, [new_msg.as_reader()], True
 
-  for index, msg in msgs:
-    if msg.which() not in ["roadCameraState", "wideRoadCameraState", "driverCameraState"]:
-      continue
 
-    camera_state = getattr(msg, msg.which())
-    min_frame_id[msg.which()] = min(min_frame_id[msg.which()], camera_state.frameId)
-
-    encode_id = frame_to_encode_id[msg.which()].get(camera_state.frameId)
-    if encode_id is None:
-      print(f"Missing encoded frame for camera feed {msg.which()} with frameId: {camera_state.frameId}")
-      if len(frame_to_encode_id[msg.which()]) != 0:
-        del_ops.append(index)
-        continue
-
-      # fallback mechanism for logs without encodeIdx (e.g. logs from before 2022 with dcamera recording disabled)
-      # try to fake encode_id by subtracting lowest frameId
-      encode_id = camera_state.frameId - min_frame_id[msg.which()]
-      print(f"Faking encodeId to {encode_id} for camera feed {msg.which()} with frameId: {camera_state.frameId}")
-
-    new_msg = messaging.new_message(msg.which())
-    new_camera_state = getattr(new_msg, new_msg.which())
-    new_camera_state.sensor = camera_state.sensor
-    new_camera_state.frameId = encode_id
-    new_camera_state.encodeId = encode_id
-    # timestampSof was added later so it might be missing on some old segments
-    if camera_state.timestampSof == 0 and camera_state.timestampEof > 25000000:
-      new_camera_state.timestampSof = camera_state.timestampEof - 18000000
-    else:
-      new_camera_state.timestampSof = camera_state.timestampSof
-    new_camera_state.timestampEof = camera_state.timestampEof
-    new_msg.logMonoTime = msg.logMonoTime
-    new_msg.valid = msg.valid
+@migrate_cameraStates.observer(["roadEncodeIdx", "wideRoadEncodeIdx", "driverEncodeIdx"])
+def observe_encodeIdx(msg, ctx):
+  encode_index = getattr(msg, msg.which())
+  meta = meta_from_encode_index(msg.which())
 
-    del_ops.append(index)
-    add_ops.append(new_msg.as_reader())
-  return [], add_ops, del_ops
+  assert encode_index.segmentId < 1200, f"Encoder index segmentId greater that 1200: {msg.which()} {encode_index.segmentId}"
+  ctx.state.setdefault("frame_to_encode_id", defaultdict(dict))[meta.camera_state][encode_index.frameId] = encode_index.segmentId
 
 
 @migration(inputs=["carParams"])
-def migrate_carParams(msgs):
-  ops = []
-  for index, msg in msgs:
-    CP = msg.as_builder()
-    CP.carParams.carFingerprint = MIGRATION.get(CP.carParams.carFingerprint, CP.carParams.carFingerprint)
-    for car_fw in CP.carParams.carFw:
-      car_fw.brand = CP.carParams.brand
-    ops.append((index, CP.as_reader()))
-  return ops, [], []
+def migrate_carParams(msg, ctx):
+  CP = msg.as_builder()
+  CP.carParams.carFingerprint = MIGRATION.get(CP.carParams.carFingerprint, CP.carParams.carFingerprint)
+  for car_fw in CP.carParams.carFw:
+    car_fw.brand = CP.carParams.brand
+  return CP.as_reader(), [], False
 
 
 @migration(inputs=["sensorEventsDEPRECATED"], product="sensorEvents")
-def migrate_sensorEvents(msgs):
-  add_ops, del_ops = [], []
-  for index, msg in msgs:
-    # migrate to split sensor events
-    for evt in msg.sensorEventsDEPRECATED:
-      # build new message for each sensor type
-      sensor_service = ''
-      if evt.which() == 'acceleration':
-        sensor_service = 'accelerometer'
-      elif evt.which() == 'gyro' or evt.which() == 'gyroUncalibrated':
-        sensor_service = 'gyroscope'
-      elif evt.which() == 'light' or evt.which() == 'proximity':
-        sensor_service = 'lightSensor'
-      elif evt.which() == 'magnetic' or evt.which() == 'magneticUncalibrated':
-        sensor_service = 'magnetometer'
-      elif evt.which() == 'temperature':
-        sensor_service = 'temperatureSensor'
-
-      m = messaging.new_message(sensor_service)
-      m.valid = True
-      m.logMonoTime = msg.logMonoTime
-
-      m_dat = getattr(m, sensor_service)
-      m_dat.version = evt.version
-      m_dat.sensor = evt.sensor
-      m_dat.type = evt.type
-      m_dat.source = evt.source
-      m_dat.timestamp = evt.timestamp
-      setattr(m_dat, evt.which(), getattr(evt, evt.which()))
-
-      add_ops.append(m.as_reader())
-    del_ops.append(index)
-  return [], add_ops, del_ops
+def migrate_sensorEvents(msg, ctx):
+  add_ops = []
+  # migrate to split sensor events
+  for evt in msg.sensorEventsDEPRECATED:
+    # build new message for each sensor type
+    sensor_service = ''
+    if evt.which() == 'acceleration':
+      sensor_service = 'accelerometer'
+    elif evt.which() == 'gyro' or evt.which() == 'gyroUncalibrated':
+      sensor_service = 'gyroscope'
+    elif evt.which() == 'light' or evt.which() == 'proximity':
+      sensor_service = 'lightSensor'
+    elif evt.which() == 'magnetic' or evt.which() == 'magneticUncalibrated':
+      sensor_service = 'magnetometer'
+    elif evt.which() == 'temperature':
+      sensor_service = 'temperatureSensor'
+
+    m = messaging.new_message(sensor_service)
+    m.valid = True
+    m.logMonoTime = msg.logMonoTime
 
+    m_dat = getattr(m, sensor_service)
+    m_dat.version = evt.version
+    m_dat.sensor = evt.sensor
+    m_dat.type = evt.type
+    m_dat.source = evt.source
+    m_dat.timestamp = evt.timestamp
+    setattr(m_dat, evt.which(), getattr(evt, evt.which()))
 
-@migration(inputs=["onroadEventsDEPRECATED"], product="onroadEvents")
-def migrate_onroadEvents(msgs):
-  ops = []
-  for index, msg in msgs:
-    onroadEvents = []
-    for event in msg.onroadEventsDEPRECATED:
-      try:
-        if not str(event.name).endswith('DEPRECATED'):
-          # dict converts name enum into string representation
-          onroadEvents.append(log.OnroadEvent(**event.to_dict()))
-      except RuntimeError:  # Member was null
-        traceback.print_exc()
-
-    new_msg = messaging.new_message('onroadEvents', len(msg.onroadEventsDEPRECATED))
-    new_msg.valid = msg.valid
-    new_msg.logMonoTime = msg.logMonoTime
-    new_msg.onroadEvents = onroadEvents
-    ops.append((index, new_msg.as_reader()))
+    add_ops.append(m.as_reader())
+  return None, add_ops, True
 
-  return ops, [], []
+
+@migration(inputs=["onroadEventsDEPRECATED"], product="onroadEvents")
+def migrate_onroadEvents(msg, ctx):
+  onroadEvents = []
+  for event in msg.onroadEventsDEPRECATED:
+    try:
+      if not str(event.name).endswith('DEPRECATED'):
+        # dict converts name enum into string representation
+        onroadEvents.append(log.OnroadEvent(**event.to_dict()))
+    except RuntimeError:  # Member was null
+      traceback.print_exc()
+
+  new_msg = messaging.new_message('onroadEvents', len(msg.onroadEventsDEPRECATED))
+  new_msg.valid = msg.valid
+  new_msg.logMonoTime = msg.logMonoTime
+  new_msg.onroadEvents = onroadEvents
+  return new_msg.as_reader(), [], False
 
 
 @migration(inputs=["driverMonitoringState"])
-def migrate_driverMonitoringState(msgs):
-  ops = []
-  for index, msg in msgs:
-    msg = msg.as_builder()
-    events = []
-    for event in msg.driverMonitoringState.eventsDEPRECATED:
-      try:
-        if not str(event.name).endswith('DEPRECATED'):
-          # dict converts name enum into string representation
-          events.append(log.OnroadEvent(**event.to_dict()))
-      except RuntimeError:  # Member was null
-        traceback.print_exc()
-
-    msg.driverMonitoringState.events = events
-    ops.append((index, msg.as_reader()))
-
-  return ops, [], []
+def migrate_driverMonitoringState(msg, ctx):
+  msg = msg.as_builder()
+  events = []
+  for event in msg.driverMonitoringState.eventsDEPRECATED:
+    try:
+      if not str(event.name).endswith('DEPRECATED'):
+        # dict converts name enum into string representation
+        events.append(log.OnroadEvent(**event.to_dict()))
+    except RuntimeError:  # Member was null
+      traceback.print_exc()
+
+  msg.driverMonitoringState.events = events
+  return msg.as_reader(), [], False
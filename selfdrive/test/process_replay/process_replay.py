@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
+import gc
 import os
 import time
 import copy
 import heapq
 import signal
-import numpy as np
+import importlib
+import threading
 from collections import Counter
 from dataclasses import dataclass, field
 from itertools import islice
@@ -22,13 +24,14 @@ from opendbc.car.can_definitions import CanData
 from opendbc.car.car_helpers import get_car, interfaces
 from openpilot.common.params import Params
 from openpilot.common.prefix import OpenpilotPrefix
-from openpilot.common.timeout import Timeout
+from openpilot.common.timeout import Timeout, TimeoutException
 from openpilot.common.realtime import DT_CTRL
 from openpilot.system.camerad.cameras.nv12_info import get_nv12_info
 from openpilot.system.manager.process_config import managed_processes
 from openpilot.selfdrive.test.process_replay.vision_meta import meta_from_camera_state, available_streams
 from openpilot.selfdrive.test.process_replay.migration import migrate_all
 from openpilot.selfdrive.test.process_replay.capture import ProcessOutputCapture
+from openpilot.selfdrive.test.process_replay.frame_feeder import FrameFeeder
 from openpilot.tools.lib.logreader import LogIterable
 from openpilot.tools.lib.framereader import FrameReader
 
@@ -132,6 +135,8 @@ class ProcessConfig:
   main_pub_drained: bool = False
   vision_pubs: list[str] = field(default_factory=list)
   ignore_alive_pubs: list[str] = field(default_factory=list)
+  # pure Python process which can be replayed in a thread of the replay process, see InProcessContainer
+  in_process: bool = False
 
   def __post_init__(self):
     # If the process is polling a service, we can just lock that one to speed up replay
@@ -150,6 +155,7 @@ class ProcessContainer:
     self.sockets: list[messaging.SubSocket] | None = None
     self.rc: ReplayContext | None = None
     self.vipc_server: VisionIpcServer | None = None
+    self.frame_feeder: FrameFeeder | None = None
     self.environ_config: dict[str, Any] | None = None
     self.capture: ProcessOutputCapture | None = None
 
@@ -211,6 +217,7 @@ class ProcessContainer:
 
     self.vipc_server = vipc_server
     self.cfg.vision_pubs = [meta.camera_state for meta in streams_metas if meta.camera_state in self.cfg.vision_pubs]
+    self.frame_feeder = FrameFeeder(frs, all_msgs, self.cfg.vision_pubs)
 
   def _start_process(self):
     if self.capture is not None:
@@ -254,6 +261,8 @@ class ProcessContainer:
     with self.prefix:
       self.process.signal(signal.SIGKILL)
       self.process.stop()
+      if self.frame_feeder is not None:
+        self.frame_feeder.stop()
       self.rc.close_context()
       self.prefix.clean_dirs()
       self._clean_env()
@@ -301,20 +310,9 @@ class ProcessContainer:
           if self.vipc_server is not None and m.which() in self.cfg.vision_pubs:
             camera_state = getattr(m, m.which())
             camera_meta = meta_from_camera_state(m.which())
-            assert frs is not None
-            img = frs[m.which()].get(camera_state.frameId)
-
-            h, w = frs[m.which()].h, frs[m.which()].w
-            stride, y_height, _, yuv_size = get_nv12_info(w, h)
-            uv_offset = stride * y_height
-            padded_img = np.zeros(((uv_offset //stride) + (h // 2), stride))
-            padded_img[:h, :w] = img[:h * w].reshape((-1, w))
-            padded_img[uv_offset // stride:uv_offset // stride + h // 2, :w] = img[h * w:].reshape((-1, w))
-            img_bytes = np.zeros((yuv_size,), dtype=np.uint8)
-            img_bytes[:padded_img.size] = padded_img.flatten()
-
-            self.vipc_server.send(camera_meta.stream, img_bytes.tobytes(),
-                                  camera_state.frameId, camera_state.timestampSof, camera_state.timestampEof)
+            assert self.frame_feeder is not None
+            img = self.frame_feeder.get(m.which(), camera_state.frameId)
+            self.vipc_server.send(camera_meta.stream, img, camera_state.frameId, camera_state.timestampSof, camera_state.timestampEof)
         self.msg_queue = []
 
         self.rc.unlock_sockets()
@@ -326,6 +324,170 @@ class ProcessContainer:
     return output_msgs
 
 
+class ReplayStopped(BaseException):
+  """Raised inside an in-process replayed process to end its main loop"""
+
+
+class InProcessSubMaster(messaging.SubMaster):
+  """SubMaster which gets the messages of each replay cycle handed over directly instead of over msgq"""
+  def __init__(self, container: 'InProcessContainer', *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.container = container
+
+  def update(self, timeout: int = 100) -> None:
+    # like with fake events, every update waits for the next cycle regardless of the timeout
+    msgs = self.container.next_cycle()
+    # sockets are conflated, so only the last message of each service in a cycle is received
+    latest = {m.which(): m for m in msgs if m.which() in self.services}
+    self.update_msgs(time.monotonic(), list(latest.values()))
+
+
+class InProcessPubMaster(messaging.PubMaster):
+  def __init__(self, container: 'InProcessContainer', services: list[str]):
+    self.container = container
+    self.sock = {}
+
+  def send(self, s: str, dat: bytes | capnp._DynamicStructBuilder) -> None:
+    if not isinstance(dat, bytes):
+      dat = dat.to_bytes()
+    if s in self.container.subs:
+      self.container.outputs.append(messaging.log_from_bytes(dat))
+
+
+class InProcessMessaging:
+  """Stands in for the cereal.messaging module of an in-process replayed process"""
+  def __init__(self, container: 'InProcessContainer'):
+    self.container = container
+
+  def __getattr__(self, name: str):
+    return getattr(messaging, name)
+
+  def SubMaster(self, *args, **kwargs) -> InProcessSubMaster:
+    return InProcessSubMaster(self.container, *args, **kwargs)
+
+  def PubMaster(self, services: list[str]) -> InProcessPubMaster:
+    return InProcessPubMaster(self.container, services)
+
+
+class InProcessContainer(ProcessContainer):
+  """
+    Runs the main() of a pure Python process in a thread of the replay process, with its SubMaster and PubMaster
+    swapped for ones that exchange messages with the replay directly. The replay and the process take turns once
+    per cycle like with msgq and fake events, without the serialization, IPC and event round trips.
+  """
+  def __init__(self, cfg: ProcessConfig):
+    super().__init__(cfg)
+    assert cfg.in_process and len(cfg.vision_pubs) == 0, f"{cfg.proc_name} can't be replayed in process"
+    self.outputs: list[capnp._DynamicStructReader] = []
+    self.inputs: list[capnp._DynamicStructReader] = []
+    self.thread: threading.Thread | None = None
+    self.exited = False
+    self.exc: BaseException | None = None
+    self.module: Any = None
+    self.module_messaging: Any = None
+    self.gc_enabled = gc.isenabled()
+    self.stopping = False
+    self.ready = threading.Semaphore(0)
+    self.done = threading.Semaphore(0)
+
+  def next_cycle(self) -> list[capnp._DynamicStructReader]:
+    """Called by the process when it waits for messages: hands control back and waits for the next cycle"""
+    self.done.release()
+    self.ready.acquire()
+    if self.stopping:
+      raise ReplayStopped
+    msgs, self.inputs = self.inputs, []
+    return msgs
+
+  def _run(self):
+    try:
+      self.module.main()
+    except ReplayStopped:
+      pass
+    except BaseException as e:
+      self.exc = e
+    finally:
+      self.exited = True
+      self.done.release()
+
+  def _wait_for_process(self):
+    if not self.done.acquire(timeout=self.cfg.timeout):
+      raise TimeoutException(f"timed out testing process {repr(self.cfg.proc_name)}")
+    if self.exc is not None:
+      raise Exception(f"{self.cfg.proc_name} crashed") from self.exc
+    assert not self.exited, f"{self.cfg.proc_name} exited"
+
+  def start(
+    self, params_config: dict[str, Any], environ_config: dict[str, Any],
+    all_msgs: LogIterable, frs: dict[str, FrameReader] | None,
+    fingerprint: str | None, capture_output: bool
+  ):
+    assert not capture_output, "output capture isn't supported in process"
+    with self.prefix:
+      self.prefix.create_dirs()
+      self._setup_env(params_config, environ_config)
+
+      params = Params()
+      if self.cfg.config_callback is not None:
+        self.cfg.config_callback(params, self.cfg, all_msgs)
+      # the process waits for CarParams before its first update, so they're set up front
+      if self.cfg.init_callback is not None:
+        self.cfg.init_callback(None, None, all_msgs, fingerprint)
+
+      self.module = importlib.import_module(self.process.module)
+      self.module_messaging = self.module.messaging
+      self.module.messaging = InProcessMessaging(self)
+
+      self.thread = threading.Thread(target=self._run, name=self.cfg.proc_name, daemon=True)
+      self.thread.start()
+      self._wait_for_process()
+
+  def stop(self):
+    with self.prefix:
+      if self.thread is not None and not self.exited:
+        self.stopping = True
+        self.ready.release()
+        self.thread.join(timeout=self.cfg.timeout)
+      if self.module is not None:
+        self.module.messaging = self.module_messaging
+      # config_realtime_process disables the garbage collector for the whole replay process
+      if self.gc_enabled:
+        gc.enable()
+      self.prefix.clean_dirs()
+      self._clean_env()
+
+  def get_output_msgs(self, start_time: int):
+    # drained socket by socket with msgq
+    outputs = sorted(self.outputs, key=lambda m: self.cfg.subs.index(m.which()))
+    self.outputs = []
+
+    output_msgs = []
+    for m in outputs:
+      m = m.as_builder()
+      m.logMonoTime = start_time + int(self.cfg.processing_time * 1e9)
+      output_msgs.append(m.as_reader())
+    return output_msgs
+
+  def run_step(self, msg: capnp._DynamicStructReader, frs: dict[str, FrameReader] | None) -> list[capnp._DynamicStructReader]:
+    output_msgs = []
+    end_of_cycle = True
+    if self.cfg.should_recv_callback is not None:
+      end_of_cycle = self.cfg.should_recv_callback(msg, self.cfg, self.cnt)
+
+    self.msg_queue.append(msg)
+    if end_of_cycle:
+      with self.prefix:
+        # get output msgs from previous inputs
+        output_msgs = self.get_output_msgs(msg.logMonoTime)
+
+        self.inputs, self.msg_queue = self.msg_queue, []
+        self.ready.release()
+        self._wait_for_process()
+        self.cnt += 1
+
+    return output_msgs
+
+
 def card_fingerprint_callback(rc, pm, msgs, fingerprint):
   print("start fingerprinting")
   params = Params()
@@ -474,6 +636,7 @@ CONFIGS = [
     ignore=["logMonoTime"],
     init_callback=get_car_params_callback,
     should_recv_callback=MessageBasedRcvCallback("modelV2"),
+    in_process=True,
   ),
   ProcessConfig(
     proc_name="plannerd",
@@ -483,6 +646,7 @@ CONFIGS = [
     init_callback=get_car_params_callback,
     should_recv_callback=MessageBasedRcvCallback("modelV2"),
     tolerance=NUMPY_TOLERANCE,
+    in_process=True,
   ),
   ProcessConfig(
     proc_name="calibrationd",
@@ -491,6 +655,7 @@ CONFIGS = [
     ignore=["logMonoTime"],
     init_callback=get_car_params_callback,
     should_recv_callback=MessageBasedRcvCallback("cameraOdometry", True),
+    in_process=True,
   ),
   ProcessConfig(
     proc_name="dmonitoringd",
@@ -519,6 +684,7 @@ CONFIGS = [
     should_recv_callback=MessageBasedRcvCallback("livePose"),
     tolerance=NUMPY_TOLERANCE,
     processing_time=0.004,
+    in_process=True,
   ),
   ProcessConfig(
     proc_name="lagd",
@@ -528,6 +694,7 @@ CONFIGS = [
     init_callback=get_car_params_callback,
     should_recv_callback=MessageBasedRcvCallback("livePose"),
     tolerance=NUMPY_TOLERANCE,
+    in_process=True,
   ),
   ProcessConfig(
     proc_name="ubloxd",
@@ -543,6 +710,7 @@ CONFIGS = [
     init_callback=get_car_params_callback,
     should_recv_callback=MessageBasedRcvCallback("livePose", True),
     tolerance=NUMPY_TOLERANCE,
+    in_process=True,
   ),
   ProcessConfig(
     proc_name="modeld",
@@ -625,8 +793,12 @@ def replay_process_with_name(name: str | Iterable[str], lr: LogIterable, *args,
 def replay_process(
   cfg: ProcessConfig | Iterable[ProcessConfig], lr: LogIterable, frs: dict[str, FrameReader] | None = None,
   fingerprint: str | None = None, return_all_logs: bool = False, custom_params: dict[str, Any] | None = None,
-  captured_output_store: dict[str, dict[str, str]] | None = None, disable_progress: bool = False
+  captured_output_store: dict[str, dict[str, str]] | None = None, disable_progress: bool = False, in_process: bool = False
 ) -> list[capnp._DynamicStructReader]:
+  """
+    With in_process, processes which support it are run in a thread of the replay process instead of as managed processes.
+    This skips msgq and is much faster for replaying short logs (e.g. fuzzing), but doesn't support capturing their output.
+  """
   if isinstance(cfg, Iterable):
     cfgs = list(cfg)
   else:
@@ -636,7 +808,7 @@ def replay_process(
                          manager_states=True,
                          panda_states=any("pandaStates" in cfg.pubs for cfg in cfgs),
                          camera_states=any(len(cfg.vision_pubs) != 0 for cfg in cfgs))
-  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress)
+  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress, in_process)
 
   if return_all_logs:
     keys = {m.which() for m in process_logs}
@@ -652,7 +824,8 @@ def replay_process(
 
 def _replay_multi_process(
   cfgs: list[ProcessConfig], lr: LogIterable, frs: dict[str, FrameReader] | None, fingerprint: str | None,
-  custom_params: dict[str, Any] | None, captured_output_store: dict[str, dict[str, str]] | None, disable_progress: bool
+  custom_params: dict[str, Any] | None, captured_output_store: dict[str, dict[str, str]] | None, disable_progress: bool,
+  in_process: bool = False
 ) -> list[capnp._DynamicStructReader]:
   if fingerprint is not None:
     params_config = generate_params_config(lr=lr, fingerprint=fingerprint, custom_params=custom_params)
@@ -676,7 +849,10 @@ def _replay_multi_process(
   containers = []
   try:
     for cfg in cfgs:
-      container = ProcessContainer(cfg)
+      if in_process and cfg.in_process and captured_output_store is None:
+        container = InProcessContainer(cfg)
+      else:
+        container = ProcessContainer(cfg)
       containers.append(container)
       container.start(params_config, env_config, all_msgs, frs, fingerprint, captured_output_store is not None)
 
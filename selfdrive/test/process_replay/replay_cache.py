@@ -0,0 +1,148 @@
+import glob
+import hashlib
+import importlib.metadata
+import json
+import os
+import subprocess
+import sys
+import zstandard as zstd
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+
+from openpilot.common.basedir import BASEDIR
+from openpilot.common.swaglog import cloudlog
+from openpilot.common.utils import atomic_write
+from openpilot.system.hardware.hw import Paths
+from openpilot.system.manager.process import PythonProcess
+from openpilot.system.manager.process_config import managed_processes
+from openpilot.selfdrive.test.process_replay.process_replay import ProcessConfig
+from openpilot.tools.lib.logreader import LogReader
+from openpilot.tools.lib.url_file import prune_cache
+
+# bump when replay outputs change without a change to any of the fingerprinted files
+REPLAY_CACHE_VERSION = 1
+HARNESS_MODULE = "openpilot.selfdrive.test.process_replay.process_replay"
+
+# files read at runtime instead of imported
+DATA_FILES = [
+  "cereal/*.capnp",
+  "opendbc/dbc/*.dbc",
+  "opendbc/car/torque_data/*.toml",
+]
+LOCK_FILE = "uv.lock"
+
+IMPORTED_FILES_SCRIPT = """
+import importlib, json, sys
+importlib.import_module(sys.argv[1])
+print(json.dumps([f for m in list(sys.modules.values()) if (f := getattr(m, "__file__", None))]))
+"""
+
+
+def imported_files(module: str) -> list[str]:
+  """Repo files loaded when importing module in a fresh interpreter, including compiled extensions"""
+  out = subprocess.check_output([sys.executable, "-c", IMPORTED_FILES_SCRIPT, module], cwd=BASEDIR, stderr=subprocess.DEVNULL)
+  files = set()
+  for fn in json.loads(out.decode().strip().splitlines()[-1]):
+    fn = os.path.realpath(fn)
+    if fn.startswith(BASEDIR + "/") and "site-packages" not in fn:
+      files.add(fn)
+  return sorted(files)
+
+
+def hash_files(files: Iterable[str]) -> str:
+  h = hashlib.md5()
+  for fn in sorted(set(files)):
+    h.update(os.path.relpath(fn, BASEDIR).encode())
+    with open(fn, "rb") as f:
+      h.update(hashlib.md5(f.read()).digest())
+  return h.hexdigest()
+
+
+@cache
+def environment_fingerprint() -> str:
+  """Hash of the interpreter, the installed package versions and the lock file"""
+  h = hashlib.md5(sys.version.encode())
+  packages = sorted(f"{d.metadata['Name']}=={d.version}" for d in importlib.metadata.distributions())
+  h.update("\n".join(packages).encode())
+  lock_file = os.path.join(BASEDIR, LOCK_FILE)
+  if os.path.exists(lock_file):
+    h.update(hash_files([lock_file]).encode())
+  return h.hexdigest()
+
+
+@cache
+def harness_files() -> list[str]:
+  data_files = [os.path.realpath(fn) for pattern in DATA_FILES for fn in glob.glob(os.path.join(BASEDIR, pattern))]
+  return imported_files(HARNESS_MODULE) + data_files
+
+
+def config_fingerprint(cfg: ProcessConfig) -> str:
+  """The replay settings of cfg. Callbacks are identified by name, their source is part of the harness"""
+  fields = {}
+  for k, v in vars(cfg).items():
+    if callable(v):
+      # callable objects (e.g. MessageBasedRcvCallback) also by their state
+      v = getattr(v, "__qualname__", None) or [type(v).__qualname__, vars(v)]
+    fields[k] = v
+  return json.dumps(fields, sort_keys=True, default=repr)
+
+
+def process_fingerprint(cfg: ProcessConfig) -> str | None:
+  """
+    Hash of everything a replay of cfg depends on besides its input: the source of the daemon and of the
+    replay harness, the data files they read, the replay config, the interpreter and the installed packages.
+    None if the process can't be fingerprinted.
+  """
+  proc = managed_processes.get(cfg.proc_name)
+  if not isinstance(proc, PythonProcess):
+    return None
+
+  h = hashlib.md5(f"{REPLAY_CACHE_VERSION}_{proc.module}_{config_fingerprint(cfg)}".encode())
+  h.update(hash_files(imported_files(proc.module) + harness_files()).encode())
+  h.update(environment_fingerprint().encode())
+  return h.hexdigest()
+
+
+def process_fingerprints(cfgs: Iterable[ProcessConfig]) -> dict[str, str | None]:
+  """process_fingerprint of each config by process name. The imports are traced in parallel"""
+  cfgs = list(cfgs)
+  harness_files()
+  environment_fingerprint()
+  with ThreadPoolExecutor(max_workers=max(len(cfgs), 1)) as pool:
+    return dict(zip([cfg.proc_name for cfg in cfgs], pool.map(process_fingerprint, cfgs), strict=True))
+
+
+def log_fingerprint(dat: bytes) -> str:
+  return hashlib.md5(dat).hexdigest()
+
+
+def replay_cache_key(process_fp: str | None, log_fp: str) -> str | None:
+  if process_fp is None:
+    return None
+  return hashlib.md5(f"{process_fp}_{log_fp}".encode()).hexdigest()
+
+
+def replay_cache_path(key: str) -> str:
+  os.makedirs(Paths.download_cache_root(), exist_ok=True)
+  return os.path.join(Paths.download_cache_root(), f"{key}_replay_v{REPLAY_CACHE_VERSION}.zst")
+
+
+def load_replay(key: str) -> list | None:
+  """Cached replay outputs, None on a miss"""
+  path = replay_cache_path(key)
+  if not os.path.exists(path):
+    return None
+  try:
+    return list(LogReader(path))
+  except Exception:
+    cloudlog.exception(f"failed to load cached replay {path}")
+    return None
+
+
+def save_replay(key: str, log_msgs: list) -> None:
+  path = replay_cache_path(key)
+  dat = b"".join(msg.as_builder().to_bytes() for msg in log_msgs)
+  with atomic_write(path, mode="wb", overwrite=True) as f:
+    f.write(zstd.compress(dat, 10))
+  prune_cache(os.path.basename(path))
@@ -0,0 +1,60 @@
+import concurrent.futures
+import time
+import traceback
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from typing import Any
+
+from openpilot.common.prefix import OpenpilotPrefix
+
+
+@dataclass
+class JobResult:
+  key: Any
+  result: Any = None
+  error: str | None = None
+  wall_time: float = 0.
+
+
+def run_job(fn: Callable, key: Any, args: tuple) -> JobResult:
+  """
+    Runs one job under its own OpenpilotPrefix, so jobs running at the same time don't share params,
+    msgq or fake event paths. The download cache is shared.
+  """
+  start = time.monotonic()
+  with OpenpilotPrefix(shared_download_cache=True):
+    try:
+      result = fn(*args)
+    except Exception:
+      return JobResult(key, error=traceback.format_exc(), wall_time=time.monotonic() - start)
+  return JobResult(key, result, wall_time=time.monotonic() - start)
+
+
+def run_jobs(fn: Callable, jobs: Iterable[tuple[Any, tuple]], workers: int = 1) -> Iterator[JobResult]:
+  """
+    Runs fn(*args) for each (key, args) job across a pool of worker processes and yields the results
+    as jobs finish, in completion order. A failing job is reported in its result instead of stopping the run.
+  """
+  jobs = list(jobs)
+  if workers <= 1:
+    for key, args in jobs:
+      yield run_job(fn, key, args)
+    return
+
+  with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+    futures = [pool.submit(run_job, fn, key, args) for key, args in jobs]
+    try:
+      for future in concurrent.futures.as_completed(futures):
+        yield future.result()
+    finally:
+      for future in futures:
+        future.cancel()
+
+
+def format_job_times(results: Iterable[JobResult], top: int = 10) -> str:
+  results = sorted(results, key=lambda r: r.wall_time, reverse=True)
+  total = sum(r.wall_time for r in results)
+  ret = f"{len(results)} jobs, {total:.1f}s total job time, slowest:\n"
+  for r in results[:top]:
+    ret += f"  {r.wall_time:7.1f}s  {r.key}\n"
+  return ret
@@ -0,0 +1,37 @@
+import cereal.messaging as messaging
+from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs
+
+
+def make_log(n, v_ego_offset=0., mono_time_offset=0, lag_offset=0., init_cruise_state=False):
+  msgs = []
+  for i in range(n):
+    msg = messaging.new_message("carState" if i % 2 else "longitudinalPlan")
+    msg.logMonoTime = i * 1000 + mono_time_offset
+    if msg.which() == "carState":
+      msg.carState.vEgo = i + v_ego_offset
+      msg.carState.cumLagMs = i + lag_offset
+      if init_cruise_state:
+        msg.carState.cruiseState.available = False
+    else:
+      msg.longitudinalPlan.solverExecutionTime = lag_offset
+    msgs.append(msg.as_reader())
+  return msgs
+
+
+class TestCompareLogs:
+  def test_ignored_fields(self):
+    ignore = ["logMonoTime", "carState.cumLagMs", "longitudinalPlan.solverExecutionTime"]
+    assert compare_logs(make_log(20), make_log(20, mono_time_offset=5, lag_offset=3.), ignore) == []
+    assert len(compare_logs(make_log(20), make_log(20, lag_offset=3.), ["logMonoTime"])) == 20
+
+  def test_tolerance(self):
+    assert compare_logs(make_log(20), make_log(20, v_ego_offset=1e-4), tolerance=1e-3) == []
+    diff = compare_logs(make_log(20), make_log(20, v_ego_offset=1.), tolerance=1e-3)
+    assert len(diff) == 10
+    assert all(d[:2] == ("change", "carState.vEgo") for d in diff)
+
+  def test_different_sizes(self):
+    # a struct set to its defaults is only in one of the logs, the messages are equal but differ in size
+    assert compare_logs(make_log(20), make_log(20, mono_time_offset=5, init_cruise_state=True), ["logMonoTime"]) == []
+    diff = compare_logs(make_log(20), make_log(20, v_ego_offset=1., init_cruise_state=True))
+    assert [d[1] for d in diff] == ["carState.vEgo"] * 10
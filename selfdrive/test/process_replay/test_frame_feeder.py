@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import cereal.messaging as messaging
+from openpilot.selfdrive.test.process_replay.frame_feeder import FrameFeeder, NV12Layout
+
+
+class FakeFrameReader:
+  def __init__(self, w, h, frame_count):
+    self.w, self.h = w, h
+    rng = np.random.default_rng(0)
+    self.frames = [rng.integers(0, 256, w * h * 3 // 2, dtype=np.uint8) for _ in range(frame_count)]
+    self.reads = []
+
+  def get(self, fidx):
+    self.reads.append(fidx)
+    return self.frames[fidx]
+
+
+def repack(frame, w, h):
+  # the per-frame repacking the feeder replaces
+  layout = NV12Layout(w, h)
+  padded_img = np.zeros(((layout.uv_offset // layout.stride) + (h // 2), layout.stride))
+  padded_img[:h, :w] = frame[:h * w].reshape((-1, w))
+  padded_img[layout.uv_offset // layout.stride:layout.uv_offset // layout.stride + h // 2, :w] = frame[h * w:].reshape((-1, w))
+  img_bytes = np.zeros((layout.size,), dtype=np.uint8)
+  img_bytes[:padded_img.size] = padded_img.flatten()
+  return img_bytes
+
+
+def camera_states(frame_ids):
+  msgs = []
+  for i, fid in enumerate(frame_ids):
+    msg = messaging.new_message("roadCameraState", logMonoTime=i)
+    msg.roadCameraState.frameId = fid
+    msgs.append(msg.as_reader())
+  return msgs
+
+
+class TestFrameFeeder:
+  @pytest.mark.parametrize("w, h", [(1928, 1208), (1344, 760), (526, 330)])
+  def test_layout(self, w, h):
+    fr = FakeFrameReader(w, h, 2)
+    layout = NV12Layout(w, h)
+    buf = layout.new_buffer()
+    for frame in fr.frames:
+      assert np.array_equal(layout.fill(buf, frame), repack(frame, w, h))
+
+  def test_prefetch(self):
+    fr = FakeFrameReader(526, 330, 40)
+    frame_ids = [0, 1, 2, 2, 5, *range(6, 40)]
+    feeder = FrameFeeder({"roadCameraState": fr}, camera_states(frame_ids), ["roadCameraState"], pool_size=4)
+    try:
+      for fid in frame_ids:
+        assert np.array_equal(feeder.get("roadCameraState", fid), repack(fr.frames[fid], fr.w, fr.h))
+      assert fr.reads == frame_ids
+
+      # frames that weren't prefetched are read on demand
+      assert np.array_equal(feeder.get("roadCameraState", 3), repack(fr.frames[3], fr.w, fr.h))
+    finally:
+      feeder.stop()
+
+  def test_stop(self):
+    fr = FakeFrameReader(526, 330, 40)
+    feeder = FrameFeeder({"roadCameraState": fr}, camera_states(range(40)), ["roadCameraState"], pool_size=2)
+    feeder.get("roadCameraState", 0)
+    feeder.stop()
+    assert len(fr.reads) < 40
@@ -14,7 +14,9 @@ import openpilot.selfdrive.test.process_replay.process_replay as pr
 # TODO: Make each one testable
 NOT_TESTED = ['selfdrived', 'controlsd', 'card', 'plannerd', 'calibrationd', 'dmonitoringd', 'paramsd', 'dmonitoringmodeld', 'modeld']
 
-TEST_CASES = [(cfg.proc_name, copy.deepcopy(cfg)) for cfg in pr.CONFIGS if cfg.proc_name not in NOT_TESTED]
+# processes which support it are fuzzed in process as well as through msgq
+TEST_CASES = [(cfg.proc_name, copy.deepcopy(cfg), in_process) for cfg in pr.CONFIGS if cfg.proc_name not in NOT_TESTED
+              for in_process in ((False, True) if cfg.in_process else (False,))]
 MAX_EXAMPLES = int(os.environ.get("MAX_EXAMPLES", "10"))
 
 class TestFuzzProcesses:
@@ -24,8 +26,8 @@ class TestFuzzProcesses:
   @given(st.data())
   @settings(phases=[Phase.generate, Phase.target], max_examples=MAX_EXAMPLES, deadline=1000,
             suppress_health_check=[HealthCheck.too_slow, HealthCheck.data_too_large])
-  def test_fuzz_process(self, proc_name, cfg, data):
+  def test_fuzz_process(self, proc_name, cfg, in_process, data):
     msgs = FuzzyGenerator.get_random_event_msg(data.draw, events=cfg.pubs, real_floats=True)
     lr = [log.Event.new_message(**m).as_reader() for m in msgs]
     cfg.timeout = 5
-    pr.replay_process(cfg, lr, fingerprint=TOYOTA.TOYOTA_COROLLA_TSS2, disable_progress=True)
+    pr.replay_process(cfg, lr, fingerprint=TOYOTA.TOYOTA_COROLLA_TSS2, disable_progress=True, in_process=in_process)
@@ -0,0 +1,22 @@
+from openpilot.common.parameterized import parameterized
+
+from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs
+from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS, replay_process
+from openpilot.selfdrive.test.process_replay.test_processes import segments
+from openpilot.tools.lib.logreader import LogReader
+from openpilot.tools.lib.openpilotci import get_url
+
+IN_PROCESS_CONFIGS = [(cfg.proc_name, cfg) for cfg in CONFIGS if cfg.in_process]
+TEST_SEGMENT = next(segment for car, segment in segments if car == "TOYOTA")
+
+
+class TestInProcessReplay:
+  @parameterized.expand(IN_PROCESS_CONFIGS)
+  def test_matches_msgq_replay(self, proc_name, cfg):
+    route, sidx = TEST_SEGMENT.rsplit("--", 1)
+    lr = list(LogReader(get_url(route, sidx, "rlog.zst")))
+
+    ref = replay_process(cfg, lr, disable_progress=True)
+    out = replay_process(cfg, lr, disable_progress=True, in_process=True)
+    # only wall time measurements (e.g. solver execution times) are ignored, everything else is identical
+    assert compare_logs(ref, out, [f for f in cfg.ignore if f != "logMonoTime"], tolerance=0) == []
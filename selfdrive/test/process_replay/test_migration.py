@@ -0,0 +1,77 @@
+import random
+import pytest
+
+import cereal.messaging as messaging
+from openpilot.selfdrive.controls.lib.drive_helpers import CONTROL_N
+from openpilot.selfdrive.test.process_replay.migration import migrate, migrate_stream, migrate_carOutput, migrate_carState, \
+                                                               migrate_controlsState, migrate_longitudinalPlan
+
+MIGRATIONS = [migrate_carOutput, migrate_controlsState, migrate_carState]
+
+
+def make_log(seconds=10):
+  rnd = random.Random(0)
+  msgs = []
+  for i in range(seconds * 100):
+    # slightly out of order, like in rlogs
+    t = 10**9 + i * 10**7 + rnd.randint(-10**6, 10**6)
+    cs = messaging.new_message('controlsState', logMonoTime=t)
+    cs.controlsState.vCruiseDEPRECATED = rnd.random() * 30
+    msgs.append(cs.as_reader())
+
+    car_state = messaging.new_message('carState', logMonoTime=t + 1)
+    car_state.carState.vCruise = rnd.random() * 30
+    msgs.append(car_state.as_reader())
+    msgs.append(messaging.new_message('carControl', logMonoTime=t + 2).as_reader())
+  return msgs
+
+
+class TestMigration:
+  def test_stream_matches_batch(self):
+    lr = make_log()
+    expected = [m.as_builder().to_bytes() for m in migrate(lr, MIGRATIONS)]
+    assert [m.which() for m in migrate(lr, MIGRATIONS)].count('selfdriveState') == 1000
+
+    read = 0
+    def msgs():
+      nonlocal read
+      for m in lr:
+        read += 1
+        yield m
+
+    stream = migrate_stream(msgs(), MIGRATIONS, lookahead=10**9)
+    first = next(stream)
+    # only the lookahead is read before migrated messages come out
+    assert read < len(lr) // 5
+    assert [m.as_builder().to_bytes() for m in [first, *stream]] == expected
+
+  def test_product_exists(self):
+    lr = make_log(1) + [messaging.new_message('carOutput', logMonoTime=10**9).as_reader()]
+    assert [m.which() for m in migrate_stream(lr, MIGRATIONS)].count('carOutput') == 1
+
+  def test_out_of_order(self):
+    lr = make_log()
+    late = messaging.new_message('carControl', logMonoTime=lr[0].logMonoTime)
+    with pytest.raises(AssertionError):
+      list(migrate_stream(lr + [late.as_reader()], MIGRATIONS, lookahead=10**9))
+
+  def test_longitudinal_plan(self):
+    # parked for longer than the lookahead, then driving with aTarget set
+    lr = [messaging.new_message('carParams', logMonoTime=1).as_reader()]
+    for i in range(200):
+      lp = messaging.new_message('longitudinalPlan', logMonoTime=10**9 + i * 10**8)
+      lp.longitudinalPlan.accels = [1.0] * CONTROL_N
+      lp.longitudinalPlan.speeds = [1.0] * CONTROL_N
+      lp.longitudinalPlan.aTarget = 0.0 if i < 150 else 1.5
+      lr.append(lp.as_reader())
+
+    for lookahead in (None, 10**9):
+      migrated = [m.longitudinalPlan.aTarget for m in migrate_stream(lr, [migrate_longitudinalPlan], lookahead) if m.which() == 'longitudinalPlan']
+      # logs with aTarget are never migrated past the point it's known they have it
+      assert migrated[150:] == [1.5] * 50
+      if lookahead is None:
+        assert migrated[:150] == [0.0] * 150
+
+    # logs from before aTarget are migrated throughout
+    old_lr = [m for m in lr if m.which() != 'longitudinalPlan' or m.longitudinalPlan.aTarget == 0.0]
+    assert all(m.longitudinalPlan.aTarget != 0.0 for m in migrate_stream(old_lr, [migrate_longitudinalPlan]) if m.which() == 'longitudinalPlan')
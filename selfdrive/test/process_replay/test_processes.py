@@ -13,6 +13,9 @@ from openpilot.tools.lib.openpilotci import get_url
 from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs, format_diff
 from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS, PROC_REPLAY_DIR, FAKEDATA, replay_process, \
                                                                    check_most_messages_valid
+from openpilot.selfdrive.test.process_replay.replay_cache import load_replay, log_fingerprint, process_fingerprints, replay_cache_key, \
+                                                                  replay_cache_path, save_replay
+from openpilot.selfdrive.test.process_replay.runner import format_job_times, run_jobs
 from openpilot.tools.lib.filereader import FileReader
 from openpilot.tools.lib.logreader import LogReader, save_log
 from openpilot.tools.lib.url_file import URLFile
@@ -70,13 +73,12 @@ REF_COMMIT_FN = os.path.join(PROC_REPLAY_DIR, "ref_commit")
 EXCLUDED_PROCS = {"modeld", "dmonitoringmodeld"}
 
 
-def run_test_process(data):
-  segment, cfg, args, cur_log_fn, ref_log_path, lr_dat = data
+def run_test_process(segment, cfg, args, cur_log_fn, ref_log_path, lr_dat, cache_key=None):
   lr = LogReader.from_bytes(lr_dat)
-  res, log_msgs = test_process(cfg, lr, segment, ref_log_path, cur_log_fn, args.ignore_fields, args.ignore_msgs)
+  res, log_msgs = test_process(cfg, lr, segment, ref_log_path, cur_log_fn, args.ignore_fields, args.ignore_msgs, cache_key)
   # save logs so we can update refs
   save_log(cur_log_fn, log_msgs)
-  return (segment, cfg.proc_name, res)
+  return res
 
 
 def get_log_data(segment):
@@ -85,7 +87,7 @@ def get_log_data(segment):
     return (segment, f.read())
 
 
-def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=None, ignore_msgs=None):
+def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=None, ignore_msgs=None, cache_key=None):
   if ignore_fields is None:
     ignore_fields = []
   if ignore_msgs is None:
@@ -93,10 +95,16 @@ def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=Non
 
   ref_log_msgs = list(LogReader(ref_log_path))
 
-  try:
-    log_msgs = replay_process(cfg, lr, disable_progress=True)
-  except Exception as e:
-    raise Exception("failed on segment: " + segment) from e
+  # outputs of a previous replay with the same process source, config and input
+  log_msgs = load_replay(cache_key) if cache_key is not None else None
+  if log_msgs is None:
+    try:
+      log_msgs = replay_process(cfg, lr, disable_progress=True)
+    except Exception as e:
+      raise Exception("failed on segment: " + segment) from e
+
+    if cache_key is not None:
+      save_replay(cache_key, log_msgs)
 
   if not check_most_messages_valid(log_msgs):
     return f"Route did not have enough valid messages: {new_log_path}", log_msgs
@@ -137,6 +145,8 @@ if __name__ == "__main__":
                       help="Updates reference logs using current commit")
   parser.add_argument("-j", "--jobs", type=int, default=max(cpu_count - 2, 1),
                       help="Max amount of parallel jobs")
+  parser.add_argument("--replay-cache", action=argparse.BooleanOptionalAction, default="CI" not in os.environ,
+                      help="Reuse the outputs of unchanged processes instead of replaying all of them, off by default in CI")
   args = parser.parse_args()
 
   tested_procs = set(args.whitelist_procs) - set(args.blacklist_procs)
@@ -174,36 +184,51 @@ if __name__ == "__main__":
     for segment, lr in tqdm(p1, desc="Getting Logs", total=len(download_segments)):
       log_data[segment] = lr
 
-    pool_args: Any = []
-    for car_brand, segment in segments:
-      if car_brand not in tested_cars:
+  # reference logs are always regenerated from a fresh replay
+  use_replay_cache = args.replay_cache and not args.update_refs
+  process_fps = process_fingerprints(cfg for cfg in CONFIGS if cfg.proc_name in tested_procs) if use_replay_cache else {}
+  log_fps = {segment: log_fingerprint(dat) for segment, dat in log_data.items()} if use_replay_cache else {}
+
+  jobs: Any = []
+  cached_jobs = 0
+  for car_brand, segment in segments:
+    if car_brand not in tested_cars:
+      continue
+
+    for cfg in CONFIGS:
+      if cfg.proc_name not in tested_procs:
+        continue
+
+      # to speed things up, we only test all segments on card
+      if cfg.proc_name not in ('card', 'controlsd', 'lagd') and car_brand not in ('HYUNDAI', 'TOYOTA'):
         continue
 
-      for cfg in CONFIGS:
-        if cfg.proc_name not in tested_procs:
-          continue
+      cur_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{cur_commit}.zst".replace("|", "_"))
+      if args.update_refs:  # reference logs will not exist if routes were just regenerated
+        route, seg_num = segment.rsplit("--", 1)
+        ref_log_path = get_url(route, seg_num, "rlog.zst")
+      else:
+        ref_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{ref_commit}.zst".replace("|", "_"))
+        ref_log_path = ref_log_fn if os.path.exists(ref_log_fn) else BASE_URL + os.path.basename(ref_log_fn)
 
-        # to speed things up, we only test all segments on card
-        if cfg.proc_name not in ('card', 'controlsd', 'lagd') and car_brand not in ('HYUNDAI', 'TOYOTA'):
-          continue
+      cache_key = replay_cache_key(process_fps[cfg.proc_name], log_fps[segment]) if use_replay_cache else None
+      cached_jobs += cache_key is not None and os.path.exists(replay_cache_path(cache_key))
+      jobs.append(((segment, cfg.proc_name), (segment, cfg, args, cur_log_fn, ref_log_path, log_data[segment], cache_key)))
 
-        cur_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{cur_commit}.zst".replace("|", "_"))
-        if args.update_refs:  # reference logs will not exist if routes were just regenerated
-          route, seg_num = segment.rsplit("--", 1)
-          ref_log_path = get_url(route, seg_num, "rlog.zst")
-        else:
-          ref_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{ref_commit}.zst".replace("|", "_"))
-          ref_log_path = ref_log_fn if os.path.exists(ref_log_fn) else BASE_URL + os.path.basename(ref_log_fn)
+      log_paths[segment][cfg.proc_name]['ref'] = ref_log_path
+      log_paths[segment][cfg.proc_name]['new'] = cur_log_fn
 
-        pool_args.append((segment, cfg, args, cur_log_fn, ref_log_path, log_data[segment]))
+  if use_replay_cache:
+    print(f"{cached_jobs}/{len(jobs)} jobs have cached replay outputs")
 
-        log_paths[segment][cfg.proc_name]['ref'] = ref_log_path
-        log_paths[segment][cfg.proc_name]['new'] = cur_log_fn
+  # each (segment, process) job runs in a separate worker under its own prefix, results come back as jobs finish
+  job_results = {r.key: r for r in tqdm(run_jobs(run_test_process, jobs, args.jobs), desc="Running Tests", total=len(jobs))}
+  print(format_job_times(job_results.values()))
 
-    results: Any = defaultdict(dict)
-    p2 = pool.map(run_test_process, pool_args)
-    for (segment, proc, result) in tqdm(p2, desc="Running Tests", total=len(pool_args)):
-      results[segment][proc] = result
+  results: Any = defaultdict(dict)
+  for (segment, proc), _ in jobs:
+    job_result = job_results[(segment, proc)]
+    results[segment][proc] = job_result.result if job_result.error is None else job_result.error
 
   diff_short, diff_long, failed = format_diff(results, log_paths, ref_commit)
   if not args.update_refs:
@@ -0,0 +1,45 @@
+import sys
+from dataclasses import replace
+
+import cereal.messaging as messaging
+from openpilot.common.prefix import OpenpilotPrefix
+from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS
+from openpilot.selfdrive.test.process_replay.replay_cache import environment_fingerprint, load_replay, process_fingerprints, replay_cache_key, \
+                                                                  save_replay
+
+RADARD_CFG = next(cfg for cfg in CONFIGS if cfg.proc_name == "radard")
+
+
+class TestReplayCache:
+  def test_process_fingerprints(self):
+    changed_cfg = replace(RADARD_CFG, processing_time=RADARD_CFG.processing_time * 2)
+    fps = process_fingerprints([RADARD_CFG])
+    assert fps == process_fingerprints([RADARD_CFG])
+
+    # the replay config is part of the fingerprint
+    assert fps["radard"] != process_fingerprints([changed_cfg])["radard"]
+    assert replay_cache_key(fps["radard"], "a") != replay_cache_key(fps["radard"], "b")
+
+  def test_environment_fingerprint(self, monkeypatch):
+    fp = process_fingerprints([RADARD_CFG])["radard"]
+    environment_fingerprint.cache_clear()
+    monkeypatch.setattr(sys, "version", sys.version + "+")
+    try:
+      # e.g. a different interpreter or package versions
+      assert process_fingerprints([RADARD_CFG])["radard"] != fp
+    finally:
+      environment_fingerprint.cache_clear()
+
+  def test_save_load(self):
+    msgs = []
+    for i in range(10):
+      msg = messaging.new_message("carState")
+      msg.logMonoTime = i
+      msg.carState.vEgo = i
+      msgs.append(msg.as_reader())
+
+    with OpenpilotPrefix():
+      assert load_replay("test") is None
+      save_replay("test", msgs)
+      cached = load_replay("test")
+      assert [m.as_builder().to_bytes() for m in cached] == [m.as_builder().to_bytes() for m in msgs]
@@ -0,0 +1,24 @@
+import os
+
+from openpilot.selfdrive.test.process_replay.runner import run_jobs
+
+
+def get_prefix(x):
+  if x < 0:
+    raise ValueError("negative")
+  return x, os.environ["OPENPILOT_PREFIX"]
+
+
+class TestRunner:
+  def test_run_jobs(self):
+    jobs = [(i, (i,)) for i in range(-1, 6)]
+    results = {r.key: r for r in run_jobs(get_prefix, jobs, workers=2)}
+    assert set(results) == set(range(-1, 6))
+
+    assert results[-1].result is None
+    assert "ValueError: negative" in results[-1].error
+
+    # each job runs under its own prefix
+    prefixes = {results[i].result[1] for i in range(6)}
+    assert len(prefixes) == 6
+    assert all(results[i].result[0] == i and results[i].wall_time >= 0 for i in range(6))
@@ -1,3 +1,4 @@
+import json
 import os
 import random
 from pathlib import Path
@@ -53,6 +54,18 @@ class MockApiIgnore:
   def get_token(self):
     return "fake-token"
 
+class MockApiServer:
+  url = ""
+
+  def __init__(self, dongle_id):
+    pass
+
+  def get(self, *args, **kwargs):
+    return MockResponse(json.dumps({"url": f"{self.url}/{kwargs['path']}", "headers": {}}), 200)
+
+  def get_token(self):
+    return "fake-token"
+
 class UploaderTestCase:
   f_type = "UNKNOWN"
 
@@ -65,11 +78,17 @@ class UploaderTestCase:
   def set_ignore(self):
     uploader.Api = MockApiIgnore
 
+  def set_server(self, url: str):
+    MockApiServer.url = url
+    uploader.Api = MockApiServer
+    uploader.fake_upload = False
+
   def setup_method(self):
     uploader.Api = MockApi
     uploader.fake_upload = True
     uploader.force_wifi = True
     uploader.allow_sleep = False
+    uploader.max_bandwidth = 0.
     self.seg_num = random.randint(1, 300)
     self.seg_format = "00000004--0ac3964c96--{}"
     self.seg_format2 = "00000005--4c4e99b08b--{}"
@@ -3,10 +3,14 @@ import time
 import threading
 import logging
 import json
+import http.server
+import zstandard as zstd
 from pathlib import Path
 from openpilot.system.hardware.hw import Paths
 
 from openpilot.common.swaglog import cloudlog
+from openpilot.selfdrive.test.helpers import http_server_context
+from openpilot.system.loggerd import uploader
 from openpilot.system.loggerd.uploader import main, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE
 
 from openpilot.system.loggerd.tests.loggerd_tests_common import UploaderTestCase
@@ -18,12 +22,15 @@ class FakeLogHandler(logging.Handler):
     self.reset()
 
   def reset(self):
+    self.upload_start = list()
     self.upload_order = list()
     self.upload_ignored = list()
 
   def emit(self, record):
     try:
       j = json.loads(record.getMessage())
+      if j["event"] == "upload_start":
+        self.upload_start.append(j["key"])
       if j["event"] == "upload_success":
         self.upload_order.append(j["key"])
       if j["event"] == "upload_ignored":
@@ -35,6 +42,46 @@ log_handler = FakeLogHandler()
 cloudlog.addHandler(log_handler)
 
 
+class UploadServerHandler(http.server.BaseHTTPRequestHandler):
+  # keep-alive, so the uploader can reuse connections
+  protocol_version = "HTTP/1.1"
+  lock = threading.Lock()
+  delay = 0.
+  uploads: list[tuple[str, bytes]] = []
+  connections = 0
+  in_flight = 0
+  max_in_flight = 0
+
+  @classmethod
+  def reset(cls, delay: float = 0.):
+    cls.delay = delay
+    cls.uploads, cls.connections, cls.in_flight, cls.max_in_flight = [], 0, 0, 0
+
+  def setup(self):
+    super().setup()
+    with self.lock:
+      UploadServerHandler.connections += 1
+
+  def do_PUT(self):
+    with self.lock:
+      UploadServerHandler.in_flight += 1
+      UploadServerHandler.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    data = self.rfile.read(int(self.headers['Content-Length']))
+    # a far away server
+    time.sleep(self.delay)
+
+    with self.lock:
+      UploadServerHandler.in_flight -= 1
+      self.uploads.append((self.path.lstrip("/"), data))
+    self.send_response(201, "Created")
+    self.send_header("Content-Length", "0")
+    self.end_headers()
+
+  def log_message(self, *args):
+    pass
+
+
 class TestUploader(UploaderTestCase):
   def setup_method(self):
     super().setup_method()
@@ -59,6 +106,11 @@ class TestUploader(UploaderTestCase):
       f_paths.append(self.make_file_with_data("boot", f"{self.seg_dir}", 1, lock=lock, upload_xattr=xattr))
     return f_paths
 
+  def wait_for_server_uploads(self, n: int, timeout: float = 10.) -> None:
+    start_time = time.monotonic()
+    while len(UploadServerHandler.uploads) < n and time.monotonic() - start_time < timeout:
+      time.sleep(0.05)
+
   def gen_order(self, seg1: list[int], seg2: list[int], boot=True) -> list[str]:
     keys = []
     if boot:
@@ -84,7 +136,8 @@ class TestUploader(UploaderTestCase):
     for f_path in exp_order:
       assert os.getxattr((Path(Paths.log_root()) / f_path).with_suffix(""), UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE, "All files not uploaded"
 
-    assert log_handler.upload_order == exp_order, "Files uploaded in wrong order"
+    assert sorted(log_handler.upload_order) == sorted(exp_order), "Files not uploaded"
+    assert log_handler.upload_start == exp_order, "Files uploaded in wrong order"
 
   def test_upload_with_wrong_xattr(self):
     self.gen_files(lock=False, xattr=b'0')
@@ -102,7 +155,8 @@ class TestUploader(UploaderTestCase):
     for f_path in exp_order:
       assert os.getxattr((Path(Paths.log_root()) / f_path).with_suffix(""), UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE, "All files not uploaded"
 
-    assert log_handler.upload_order == exp_order, "Files uploaded in wrong order"
+    assert sorted(log_handler.upload_order) == sorted(exp_order), "Files not uploaded"
+    assert log_handler.upload_start == exp_order, "Files uploaded in wrong order"
 
   def test_upload_ignored(self):
     self.set_ignore()
@@ -121,7 +175,8 @@ class TestUploader(UploaderTestCase):
     for f_path in exp_order:
       assert os.getxattr((Path(Paths.log_root()) / f_path).with_suffix(""), UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE, "All files not ignored"
 
-    assert log_handler.upload_ignored == exp_order, "Files ignored in wrong order"
+    assert sorted(log_handler.upload_ignored) == sorted(exp_order), "Files not ignored"
+    assert log_handler.upload_start == exp_order, "Files ignored in wrong order"
 
   def test_upload_files_in_create_order(self):
     seg1_nums = [0, 1, 2, 10, 20]
@@ -146,7 +201,8 @@ class TestUploader(UploaderTestCase):
     for f_path in exp_order:
       assert os.getxattr((Path(Paths.log_root()) / f_path).with_suffix(""), UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE, "All files not uploaded"
 
-    assert log_handler.upload_order == exp_order, "Files uploaded in wrong order"
+    assert sorted(log_handler.upload_order) == sorted(exp_order), "Files not uploaded"
+    assert log_handler.upload_start == exp_order, "Files uploaded in wrong order"
 
   def test_no_upload_with_lock_file(self):
     self.start_thread()
@@ -163,6 +219,72 @@ class TestUploader(UploaderTestCase):
       uploaded = UPLOAD_ATTR_NAME in os.listxattr(fn) and os.getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
       assert not uploaded, "File upload when locked"
 
+  def test_upload_when_unlocked(self):
+    self.start_thread()
+
+    time.sleep(0.25)
+    f_paths = self.gen_files(lock=True, boot=False)
+    time.sleep(0.25)
+
+    # the segment is closed while the uploader is running
+    for f_path in f_paths:
+      f_path.with_suffix(f_path.suffix + ".lock").unlink()
+
+    # allow enough time that files could upload twice if there is a bug in the logic
+    time.sleep(1)
+    self.join_thread()
+
+    exp_order = self.gen_order([self.seg_num], [], boot=False)
+    assert sorted(log_handler.upload_order) == sorted(exp_order), "Files not uploaded once unlocked"
+    assert log_handler.upload_start == exp_order, "Files uploaded in wrong order"
+
+  def test_upload_to_server(self):
+    seg_nums = list(range(12))
+    f_paths = []
+    for i in seg_nums:
+      self.seg_dir = self.seg_format.format(i)
+      f_paths.append(self.make_file_with_data(self.seg_dir, "qlog", 0.1))
+    exp_order = self.gen_order(seg_nums, [], boot=False)
+
+    UploadServerHandler.reset(delay=0.1)
+    with http_server_context(UploadServerHandler, server_class=http.server.ThreadingHTTPServer) as (host, port):
+      self.set_server(f"http://{host}:{port}")
+      self.start_thread()
+      self.wait_for_server_uploads(len(exp_order))
+      self.join_thread()
+
+    uploads = dict(UploadServerHandler.uploads)
+    assert len(UploadServerHandler.uploads) == len(exp_order), "Some files were not uploaded once"
+    assert log_handler.upload_start == exp_order, "Files uploaded in wrong order"
+    for key, f_path in zip(exp_order, f_paths, strict=True):
+      assert zstd.ZstdDecompressor().decompressobj().decompress(uploads[key]) == f_path.read_bytes(), "Wrong data uploaded"
+
+    # latency bound, so more uploads at once get more throughput
+    assert UploadServerHandler.max_in_flight > 1, "Files not uploaded concurrently"
+    assert UploadServerHandler.connections < len(exp_order), "Connections not reused"
+
+  def test_upload_bandwidth_limit(self):
+    seg_nums = list(range(4))
+    for i in seg_nums:
+      self.seg_dir = self.seg_format.format(i)
+      self.make_file_with_data(self.seg_dir, "qlog", 0.25)
+    exp_order = self.gen_order(seg_nums, [], boot=False)
+
+    uploader.max_bandwidth = 2.
+    UploadServerHandler.reset()
+    with http_server_context(UploadServerHandler, server_class=http.server.ThreadingHTTPServer) as (host, port):
+      self.set_server(f"http://{host}:{port}")
+      start_time = time.monotonic()
+      self.start_thread()
+      self.wait_for_server_uploads(len(exp_order))
+      dt = time.monotonic() - start_time
+      self.join_thread()
+
+    assert len(UploadServerHandler.uploads) == len(exp_order), "Some files were not uploaded once"
+    sz = sum(len(data) for _, data in UploadServerHandler.uploads)
+    # all the uploads share the limit, only the burst goes through right away
+    assert dt > (sz - uploader.max_bandwidth * 1e6 * uploader.BANDWIDTH_BURST) / (uploader.max_bandwidth * 1e6), "Bandwidth limit exceeded"
+
   def test_no_upload_with_xattr(self):
     self.gen_files(lock=False, xattr=UPLOAD_ATTR_VALUE)
 
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import bisect
 import json
 import os
 import random
@@ -8,11 +9,14 @@ import time
 import traceback
 import datetime
 from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait as wait_futures
+from requests.adapters import HTTPAdapter
 
 from cereal import log
 import cereal.messaging as messaging
 from openpilot.common.api import Api
-from openpilot.common.utils import get_upload_stream
+from openpilot.common.inotify import Inotify, IN_CREATE, IN_DELETE, IN_IGNORED, IN_ISDIR, IN_MOVED_FROM, IN_MOVED_TO, IN_ONLYDIR, IN_Q_OVERFLOW
+from openpilot.common.utils import CallbackReader, get_upload_stream
 from openpilot.common.params import Params
 from openpilot.common.realtime import set_core_affinity
 from openpilot.system.hardware.hw import Paths
@@ -29,9 +33,18 @@ MAX_UPLOAD_SIZES = {
   "qcam": 5*1e6,
 }
 
+MAX_CONCURRENT_UPLOADS = 4
+BANDWIDTH_BURST = 0.1  # s of the bandwidth limit that can go at once
+
 allow_sleep = bool(int(os.getenv("UPLOADER_SLEEP", "1")))
 force_wifi = os.getenv("FORCEWIFI") is not None
 fake_upload = os.getenv("FAKEUPLOAD") is not None
+max_bandwidth = float(os.getenv("UPLOADER_MAX_BANDWIDTH", "0"))  # MB/s shared by all the uploads, 0 for no limit
+
+# keep the connections to the upload server alive between uploads
+UPLOAD_SESS = requests.Session()
+UPLOAD_SESS.mount("http://", HTTPAdapter(pool_maxsize=MAX_CONCURRENT_UPLOADS))
+UPLOAD_SESS.mount("https://", HTTPAdapter(pool_maxsize=MAX_CONCURRENT_UPLOADS))
 
 
 class FakeRequest:
@@ -73,6 +86,224 @@ def clear_locks(root: str) -> None:
       cloudlog.exception("clear_locks failed")
 
 
+class TokenBucket:
+  """Rate limit shared by threads, a consumer goes into debt and waits it out"""
+  def __init__(self, rate: float, capacity: float):
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity
+    self.last_t = time.monotonic()
+    self.lock = threading.Lock()
+
+  def consume(self, n: float) -> None:
+    with self.lock:
+      t = time.monotonic()
+      self.tokens = min(self.capacity, self.tokens + (t - self.last_t) * self.rate) - n
+      self.last_t = t
+      wait_t = -self.tokens / self.rate
+    if wait_t > 0:
+      time.sleep(wait_t)
+
+  def reader(self, stream):
+    """stream with reads that wait for their bytes"""
+    total_consumed = 0
+
+    def consume_read(total_read: int) -> None:
+      nonlocal total_consumed
+      self.consume(total_read - total_consumed)
+      total_consumed = total_read
+
+    return CallbackReader(stream, consume_read)
+
+
+class UploadConcurrency:
+  """
+  How many files to upload at once. The total throughput is measured over a few uploads at each limit, and the limit
+  keeps moving by one in the same direction while the throughput goes up and turns around when it doesn't, so it
+  settles around the most the link can take. A failed upload brings it back to one.
+  """
+  def __init__(self, max_uploads: int, min_gain: float = 0.1):
+    self.max_uploads = max_uploads
+    self.min_gain = min_gain
+    self.reset()
+
+  def reset(self) -> None:
+    self.limit = 1
+    self.direction = 1
+    self.last_throughput = 0.0
+    self.start_window()
+
+  def start_window(self) -> None:
+    self.window_start_t = time.monotonic()
+    self.window_bytes = 0
+    self.window_uploads = 0
+
+  def update(self, sz: int, success: bool) -> None:
+    if not success:
+      self.reset()
+      return
+
+    self.window_bytes += sz
+    self.window_uploads += 1
+    if self.window_uploads < 2 * self.limit:
+      return
+
+    throughput = self.window_bytes / max(time.monotonic() - self.window_start_t, 1e-3)
+    if throughput <= self.last_throughput * (1 + self.min_gain):
+      self.direction = -self.direction
+    self.limit = min(max(self.limit + self.direction, 1), self.max_uploads)
+    self.last_throughput = throughput
+    self.start_window()
+
+
+class UploadQueue:
+  """
+  The files the uploader could upload, in upload order. It's seeded with one scan of the log root and then kept up to
+  date with inotify events as segments are created, closed and deleted, so picking the next file doesn't list and stat
+  every segment. Without inotify, e.g. on macOS or when out of watches, it falls back to a full scan on every update.
+  """
+  def __init__(self, root: str, immediate_folders: list[str], immediate_priority: dict[str, int]):
+    self.root = root
+    self.immediate_folders = immediate_folders
+    self.immediate_priority = immediate_priority
+
+    # sorted (folder priority, directory sort, name priority, logdir, name), only of files with no upload xattr
+    self.files: list[tuple] = []
+    self.locks: dict[str, set[str]] = {}
+    self.watches: dict[int, str] = {}
+    self.root_wd: int | None = None
+
+    try:
+      self.inotify: Inotify | None = Inotify()
+    except OSError:
+      cloudlog.warning("uploader inotify unavailable, scanning for files on every update")
+      self.inotify = None
+    self.scan()
+
+  def __iter__(self) -> Iterator[tuple[str, str]]:
+    """logdir and name of the files in upload order, skipping segments that are still being written"""
+    for *_, logdir, name in self.files:
+      if not self.locks.get(logdir):
+        yield logdir, name
+
+  def file_key(self, logdir: str, name: str) -> tuple:
+    return (logdir + "/" not in self.immediate_folders, get_directory_sort(logdir), self.immediate_priority.get(name, 1000), logdir, name)
+
+  def add_file(self, logdir: str, name: str) -> None:
+    if name.endswith(".lock"):
+      self.locks.setdefault(logdir, set()).add(name)
+      return
+
+    # only crash and boot logs, qlogs and qcameras are uploaded
+    if logdir + "/" not in self.immediate_folders and name not in self.immediate_priority:
+      return
+
+    # skip files already uploaded
+    fn = os.path.join(self.root, logdir, name)
+    try:
+      if getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE:
+        return
+    except OSError:
+      cloudlog.event("uploader_getxattr_failed", key=os.path.join(logdir, name), fn=fn)
+      # deleter could have deleted, so skip
+      return
+
+    key = self.file_key(logdir, name)
+    i = bisect.bisect_left(self.files, key)
+    if i == len(self.files) or self.files[i] != key:
+      self.files.insert(i, key)
+
+  def remove_file(self, logdir: str, name: str) -> None:
+    if name.endswith(".lock"):
+      self.locks.get(logdir, set()).discard(name)
+      return
+
+    key = self.file_key(logdir, name)
+    i = bisect.bisect_left(self.files, key)
+    if i < len(self.files) and self.files[i] == key:
+      del self.files[i]
+
+  def add_dir(self, logdir: str) -> None:
+    # watch before listing, so no file is missed in between
+    if self.inotify is not None:
+      try:
+        self.watches[self.inotify.add_watch(os.path.join(self.root, logdir), IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO)] = logdir
+      except OSError:
+        cloudlog.exception("uploader inotify add_watch failed, scanning for files on every update")
+        self.inotify = None
+
+    try:
+      with os.scandir(os.path.join(self.root, logdir)) as entries:
+        for entry in entries:
+          if not entry.is_dir():
+            self.add_file(logdir, entry.name)
+    except OSError:
+      return
+
+  def remove_dir(self, logdir: str) -> None:
+    self.files = [f for f in self.files if f[-2] != logdir]
+    self.locks.pop(logdir, None)
+    for wd, d in list(self.watches.items()):
+      if d == logdir:
+        del self.watches[wd]
+        if self.inotify is not None:
+          self.inotify.rm_watch(wd)
+
+  def scan(self) -> None:
+    if self.inotify is not None:
+      for wd in self.watches:
+        self.inotify.rm_watch(wd)
+      if self.root_wd is not None:
+        self.inotify.rm_watch(self.root_wd)
+    self.files, self.locks, self.watches, self.root_wd = [], {}, {}, None
+
+    if self.inotify is not None and os.path.isdir(self.root):
+      try:
+        self.root_wd = self.inotify.add_watch(self.root, IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR)
+      except OSError:
+        cloudlog.exception("uploader inotify add_watch failed, scanning for files on every update")
+        self.inotify = None
+
+    for logdir in listdir_by_creation(self.root):
+      self.add_dir(logdir)
+
+  def update(self) -> None:
+    if self.inotify is None or self.root_wd is None:
+      # the log root might not be there yet
+      if self.inotify is None or os.path.isdir(self.root):
+        self.scan()
+      return
+
+    for wd, mask, name in self.inotify.read():
+      if mask & IN_Q_OVERFLOW:
+        cloudlog.warning("uploader inotify queue overflow, scanning for files")
+        self.scan()
+        return
+
+      if wd == self.root_wd:
+        if mask & IN_IGNORED:
+          self.scan()
+          return
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+          self.add_dir(name)
+        elif mask & IN_ISDIR and mask & (IN_DELETE | IN_MOVED_FROM):
+          self.remove_dir(name)
+      elif wd in self.watches:
+        logdir = self.watches[wd]
+        if mask & IN_IGNORED:
+          del self.watches[wd]
+        elif mask & IN_ISDIR:
+          continue
+        elif mask & (IN_CREATE | IN_MOVED_TO):
+          self.add_file(logdir, name)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+          self.remove_file(logdir, name)
+
+      if self.inotify is None:
+        # out of watches, the next update scans again
+        return
+
+
 class Uploader:
   def __init__(self, dongle_id: str, root: str):
     self.dongle_id = dongle_id
@@ -86,58 +317,42 @@ class Uploader:
 
     self.immediate_folders = ["crash/", "boot/"]
     self.immediate_priority = {"qlog": 0, "qlog.zst": 0, "qcamera.ts": 1}
+    self.upload_queue = UploadQueue(root, self.immediate_folders, self.immediate_priority)
+
+    self.executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_UPLOADS, thread_name_prefix="upload")
+    # logdir, name and size of the files being uploaded
+    self.uploads: dict[Future, tuple[str, str, int]] = {}
+    self.concurrency = UploadConcurrency(MAX_CONCURRENT_UPLOADS)
+    self.bandwidth = TokenBucket(max_bandwidth * 1e6, max_bandwidth * 1e6 * BANDWIDTH_BURST) if max_bandwidth > 0 else None
 
   def list_upload_files(self, metered: bool) -> Iterator[tuple[str, str, str]]:
     r = self.params.get("AthenadRecentlyViewedRoutes")
     requested_routes = [] if r is None else [route for route in r.split(",") if route]
 
-    for logdir in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logdir)
-      try:
-        names = os.listdir(path)
-      except OSError:
-        continue
-
-      if any(name.endswith(".lock") for name in names):
-        continue
-
-      for name in sorted(names, key=lambda n: self.immediate_priority.get(n, 1000)):
-        key = os.path.join(logdir, name)
-        fn = os.path.join(path, name)
-        # skip files already uploaded
-        try:
-          ctime = os.path.getctime(fn)
-          is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
-        except OSError:
-          cloudlog.event("uploader_getxattr_failed", key=key, fn=fn)
-          # deleter could have deleted, so skip
-          continue
-        if is_uploaded:
-          continue
-
-        # limit uploading on metered connections
-        if metered:
-          dt = datetime.timedelta(hours=12)
-          if logdir in self.immediate_folders and (datetime.datetime.now() - datetime.datetime.fromtimestamp(ctime)) < dt:
+    self.upload_queue.update()
+    for logdir, name in self.upload_queue:
+      key = os.path.join(logdir, name)
+      fn = os.path.join(self.root, key)
+
+      # limit uploading on metered connections
+      if metered:
+        dt = datetime.timedelta(hours=12)
+        if logdir in self.immediate_folders:
+          try:
+            ctime = os.path.getctime(fn)
+          except OSError:
             continue
-
-          if name == "qcamera.ts" and not any(logdir.startswith(r.split('|')[-1]) for r in requested_routes):
+          if (datetime.datetime.now() - datetime.datetime.fromtimestamp(ctime)) < dt:
             continue
 
-        yield name, key, fn
-
-  def next_file_to_upload(self, metered: bool) -> tuple[str, str, str] | None:
-    upload_files = list(self.list_upload_files(metered))
-
-    for name, key, fn in upload_files:
-      if any(f in fn for f in self.immediate_folders):
-        return name, key, fn
+        if name == "qcamera.ts" and not any(logdir.startswith(r.split('|')[-1]) for r in requested_routes):
+          continue
 
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority:
-        return name, key, fn
+      yield name, key, fn
 
-    return None
+  def next_file_to_upload(self, metered: bool) -> tuple[str, str, str] | None:
+    # the queue is in upload order: crash and boot logs, then qlogs and qcameras by segment
+    return next(self.list_upload_files(metered), None)
 
   def do_upload(self, key: str, fn: str):
     url_resp = self.api.get("v1.4/" + self.dongle_id + "/upload_url/", timeout=10, path=key, access_token=self.api.get_token())
@@ -156,21 +371,14 @@ class Uploader:
     try:
       compress = key.endswith('.zst') and not fn.endswith('.zst')
       stream, _ = get_upload_stream(fn, compress)
-      response = requests.put(url, data=stream, headers=headers, timeout=10)
+      data = stream if self.bandwidth is None else self.bandwidth.reader(stream)
+      response = UPLOAD_SESS.put(url, data=data, headers=headers, timeout=10)
       return response
     finally:
       if stream:
         stream.close()
 
-  def upload(self, name: str, key: str, fn: str, network_type: int, metered: bool) -> bool:
-    try:
-      sz = os.path.getsize(fn)
-    except OSError:
-      cloudlog.exception("upload: getsize failed")
-      return False
-
-    cloudlog.event("upload_start", key=key, fn=fn, sz=sz, network_type=network_type, metered=metered)
-
+  def upload(self, name: str, key: str, fn: str, sz: int, network_type: int, metered: bool) -> bool:
     if sz == 0:
       # tag files of 0 size as uploaded
       success = True
@@ -213,17 +421,60 @@ class Uploader:
 
 
   def step(self, network_type: int, metered: bool) -> bool | None:
-    d = self.next_file_to_upload(metered)
-    if d is None:
-      return None
+    """Collects the finished uploads and starts the next ones, None if there's nothing to upload"""
+    success = True
+    for future in [f for f in self.uploads if f.done()]:
+      logdir, name, sz = self.uploads.pop(future)
+      if future.result():
+        self.upload_queue.remove_file(logdir, name)
+        self.concurrency.update(sz, True)
+      else:
+        self.concurrency.update(sz, False)
+        success = False
+
+    # back off before trying again
+    if not success:
+      return False
+
+    limit = 1 if metered else self.concurrency.limit
+    uploading = {(logdir, name) for logdir, name, _ in self.uploads.values()}
+    for name, key, fn in self.list_upload_files(metered):
+      if len(self.uploads) >= limit:
+        break
 
-    name, key, fn = d
+      logdir = os.path.dirname(key)
+      if (logdir, name) in uploading:
+        continue
 
-    # qlogs and bootlogs need to be compressed before uploading
-    if key.endswith(('qlog', 'rlog')) or (key.startswith('boot/') and not key.endswith('.zst')):
-      key += ".zst"
+      try:
+        sz = os.path.getsize(fn)
+      except OSError:
+        cloudlog.exception("upload: getsize failed")
+        return False
 
-    return self.upload(name, key, fn, network_type, metered)
+      # qlogs and bootlogs need to be compressed before uploading
+      if key.endswith(('qlog', 'rlog')) or (key.startswith('boot/') and not key.endswith('.zst')):
+        key += ".zst"
+
+      # logged here rather than in the worker, so upload_start is in queue order
+      cloudlog.event("upload_start", key=key, fn=fn, sz=sz, network_type=network_type, metered=metered)
+      self.uploads[self.executor.submit(self.upload, name, key, fn, sz, network_type, metered)] = (logdir, name, sz)
+
+    if not self.uploads:
+      # time with nothing to upload doesn't count against the throughput
+      self.concurrency.start_window()
+      return None
+    return True
+
+  def wait(self, timeout: float) -> None:
+    """Waits until an upload is done, at most timeout"""
+    if self.uploads:
+      wait_futures(self.uploads, timeout=timeout, return_when=FIRST_COMPLETED)
+    else:
+      time.sleep(timeout)
+
+  def close(self) -> None:
+    self.executor.shutdown(wait=True)
 
 
 def main(exit_event: threading.Event | None = None) -> None:
@@ -266,7 +517,13 @@ def main(exit_event: threading.Event | None = None) -> None:
       cloudlog.info("upload backoff %r", backoff)
       backoff = min(backoff*2, 120)
     if allow_sleep:
-      time.sleep(backoff + random.uniform(0, backoff))
+      if success:
+        # start the next upload as soon as one is done
+        uploader.wait(backoff + random.uniform(0, backoff))
+      else:
+        time.sleep(backoff + random.uniform(0, backoff))
+
+  uploader.close()
 
 
 if __name__ == "__main__":
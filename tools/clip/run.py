@@ -18,7 +18,7 @@ from openpilot.tools.lib.route import Route
 from openpilot.tools.lib.logreader import LogReader
 from openpilot.tools.lib.filereader import FileReader
 from openpilot.tools.lib.framereader import FrameReader, ffprobe
-from openpilot.selfdrive.test.process_replay.migration import migrate_all
+from openpilot.selfdrive.test.process_replay.migration import migrate_all_stream
 from openpilot.common.prefix import OpenpilotPrefix
 from openpilot.common.utils import Timer
 from msgq.visionipc import VisionIpcServer, VisionStreamType
@@ -81,7 +81,7 @@ def _download_segment(path: str) -> bytes:
 def _parse_and_chunk_segment(args: tuple) -> list[dict]:
   raw_data, fps = args
   from openpilot.tools.lib.logreader import _LogFileReader
-  messages = migrate_all(list(_LogFileReader("", dat=raw_data, sort_by_time=True)))
+  messages = list(migrate_all_stream(_LogFileReader("", dat=raw_data, streaming=True)))
   if not messages:
     return []
 
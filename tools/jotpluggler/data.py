@@ -3,10 +3,12 @@ import threading
 import multiprocessing
 import bisect
 from collections import defaultdict
+from functools import partial
 from tqdm import tqdm
 from openpilot.common.swaglog import cloudlog
-from openpilot.selfdrive.test.process_replay.migration import migrate_all
+from openpilot.selfdrive.test.process_replay.migration import migrate_all_stream
 from openpilot.tools.lib.logreader import _LogFileReader, LogReader
+from openpilot.tools.lib.time_series_cache import cached_time_series
 
 
 def flatten_dict(d: dict, sep: str = "/", prefix: str | None = None) -> dict:
@@ -197,11 +199,20 @@ def msgs_to_time_series(msgs):
   return final_result, min_time or 0.0, max_time or 0.0
 
 
+def _extract_segment(segment_identifier: str) -> dict:
+  # migrated messages come out sorted by time, so the segment is streamed instead of loaded whole
+  lr = _LogFileReader(segment_identifier, streaming=True)
+  migrated_msgs = migrate_all_stream(lr)
+  ts, start_time, end_time = msgs_to_time_series(migrated_msgs)
+  return {'ts': ts, 'start_time': start_time, 'end_time': end_time}
+
+
 def _process_segment(segment_identifier: str):
   try:
-    lr = _LogFileReader(segment_identifier, sort_by_time=True)
-    migrated_msgs = migrate_all(lr)
-    return msgs_to_time_series(migrated_msgs)
+    # extracted segments are cached in the download cache, so re-opening a route skips decoding
+    ret = cached_time_series(segment_identifier, "jotpluggler", partial(_extract_segment, segment_identifier),
+                             (__name__, migrate_all_stream.__module__))
+    return ret.get('ts', {}), ret['start_time'], ret['end_time']
   except Exception as e:
     cloudlog.warning(f"Warning: Failed to process segment {segment_identifier}: {e}")
     return {}, 0.0, 0.0
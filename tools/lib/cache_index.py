@@ -0,0 +1,160 @@
+import atexit
+import contextlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+
+class CacheIndex:
+  """
+    LRU index of the entries in the download cache with their sizes and access times. An entry is a file, or a
+    directory that's added and evicted as a whole.
+    Backed by SQLite, which takes care of locking between processes.
+  """
+  DB_NAME = "cache_index.db"
+  EVICT_BATCH = 64
+  FLUSH_INTERVAL = 1.0  # s
+
+  def __init__(self, root: str):
+    self.root = root
+    self.pid = os.getpid()
+    self._lock = threading.Lock()
+    # accesses not written to the database yet, see record_access
+    self._pending_access: dict[str, int] = {}
+    self._pending_hits = 0
+    self._pending_misses = 0
+    self._last_flush = time.monotonic()
+    self._conn = sqlite3.connect(os.path.join(root, self.DB_NAME), timeout=60, isolation_level=None, check_same_thread=False)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute("PRAGMA synchronous=NORMAL")
+    with self._transaction() as c:
+      c.execute("CREATE TABLE IF NOT EXISTS entries (name TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access INTEGER NOT NULL)")
+      c.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+      c.execute("CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+      for key in ("size", "hits", "misses", "evictions"):
+        c.execute("INSERT OR IGNORE INTO stats VALUES (?, 0)", (key,))
+    self._import_manifest()
+    atexit.register(self.flush)
+
+  @contextlib.contextmanager
+  def _transaction(self):
+    # BEGIN IMMEDIATE takes the database write lock up front, so concurrent writers wait instead of failing
+    with self._lock:
+      self._conn.execute("BEGIN IMMEDIATE")
+      try:
+        yield self._conn
+      except BaseException:
+        self._conn.execute("ROLLBACK")
+        raise
+      self._conn.execute("COMMIT")
+
+  def _query(self, sql: str) -> list:
+    with self._lock:
+      return self._conn.execute(sql).fetchall()
+
+  def _import_manifest(self) -> None:
+    """Takes over the entries of the old manifest.txt index"""
+    manifest_path = os.path.join(self.root, "manifest.txt")
+    if not os.path.exists(manifest_path):
+      return
+
+    with self._transaction() as c:
+      # another process may have imported it in the meantime
+      try:
+        with open(manifest_path) as f:
+          entries = [(parts[0], int(parts[1])) for line in f if (parts := line.strip().split()) and len(parts) == 2]
+      except FileNotFoundError:
+        return
+
+      for name, last_access in entries:
+        try:
+          self._add(c, name, os.path.getsize(os.path.join(self.root, name)), last_access * 10**9)
+        except OSError:
+          pass
+      with contextlib.suppress(FileNotFoundError):
+        os.remove(manifest_path)
+
+  @staticmethod
+  def _add(c: sqlite3.Connection, name: str, size: int, last_access: int) -> None:
+    old = c.execute("SELECT size FROM entries WHERE name = ?", (name,)).fetchone()
+    c.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (name, size, last_access))
+    c.execute("UPDATE stats SET value = value + ? WHERE key = 'size'", (size - (old[0] if old else 0),))
+
+  def add(self, name: str, size: int) -> None:
+    with self._transaction() as c:
+      self._add(c, name, size, time.time_ns())
+
+  def record_access(self, hits: list[str], misses: int = 0) -> None:
+    """
+      Marks the hit entries as recently used and updates the hit/miss stats. Accesses are batched and
+      written at most once per FLUSH_INTERVAL, so cached reads don't take the database write lock each time.
+    """
+    now = time.time_ns()
+    with self._lock:
+      self._pending_access.update(dict.fromkeys(hits, now))
+      self._pending_hits += len(hits)
+      self._pending_misses += misses
+      flush = time.monotonic() - self._last_flush > self.FLUSH_INTERVAL
+    if flush:
+      self.flush()
+
+  def flush(self) -> None:
+    """Writes the batched accesses"""
+    with self._lock:
+      access, hits, misses = self._pending_access, self._pending_hits, self._pending_misses
+      self._pending_access, self._pending_hits, self._pending_misses = {}, 0, 0
+      self._last_flush = time.monotonic()
+    if not access and not misses:
+      return
+
+    with self._transaction() as c:
+      c.executemany("UPDATE entries SET last_access = ? WHERE name = ?", [(t, name) for name, t in access.items()])
+      c.execute("UPDATE stats SET value = value + ? WHERE key = 'hits'", (hits,))
+      if misses:
+        c.execute("UPDATE stats SET value = value + ? WHERE key = 'misses'", (misses,))
+
+  def size(self) -> int:
+    return self._query("SELECT value FROM stats WHERE key = 'size'")[0][0]
+
+  def stats(self) -> dict[str, int]:
+    self.flush()
+    ret = dict(self._query("SELECT key, value FROM stats"))
+    ret["entries"] = self._query("SELECT COUNT(*) FROM entries")[0][0]
+    return ret
+
+  def evict(self, max_size: int) -> None:
+    """Removes the least recently used entries until the cache is under max_size bytes"""
+    self.flush()
+    while self.size() > max_size:
+      with self._transaction() as c:
+        total = c.execute("SELECT value FROM stats WHERE key = 'size'").fetchone()[0]
+        if total <= max_size:
+          # evicted by another process in the meantime
+          break
+
+        entries = c.execute("SELECT name, size FROM entries ORDER BY last_access LIMIT ?", (self.EVICT_BATCH,)).fetchall()
+        if not entries:
+          # size got out of sync with the entries
+          c.execute("UPDATE stats SET value = 0 WHERE key = 'size'")
+          break
+
+        evicted = []
+        for name, size in entries:
+          if total <= max_size:
+            break
+          evicted.append((name,))
+          total -= size
+          path = os.path.join(self.root, name)
+          try:
+            if os.path.isdir(path):
+              shutil.rmtree(path)
+            else:
+              os.remove(path)
+          except OSError:
+            pass
+
+        c.executemany("DELETE FROM entries WHERE name = ?", evicted)
+        c.execute("UPDATE stats SET value = ? WHERE key = 'size'", (total,))
+        c.execute("UPDATE stats SET value = value + ? WHERE key = 'evictions'", (len(evicted),))
@@ -1,5 +1,6 @@
 import os
 import io
+import mmap
 import posixpath
 import socket
 from functools import cache
@@ -43,12 +44,28 @@ def file_exists(fn):
   return os.path.exists(fn)
 
 class DiskFile(io.BufferedReader):
-  def get_multi_range(self, ranges: list[tuple[int, int]]) -> list[bytes]:
-    parts = []
-    for r in ranges:
-      self.seek(r[0])
-      parts.append(self.read(r[1] - r[0]))
-    return parts
+  _mmap: mmap.mmap | None = None
+
+  def view(self, start: int = 0, end: int | None = None) -> memoryview:
+    """Zero-copy view of a byte range, backed by a memory mapping of the file"""
+    if self._mmap is None:
+      if os.fstat(self.fileno()).st_size == 0:
+        return memoryview(b"")
+      self._mmap = mmap.mmap(self.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(self._mmap)[start:end]
+
+  def get_multi_range(self, ranges: list[tuple[int, int]]) -> list[memoryview]:
+    return [self.view(s, e) for s, e in ranges]
+
+  def close(self) -> None:
+    if self._mmap is not None:
+      try:
+        self._mmap.close()
+      except BufferError:
+        # views are still in use, the mapping is released once they're garbage collected
+        pass
+      self._mmap = None
+    super().close()
 
 def FileReader(fn):
   fn = resolve_name(fn)
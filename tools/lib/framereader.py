@@ -1,13 +1,26 @@
 import os
 import subprocess
 import json
+import atexit
 import logging
-from collections.abc import Iterator
-from collections import OrderedDict
+import multiprocessing
+import queue
+import threading
+import zipfile
+from collections.abc import Iterator, Sequence
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
 
 import numpy as np
-from openpilot.tools.lib.filereader import FileReader, resolve_name
+from openpilot.common.utils import atomic_write
+from openpilot.system.hardware.hw import Paths
+from openpilot.tools.lib.filereader import DiskFile, FileReader, resolve_name
 from openpilot.tools.lib.exceptions import DataUnreadableError
+from openpilot.tools.lib.log_index import file_cache_key
+from openpilot.tools.lib.url_file import prune_cache
 from openpilot.tools.lib.vidindex import hevc_index
 
 logger = logging.getLogger("tools")
@@ -16,6 +29,13 @@ HEVC_SLICE_B = 0
 HEVC_SLICE_P = 1
 HEVC_SLICE_I = 2
 
+# bump when the cached video index changes
+VIDEO_INDEX_VERSION = 1
+
+# size of the pool of long-lived decoder processes shared by all readers, off (0) by default,
+# which runs ffmpeg once per GOP. A pool can also be passed to the readers explicitly
+DECODER_WORKERS = int(os.getenv("FRAMEREADER_WORKERS", "0"))
+
 class LRUCache:
   def __init__(self, capacity: int):
     self._cache: OrderedDict = OrderedDict()
@@ -42,7 +62,34 @@ def assert_hvec(fn: str) -> None:
     if 'hevc' not in fn:
       raise NotImplementedError(fn)
 
+def _frame_shape(w: int, h: int, pix_fmt: str) -> tuple[int, ...]:
+  if pix_fmt == "rgb24":
+    return (h, w, 3)
+  elif pix_fmt in ["nv12", "yuv420p"]:
+    return (h*w*3//2,)
+  raise NotImplementedError(f"Unsupported pixel format: {pix_fmt}")
+
+def _check_output_chunks(args: list[str], chunks: Sequence) -> bytes:
+  """Like subprocess.check_output, but writes the input chunks one by one instead of joining them first"""
+  with subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE) as p:
+    def write_input():
+      try:
+        for chunk in chunks:
+          p.stdin.write(chunk)
+        p.stdin.close()
+      except BrokenPipeError:
+        pass
+
+    writer = threading.Thread(target=write_input, daemon=True)
+    writer.start()
+    dat = p.stdout.read()
+    writer.join()
+    if p.wait() != 0:
+      raise subprocess.CalledProcessError(p.returncode, args, output=dat)
+  return dat
+
 def decompress_video_data(rawdat, w, h, pix_fmt="rgb24", vid_fmt='hevc', hwaccel="auto", loglevel="info") -> np.ndarray:
+  """rawdat is bytes, or a list of bytes-like chunks which are passed to ffmpeg without copying"""
   threads = os.getenv("FFMPEG_THREADS", "0")
   args = ["ffmpeg", "-v", loglevel,
           "-threads", threads,
@@ -55,16 +102,154 @@ def decompress_video_data(rawdat, w, h, pix_fmt="rgb24", vid_fmt='hevc', hwaccel
           "-f", "rawvideo",
           "-pix_fmt", pix_fmt,
           "-"]
-  dat = subprocess.check_output(args, input=rawdat)
+  dat = _check_output_chunks(args, rawdat if isinstance(rawdat, list) else [rawdat])
 
-  ret: np.ndarray
-  if pix_fmt == "rgb24":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, h, w, 3)
-  elif pix_fmt in ["nv12", "yuv420p"]:
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
-  else:
-    raise NotImplementedError(f"Unsupported pixel format: {pix_fmt}")
-  return ret
+  return np.frombuffer(dat, dtype=np.uint8).reshape(-1, *_frame_shape(w, h, pix_fmt))
+
+def _decoder_worker(conn: Connection) -> None:
+  """
+    Decoder process loop. Each request is a GOP sent as chunks over conn, decoded with one codec context
+    that stays open between requests. The frames are written into a shared memory buffer owned by the parent.
+  """
+  import av
+
+  def open_codec():
+    codec = av.CodecContext.create("hevc", "r")
+    codec.flags2 |= av.codec.context.Flags2.show_all
+    codec.thread_type = "AUTO"
+    codec.thread_count = int(os.getenv("FFMPEG_THREADS", "0"))
+    return codec
+
+  codec = open_codec()
+  shm: SharedMemory | None = None
+  while True:
+    try:
+      n_chunks, pix_fmt = conn.recv()
+      chunks = [conn.recv_bytes() for _ in range(n_chunks)]
+    except EOFError:
+      break
+
+    try:
+      frames = []
+      for chunk in chunks + [None]:
+        for packet in codec.parse(chunk):
+          frames += codec.decode(packet)
+      frames += codec.decode(None)
+      codec.flush_buffers()
+    except av.error.FFmpegError as e:
+      codec = open_codec()
+      conn.send((0, str(e)))
+      continue
+
+    conn.send((len(frames), None))
+    if not frames:
+      continue
+
+    shm_name = conn.recv()
+    if shm is None or shm.name != shm_name:
+      if shm is not None:
+        shm.close()
+      shm = SharedMemory(shm_name)
+    offset = 0
+    for frame in frames:
+      dat = frame.to_ndarray(format=pix_fmt).reshape(-1)
+      shm.buf[offset:offset + dat.size] = dat
+      offset += dat.size
+    conn.send(None)
+
+class _DecoderWorker:
+  def __init__(self):
+    self.conn, child_conn = multiprocessing.Pipe()
+    self.proc = multiprocessing.Process(target=_decoder_worker, args=(child_conn,), name="framereader decoder", daemon=True)
+    self.proc.start()
+    child_conn.close()
+    self.shm: SharedMemory | None = None
+
+  def decode(self, chunks: Sequence, w: int, h: int, pix_fmt: str) -> np.ndarray:
+    shape = _frame_shape(w, h, pix_fmt)
+    self.conn.send((len(chunks), pix_fmt))
+    for chunk in chunks:
+      self.conn.send_bytes(chunk)
+    count, err = self.conn.recv()
+    if err is not None:
+      raise DataUnreadableError(f"failed to decode GOP: {err}")
+    if count == 0:
+      return np.empty((0, *shape), dtype=np.uint8)
+
+    nbytes = count * int(np.prod(shape))
+    if self.shm is None or self.shm.size < nbytes:
+      # grown with some headroom, GOP lengths vary a little
+      self._free_shm()
+      self.shm = SharedMemory(create=True, size=nbytes * 5 // 4)
+    self.conn.send(self.shm.name)
+    self.conn.recv()
+    return np.frombuffer(self.shm.buf, dtype=np.uint8, count=nbytes).reshape(count, *shape).copy()
+
+  def _free_shm(self) -> None:
+    if self.shm is not None:
+      self.shm.close()
+      self.shm.unlink()
+      self.shm = None
+
+  def close(self) -> None:
+    self.conn.close()
+    self.proc.join(timeout=1)
+    if self.proc.is_alive():
+      self.proc.kill()
+    self._free_shm()
+
+class DecoderPool:
+  """
+    Pool of long-lived decoder processes, so decoding a GOP doesn't pay for process startup and codec init.
+    GOPs are passed over a pipe and the frames come back through a shared memory buffer per worker.
+  """
+  def __init__(self, workers: int = DECODER_WORKERS):
+    self.pid = os.getpid()
+    self.workers = workers
+    # the workers have to share the parent's resource tracker, their own would unlink the buffers when they exit
+    resource_tracker.ensure_running()
+    self._all = [_DecoderWorker() for _ in range(workers)]
+    self._idle: queue.SimpleQueue[_DecoderWorker] = queue.SimpleQueue()
+    for worker in self._all:
+      self._idle.put(worker)
+    self._lock = threading.Lock()
+    self.executor = ThreadPoolExecutor(max_workers=workers)
+
+  def decode(self, chunks: Sequence, w: int, h: int, pix_fmt: str = "rgb24") -> np.ndarray:
+    """Decodes a GOP given as a list of bytes-like chunks, blocks until a worker is free. Thread safe."""
+    worker = self._idle.get()
+    try:
+      return worker.decode(chunks, w, h, pix_fmt)
+    except DataUnreadableError:
+      raise
+    except BaseException:
+      # the worker is out of sync or dead, replace it
+      worker.close()
+      with self._lock:
+        self._all.remove(worker)
+        worker = _DecoderWorker()
+        self._all.append(worker)
+      raise
+    finally:
+      self._idle.put(worker)
+
+  def close(self) -> None:
+    self.executor.shutdown(wait=True, cancel_futures=True)
+    for worker in self._all:
+      worker.close()
+    self._all = []
+
+_decoder_pool: DecoderPool | None = None
+_decoder_pool_lock = threading.Lock()
+
+def decoder_pool() -> DecoderPool:
+  """Decoder pool shared by all readers of this process"""
+  global _decoder_pool
+  with _decoder_pool_lock:
+    if _decoder_pool is None or _decoder_pool.pid != os.getpid():
+      _decoder_pool = DecoderPool()
+      atexit.register(_decoder_pool.close)
+    return _decoder_pool
 
 def ffprobe(fn, fmt=None):
   fn = resolve_name(fn)
@@ -88,70 +273,134 @@ def get_index_data(fn: str, index_data: dict|None = None):
   stream = index_data["probe"]["streams"][0]
   return index_data["index"], index_data["global_prefix"], stream["width"], stream["height"]
 
+def video_index_cache_path(fn: str) -> str | None:
+  """Video index location in the download cache, None if caching is disabled"""
+  if int(os.environ.get("DISABLE_FILEREADER_CACHE", "0")) == 1:
+    return None
+
+  os.makedirs(Paths.download_cache_root(), exist_ok=True)
+  return os.path.join(Paths.download_cache_root(), f"{file_cache_key(fn)}_vidindex_v{VIDEO_INDEX_VERSION}.npz")
+
+def load_video_index(path: str) -> dict:
+  with np.load(path, allow_pickle=False) as dat:
+    return {
+      'index': dat['index'],
+      'global_prefix': dat['global_prefix'].tobytes(),
+      'probe': json.loads(str(dat['probe'])),
+    }
+
+def save_video_index(path: str, index_data: dict) -> None:
+  with atomic_write(path, mode="wb", overwrite=True) as f:
+    np.savez(f, index=index_data['index'], global_prefix=np.frombuffer(index_data['global_prefix'], dtype=np.uint8),
+             probe=np.array(json.dumps(index_data['probe'])))
+
 def get_video_index(fn):
+  # indexing reads the whole file and runs ffprobe, cache it so reopening a file is instant
+  path = video_index_cache_path(fn)
+  if path is not None and os.path.exists(path):
+    try:
+      return load_video_index(path)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+      logger.warning(f"failed to load cached video index {path}")
+
   assert_hvec(fn)
   frame_types, dat_len, prefix = hevc_index(fn)
   index = np.array(frame_types + [(0xFFFFFFFF, dat_len)], dtype=np.uint32)
   probe = ffprobe(fn, "hevc")
-  return {
+  index_data = {
     'index': index,
     'global_prefix': prefix,
     'probe': probe
   }
+  if path is not None:
+    save_video_index(path, index_data)
+    prune_cache(os.path.basename(path))
+  return index_data
 
 class FfmpegDecoder:
   def __init__(self, fn: str, index_data: dict|None = None,
-               pix_fmt: str = "rgb24", hwaccel="auto", loglevel="quiet"):
+               pix_fmt: str = "rgb24", hwaccel="auto", loglevel="quiet", pool: DecoderPool|None = None):
     self.fn = fn
     self.index, self.prefix, self.w, self.h = get_index_data(fn, index_data)
     self.frame_count = len(self.index) - 1          # sentinel row at the end
     self.iframes = np.where(self.index[:, 0] == HEVC_SLICE_I)[0]
     self.pix_fmt = pix_fmt
     self.loglevel, self.hwaccel = loglevel, hwaccel
+    # the decoder processes decode in software, hardware decoding still goes through ffmpeg.
+    # Daemonic processes (e.g. multiprocessing.Pool workers) can't start the pool's processes
+    if pool is None and DECODER_WORKERS > 0 and hwaccel in ("auto", "none") and not multiprocessing.current_process().daemon:
+      pool = decoder_pool()
+    self.pool = pool
 
   def _gop_bounds(self, frame_idx: int):
-    f_b = frame_idx
-    while f_b > 0 and self.index[f_b, 0] != HEVC_SLICE_I:
-      f_b -= 1
-    f_e = frame_idx + 1
-    while f_e < self.frame_count and self.index[f_e, 0] != HEVC_SLICE_I:
-      f_e += 1
+    # GOP from the last I-frame at or before frame_idx up to the next one
+    i = np.searchsorted(self.iframes, frame_idx, side="right")
+    f_b = int(self.iframes[i - 1]) if i > 0 else 0
+    f_e = int(self.iframes[i]) if i < len(self.iframes) else self.frame_count
     return f_b, f_e, self.index[f_b, 1], self.index[f_e, 1]
 
-  def _decode_gop(self, raw: bytes) -> Iterator[np.ndarray]:
-    yield from decompress_video_data(raw, self.w, self.h, pix_fmt=self.pix_fmt, hwaccel=self.hwaccel, loglevel=self.loglevel)
+  def _decode_gop(self, off_b: int, off_e: int) -> np.ndarray:
+    with FileReader(self.fn) as f:
+      if isinstance(f, DiskFile):
+        # local files are handed to the decoder straight from a memory mapping
+        gop = f.view(off_b, off_e)
+      else:
+        f.seek(off_b)
+        gop = f.read(off_e - off_b)
+      if self.pool is not None:
+        frames = self.pool.decode([self.prefix, gop], self.w, self.h, self.pix_fmt)
+      else:
+        frames = decompress_video_data([self.prefix, gop], self.w, self.h, self.pix_fmt, hwaccel=self.hwaccel, loglevel=self.loglevel)
+      del gop
+    return frames
+
+  def _gops(self, start_fidx: int, end_fidx: int, read_ahead: bool) -> Iterator[tuple[int, np.ndarray]]:
+    """Decoded GOPs overlapping [start_fidx, end_fidx) as (first frame index, frames), with read_ahead decoded ahead in parallel with a pool"""
+    fidx = start_fidx
+    if self.pool is None or not read_ahead:
+      while fidx < end_fidx:
+        f_b, fidx, off_b, off_e = self._gop_bounds(fidx)
+        yield f_b, self._decode_gop(off_b, off_e)
+      return
+
+    pending: deque[tuple[int, Future]] = deque()
+    try:
+      while fidx < end_fidx or pending:
+        while fidx < end_fidx and len(pending) < self.pool.workers:
+          f_b, fidx, off_b, off_e = self._gop_bounds(fidx)
+          pending.append((f_b, self.pool.executor.submit(self._decode_gop, off_b, off_e)))
+        f_b, fut = pending.popleft()
+        yield f_b, fut.result()
+    finally:
+      for _, fut in pending:
+        fut.cancel()
 
   def get_gop_start(self, frame_idx: int):
     return self.iframes[np.searchsorted(self.iframes, frame_idx, side="right") - 1]
 
   def get_iterator(self, start_fidx: int = 0, end_fidx: int|None = None,
-                   frame_skip: int = 1) -> Iterator[tuple[int, np.ndarray]]:
+                   frame_skip: int = 1, read_ahead: bool = True) -> Iterator[tuple[int, np.ndarray]]:
     end_fidx = end_fidx or self.frame_count
-    fidx = start_fidx
-    while fidx < end_fidx:
-      f_b, f_e, off_b, off_e = self._gop_bounds(fidx)
-      with FileReader(self.fn) as f:
-        f.seek(off_b)
-        raw = self.prefix + f.read(off_e - off_b)
+    for f_b, frames in self._gops(start_fidx, end_fidx, read_ahead):
       # number of frames to discard inside this GOP before the wanted one
-      for i, frm in enumerate(decompress_video_data(raw, self.w, self.h, self.pix_fmt, hwaccel=self.hwaccel, loglevel=self.loglevel)):
+      for i, frm in enumerate(frames):
         fidx = f_b + i
         if fidx >= end_fidx:
           return
         elif fidx >= start_fidx and (fidx - start_fidx) % frame_skip == 0:
           yield fidx, frm
-      fidx += 1
 
 def FrameIterator(fn: str, index_data: dict|None=None, pix_fmt: str = "rgb24",
-                  start_fidx:int=0, end_fidx=None, frame_skip:int=1, hwaccel="auto", loglevel="quiet") -> Iterator[np.ndarray]:
-  dec = FfmpegDecoder(fn, pix_fmt=pix_fmt, index_data=index_data, hwaccel=hwaccel, loglevel=loglevel)
+                  start_fidx:int=0, end_fidx=None, frame_skip:int=1, hwaccel="auto", loglevel="quiet",
+                  pool: DecoderPool|None = None) -> Iterator[np.ndarray]:
+  dec = FfmpegDecoder(fn, pix_fmt=pix_fmt, index_data=index_data, hwaccel=hwaccel, loglevel=loglevel, pool=pool)
   for _, frame in dec.get_iterator(start_fidx=start_fidx, end_fidx=end_fidx, frame_skip=frame_skip):
     yield frame
 
 class FrameReader:
   def __init__(self, fn: str, index_data: dict|None = None, cache_size: int = 30,
-               pix_fmt: str = "rgb24", hwaccel="auto", loglevel="quiet"):
-    self.decoder = FfmpegDecoder(fn, index_data=index_data, pix_fmt=pix_fmt, hwaccel=hwaccel, loglevel=loglevel)
+               pix_fmt: str = "rgb24", hwaccel="auto", loglevel="quiet", pool: DecoderPool|None = None):
+    self.decoder = FfmpegDecoder(fn, index_data=index_data, pix_fmt=pix_fmt, hwaccel=hwaccel, loglevel=loglevel, pool=pool)
     self.iframes = self.decoder.iframes
     self._cache: LRUCache = LRUCache(cache_size)
     self.w, self.h, self.frame_count, = self.decoder.w, self.decoder.h, self.decoder.frame_count
@@ -165,7 +414,8 @@ class FrameReader:
       return self._cache[fidx]
     read_start = self.decoder.get_gop_start(fidx)
     if not self.it or fidx < self.fidx or read_start != self.decoder.get_gop_start(self.fidx):  # If the frame is in a different GOP, reset the iterator
-      self.it = self.decoder.get_iterator(read_start)
+      # only the GOP of the frame is decoded, the iterator is reset at the next one anyway
+      self.it = self.decoder.get_iterator(read_start, self.decoder._gop_bounds(fidx)[1], read_ahead=False)
       self.fidx = -1
     while self.fidx < fidx:
       self.fidx, frame = next(self.it)
@@ -0,0 +1,80 @@
+import hashlib
+import os
+import numpy as np
+from collections.abc import Iterable
+
+from openpilot.common.utils import atomic_write
+from openpilot.system.hardware.hw import Paths
+from openpilot.tools.lib.url_file import hash_url
+
+# bump when the index format or its contents change
+INDEX_VERSION = 1
+
+
+def file_cache_key(fn: str) -> str:
+  """Cache key for data derived from a log file"""
+  if fn.startswith(("http://", "https://", "cd:/")):
+    return hash_url(fn)
+
+  # local files can change, so they're keyed on their stat as well
+  st = os.stat(fn)
+  return hashlib.md5(f"{os.path.abspath(fn)}_{st.st_size}_{st.st_mtime_ns}".encode()).hexdigest()
+
+
+def index_cache_path(fn: str) -> str | None:
+  """Sidecar index location in the download cache, None if caching is disabled"""
+  if int(os.environ.get("DISABLE_FILEREADER_CACHE", "0")) == 1:
+    return None
+
+  os.makedirs(Paths.download_cache_root(), exist_ok=True)
+  return os.path.join(Paths.download_cache_root(), f"{file_cache_key(fn)}_index_v{INDEX_VERSION}.npz")
+
+
+class LogIndex:
+  """Per-segment index of message type and logMonoTime to byte ranges in the decompressed log"""
+
+  def __init__(self, types: np.ndarray, type_idxs: np.ndarray, offsets: np.ndarray, sizes: np.ndarray, mono_times: np.ndarray):
+    self.types = types
+    self.type_idxs = type_idxs
+    self.offsets = offsets
+    self.sizes = sizes
+    self.mono_times = mono_times
+
+  @classmethod
+  def from_events(cls, events: Iterable[tuple[int, int, str, int]]) -> 'LogIndex':
+    """Builds the index from (offset, size, which, logMonoTime) tuples, non-union events have an empty which"""
+    types: dict[str, int] = {}
+    type_idxs, offsets, sizes, mono_times = [], [], [], []
+    for offset, size, which, mono_time in events:
+      type_idxs.append(types.setdefault(which, len(types)))
+      offsets.append(offset)
+      sizes.append(size)
+      mono_times.append(mono_time)
+
+    return cls(np.array(list(types), dtype=str), np.array(type_idxs, dtype=np.uint16), np.array(offsets, dtype=np.uint64),
+               np.array(sizes, dtype=np.uint64), np.array(mono_times, dtype=np.uint64))
+
+  @classmethod
+  def load(cls, path: str) -> 'LogIndex':
+    with np.load(path, allow_pickle=False) as dat:
+      return cls(dat['types'], dat['type_idxs'], dat['offsets'], dat['sizes'], dat['mono_times'])
+
+  def save(self, path: str) -> None:
+    with atomic_write(path, mode="wb", overwrite=True) as f:
+      np.savez(f, types=self.types, type_idxs=self.type_idxs, offsets=self.offsets, sizes=self.sizes, mono_times=self.mono_times)
+
+  def __len__(self) -> int:
+    return len(self.offsets)
+
+  def select(self, msg_type: str, start_time: int | None = None, end_time: int | None = None) -> np.ndarray:
+    """Indices of events of msg_type with start_time <= logMonoTime < end_time, in file order"""
+    type_idx = np.flatnonzero(self.types == msg_type)
+    if len(type_idx) == 0:
+      return np.empty(0, dtype=np.int64)
+
+    mask = self.type_idxs == type_idx[0]
+    if start_time is not None:
+      mask &= self.mono_times >= start_time
+    if end_time is not None:
+      mask &= self.mono_times < end_time
+    return np.flatnonzero(mask)
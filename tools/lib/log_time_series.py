@@ -1,4 +1,5 @@
 import numpy as np
+from functools import partial
 
 
 def flatten_type_dict(d, sep="/", prefix=None):
@@ -52,11 +53,9 @@ def potentially_ragged_array(arr, dtype=None, **kwargs):
   except ValueError:
     return np.array(arr, dtype=object, **kwargs)
 
-def msgs_to_time_series(msgs):
+def msgs_to_time_series_dicts(msgs):
   """
-    Convert an iterable of canonical capnp messages into a dictionary of time series.
-    Each time series has a value with key "t" which consists of monotonically increasing timestamps
-    in seconds.
+    Reference implementation of msgs_to_time_series, going through to_dict(verbose=True) for every message.
   """
   values = {}
   for msg in msgs:
@@ -76,9 +75,231 @@ def msgs_to_time_series(msgs):
   return values
 
 
+# capnp primitive type -> numpy dtype. Same dtypes as the to_dict() reference, so that
+# e.g. differences of unsigned timestamps or frame ids can't wrap around
+NUMERIC_DTYPES = {
+  'bool': np.bool_, 'int8': np.int64, 'int16': np.int64, 'int32': np.int64, 'int64': np.int64,
+  'uint8': np.int64, 'uint16': np.int64, 'uint32': np.int64, 'uint64': np.int64,
+  'float32': np.float64, 'float64': np.float64,
+}
+COLUMN_BLOCK_SIZE = 1024
+UNSUPPORTED_TYPES = ('qcomGnss', 'ubloxGnss')
+
+
+class Column:
+  """
+    Growable typed buffer. Values are staged in a list and copied into the
+    NumPy buffer in blocks with flush(), the buffer doubles in size when full.
+    Columns without a dtype stay a list and may be padded with None.
+  """
+  def __init__(self, dtype=None):
+    self.pending: list = []
+    self._buf = np.empty(COLUMN_BLOCK_SIZE, dtype=dtype) if dtype is not None else None
+    self._len = 0
+
+  def __len__(self) -> int:
+    return self._len + len(self.pending)
+
+  def pad(self, size: int) -> None:
+    """Fills missing rows (e.g. inactive union fields) with None"""
+    if len(self) < size:
+      self.pending.extend([None] * (size - len(self)))
+
+  def flush(self) -> None:
+    n = len(self.pending)
+    if self._buf is None or n == 0:
+      return
+    if self._len + n > len(self._buf):
+      self._buf = np.resize(self._buf, max(2 * len(self._buf), self._len + n))
+    try:
+      self._buf[self._len:self._len + n] = self.pending
+    except OverflowError:
+      # uint64 values past the int64 range
+      self._buf = self._buf.astype(np.uint64)
+      self._buf[self._len:self._len + n] = self.pending
+    self._len += n
+    self.pending.clear()
+
+  def array(self) -> np.ndarray:
+    if self._buf is None:
+      return potentially_ragged_array(self.pending)
+    self.flush()
+    return self._buf[:self._len]
+
+
+def _convert_list(lst, element_type: str):
+  if element_type == 'uint64':
+    return np.array(list(lst))
+  elif element_type in NUMERIC_DTYPES:
+    return np.fromiter(lst, dtype=NUMERIC_DTYPES[element_type], count=len(lst))
+  elif element_type == 'enum':
+    return np.array([str(e) for e in lst])
+  elif element_type == 'struct':
+    return np.array([e.to_dict(verbose=True) for e in lst])
+  elif element_type == 'list':
+    return potentially_ragged_array([list(e) for e in lst])
+  return np.array(list(lst))
+
+
+def _wanted(path: str, fields: tuple[str, ...] | None) -> bool:
+  """Whether path is, is inside of, or contains a whitelisted field"""
+  return fields is None or any(path == f or path.startswith(f + "/") or f.startswith(path + "/") for f in fields)
+
+
+def _sub_fields(typ: str, fields: tuple[str, ...] | None) -> tuple[str, ...] | None:
+  """Whitelisted fields relative to a message type, None for all fields"""
+  if fields is None or typ in fields:
+    return None
+  return tuple(f.split("/", 1)[1] for f in fields if f.startswith(typ + "/"))
+
+
+class StructPlan:
+  """
+    Field accessors for a capnp struct type, precomputed from its schema. Leaf
+    fields write straight into the flat "a/b/c" columns. Fields below a union
+    only have values for some rows, those are padded with None.
+  """
+  def __init__(self, columns: dict[str, Column], sparse: bool = False):
+    self.columns = columns
+    self.sparse = sparse
+    self.leaves: list[tuple] = []  # (name, column, converter)
+    self.children: list[tuple] = []  # (name, plan)
+    self.union_fields: dict[str, StructPlan] = {}  # name -> plan of just that field
+
+  @classmethod
+  def from_schema(cls, schema, columns: dict[str, Column], prefix: str | None = None, fields: tuple[str, ...] | None = None,
+                  sparse: bool = False) -> 'StructPlan':
+    plan = cls(columns, sparse)
+    union_names = set(schema.union_fields)
+    for name, field in schema.fields.items():
+      path = name if prefix is None else f"{prefix}/{name}"
+      if not _wanted(path, fields):
+        continue
+
+      if name in union_names:
+        plan.union_fields[name] = cls(columns, sparse=True)
+        plan.union_fields[name].add_field(name, field, path, fields)
+      else:
+        plan.add_field(name, field, path, fields)
+    return plan
+
+  def add_field(self, name: str, field, path: str, fields: tuple[str, ...] | None) -> None:
+    if field.proto.which() == 'group' or field.proto.slot.type.which() == 'struct':
+      self.children.append((name, StructPlan.from_schema(field.schema, self.columns, path, fields, self.sparse)))
+      return
+
+    typ = field.proto.slot.type.which()
+    converter = None
+    if typ == 'enum':
+      converter = str
+    elif typ == 'list':
+      converter = partial(_convert_list, element_type=field.proto.slot.type.list.elementType.which())
+
+    self.columns[path] = Column(NUMERIC_DTYPES.get(typ) if not self.sparse else None)
+    self.leaves.append((name, self.columns[path], converter))
+
+  def extract(self, reader, row: int) -> None:
+    get = reader._get
+    for name, column, converter in self.leaves:
+      value = get(name)
+      if self.sparse:
+        column.pad(row)
+      column.pending.append(value if converter is None else converter(value))
+
+    for name, child in self.children:
+      child.extract(get(name), row)
+
+    if self.union_fields:
+      plan = self.union_fields.get(reader.which())
+      if plan is not None:
+        plan.extract(reader, row)
+
+
+def msgs_to_time_series(msgs, fields=None):
+  """
+    Convert an iterable of canonical capnp messages into a dictionary of time series.
+    Each time series has a value with key "t" which consists of monotonically increasing timestamps
+    in seconds.
+
+    fields optionally restricts the output to some message types or fields, e.g. ("carState/vEgo", "controlsState").
+  """
+  if fields is not None:
+    fields = tuple(fields)
+
+  plans: dict[str, StructPlan | None] = {}
+  values: dict[str, dict[str, Column]] = {}
+  for msg in msgs:
+    typ = msg.which()
+    if typ not in plans:
+      plans[typ] = None
+      if typ not in UNSUPPORTED_TYPES and _wanted(typ, fields):
+        sub_msg = msg._get(typ)
+        if hasattr(sub_msg, 'schema'):
+          values[typ] = {"t": Column(np.float64), "_valid": Column(np.bool_)}
+          plans[typ] = StructPlan.from_schema(sub_msg.schema, values[typ], None, _sub_fields(typ, fields))
+
+    plan = plans[typ]
+    if plan is None:
+      continue
+
+    columns = values[typ]
+    row = len(columns["t"])
+    if row % COLUMN_BLOCK_SIZE == 0:
+      for column in columns.values():
+        column.flush()
+    columns["t"].pending.append(msg.logMonoTime / 1.0e9)
+    columns["_valid"].pending.append(msg.valid)
+    plan.extract(msg._get(typ), row)
+
+  # Sort values by time.
+  ret = {}
+  for typ, columns in values.items():
+    num_rows = len(columns["t"])
+    order = np.argsort(columns["t"].array())
+    ret[typ] = {}
+    for name, column in columns.items():
+      # skip fields of never active union members
+      if len(column) > 0:
+        column.pad(num_rows)
+        ret[typ][name] = column.array()[order]
+
+  return ret
+
+
+def merge_time_series(parts: list[dict]) -> dict:
+  """Concatenates time series (e.g. of consecutive segments) and sorts them by time"""
+  ret = {}
+  for typ in dict.fromkeys(typ for part in parts for typ in part):
+    typ_parts = [part[typ] for part in parts if typ in part]
+    num_rows = [len(p["t"]) for p in typ_parts]
+    order = np.argsort(np.concatenate([p["t"] for p in typ_parts]))
+
+    ret[typ] = {}
+    for name in dict.fromkeys(name for p in typ_parts for name in p):
+      if all(name in p for p in typ_parts):
+        try:
+          values = np.concatenate([p[name] for p in typ_parts])
+        except ValueError:
+          # e.g. list fields with a different length in each part
+          values = potentially_ragged_array([v for p in typ_parts for v in p[name]])
+      else:
+        values = potentially_ragged_array([v for p, n in zip(typ_parts, num_rows, strict=True) for v in (p[name] if name in p else [None] * n)])
+      ret[typ][name] = values[order]
+  return ret
+
+
 if __name__ == "__main__":
   import sys
+  import time
   from openpilot.tools.lib.logreader import LogReader
-  m = msgs_to_time_series(LogReader(sys.argv[1]))
+
+  # benchmark against the reference implementation, e.g. on a full rlog or a route
+  msgs = list(LogReader(sys.argv[1]))
+  for name, f in (("reference", msgs_to_time_series_dicts), ("carState/vEgo only", partial(msgs_to_time_series, fields=("carState/vEgo",))),
+                  ("schema compiled", msgs_to_time_series)):
+    st = time.monotonic()
+    m = f(msgs)
+    dt = time.monotonic() - st
+    print(f"{name}: {len(msgs)} msgs in {dt:.2f}s, {len(msgs) / dt:.0f} msgs/s")
   print(m['driverCameraState']['t'])
   print(np.diff(m['driverCameraState']['timestampSof']))
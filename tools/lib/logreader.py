@@ -6,21 +6,27 @@ import capnp
 import enum
 import os
 import pathlib
+import struct
 import sys
 import tqdm
 import urllib.parse
 import warnings
 import zstandard as zstd
 
+from collections import deque
 from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import parse_qs, urlparse
 
 from cereal import log as capnp_log
 from openpilot.common.swaglog import cloudlog
-from openpilot.tools.lib.filereader import FileReader
+from openpilot.tools.lib.filereader import DiskFile, FileReader
+from openpilot.tools.lib.log_index import LogIndex, index_cache_path
 from openpilot.tools.lib.file_sources import comma_api_source, internal_source, openpilotci_source, comma_car_segments_source, Source
 from openpilot.tools.lib.route import SegmentRange, FileName
-from openpilot.tools.lib.log_time_series import msgs_to_time_series
+from openpilot.tools.lib.log_time_series import merge_time_series, msgs_to_time_series
+from openpilot.tools.lib.time_series_cache import cached_time_series
+from openpilot.tools.lib.url_file import prune_cache
 
 LogMessage = type[capnp._DynamicStructReader]
 LogIterable = Iterable[LogMessage]
@@ -39,6 +45,9 @@ def save_log(dest, log_msgs, compress=True):
     f.write(dat)
 
 
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
 def decompress_stream(data: bytes):
   dctx = zstd.ZstdDecompressor()
   decompressed_data = b""
@@ -86,41 +95,210 @@ class CachedEventReader:
     return getattr(self._evt, name)
 
 
+def _buffer_chunks(dat, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[memoryview]:
+  view = memoryview(dat)
+  for i in range(0, len(view), chunk_size):
+    yield view[i:i + chunk_size]
+
+
+def _decompressed_chunks(chunks: Iterator, ext: str | None = None) -> Iterator[bytes]:
+  """Incrementally decompresses the chunks of a bz2/zstd (or raw) log file"""
+  dat = next(chunks, b"")
+  magic = bytes(dat[:4])
+  if ext == ".bz2" or magic.startswith(b'BZh9'):
+    new_decompressor = bz2.BZ2Decompressor
+  elif ext == ".zst" or magic.startswith(b'\x28\xB5\x2F\xFD'):
+    # https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md#zstandard-frames
+    new_decompressor = zstd.ZstdDecompressor().decompressobj
+  else:
+    new_decompressor = None
+
+  decompressor = new_decompressor() if new_decompressor is not None else None
+  while len(dat):
+    if decompressor is None:
+      yield dat
+    else:
+      # a file may contain multiple concatenated streams/frames
+      while len(dat):
+        yield decompressor.decompress(dat)
+        if not decompressor.eof:
+          break
+        dat = decompressor.unused_data
+        decompressor = new_decompressor()
+    dat = next(chunks, b"")
+
+
+def _complete_message_sizes(dat: bytearray) -> list[int]:
+  """Returns the sizes of the complete capnp messages at the start of dat"""
+  # https://capnproto.org/encoding.html#serialization-over-a-stream
+  sizes = []
+  pos, size = 0, len(dat)
+  while pos + 4 <= size:
+    num_segments = struct.unpack_from("<I", dat, pos)[0] + 1
+    header_size = (4 * (num_segments + 1) + 7) & ~7
+    if pos + header_size > size:
+      break
+    msg_size = header_size + 8 * sum(struct.unpack_from(f"<{num_segments}I", dat, pos + 4))
+    if pos + msg_size > size:
+      break
+    sizes.append(msg_size)
+    pos += msg_size
+  return sizes
+
+
+def _which_or_empty(ent: CachedEventReader) -> str:
+  try:
+    return ent.which()
+  except capnp.KjException:
+    return ""
+
+
 class _LogFileReader:
-  def __init__(self, fn, only_union_types=False, sort_by_time=False, dat=None):
+  def __init__(self, fn, only_union_types=False, sort_by_time=False, dat=None, streaming=False):
+    """When streaming, events are decoded on demand during iteration and nothing is retained between iterations"""
     self.data_version = None
+    self._fn = fn
+    self._dat = dat
     self._only_union_types = only_union_types
+    self._sort_by_time = sort_by_time
+    self._streaming = streaming
 
-    ext = None
+    self._ext = None
     if not dat:
-      _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
-      if ext not in ('', '.bz2', '.zst'):
+      _, self._ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+      if self._ext not in ('', '.bz2', '.zst'):
         # old rlogs weren't compressed
-        raise ValueError(f"unknown extension {ext}")
-
-      with FileReader(fn) as f:
-        dat = f.read()
-
-    if ext == ".bz2" or dat.startswith(b'BZh9'):
-      dat = bz2.decompress(dat)
-    elif ext == ".zst" or dat.startswith(b'\x28\xB5\x2F\xFD'):
-      # https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md#zstandard-frames
-      dat = decompress_stream(dat)
+        raise ValueError(f"unknown extension {self._ext}")
+
+    self._index: LogIndex | None = None
+    self._ents: list[CachedEventReader] | None = None
+    if not streaming:
+      self._ents = self._read_ents()
+
+  def _read_ents(self) -> list[CachedEventReader]:
+    ents = list(self._stream_ents())
+    if self._sort_by_time:
+      ents.sort(key=lambda x: x.logMonoTime)
+    return ents
+
+  def _decompressed(self) -> Iterator[bytes]:
+    if self._dat:
+      yield from _decompressed_chunks(_buffer_chunks(self._dat), self._ext)
+      return
+
+    with FileReader(self._fn) as f:
+      # local files are decompressed straight from a memory mapping, remote files are fetched whole.
+      # either way, the decompression and decoding is incremental
+      dat = f.view() if isinstance(f, DiskFile) else f.read()
+      yield from _decompressed_chunks(_buffer_chunks(dat), self._ext)
+      del dat
+
+  def _stream_ents_with_offsets(self) -> Iterator[tuple[int, int, CachedEventReader]]:
+    """Yields (offset, size, event) with offset and size in bytes of the decompressed log"""
+    buf = bytearray()
+    offset = 0
+    for chunk in self._decompressed():
+      buf += chunk
+      sizes = _complete_message_sizes(buf)
+      if len(sizes) == 0:
+        continue
+
+      msgs_len = sum(sizes)
+      try:
+        for size, e in zip(sizes, capnp_log.Event.read_multiple_bytes(bytes(buf[:msgs_len])), strict=False):
+          yield offset, size, CachedEventReader(e)
+          offset += size
+      except capnp.KjException:
+        warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+        return
+      del buf[:msgs_len]
+
+    if len(buf):
+      warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
 
-    ents = capnp_log.Event.read_multiple_bytes(dat)
+  def _stream_ents(self) -> Iterator[CachedEventReader]:
+    for _, _, ent in self._stream_ents_with_offsets():
+      yield ent
+
+  def _read_ranges(self, ranges: Iterable[tuple[int, int]]) -> Iterator[bytes]:
+    """Yields the given sorted, non-overlapping byte ranges of the decompressed log, decompressing only as far as needed"""
+    chunks = self._decompressed()
+    buf = bytearray()
+    buf_start = 0
+    for start, end in ranges:
+      while buf_start + len(buf) < end:
+        chunk = next(chunks, None)
+        if chunk is None:
+          return
+        if buf_start + len(buf) + len(chunk) <= start:
+          # nothing of interest in this chunk
+          buf_start += len(buf) + len(chunk)
+          buf.clear()
+        else:
+          buf += chunk
+
+      yield bytes(buf[start - buf_start:end - buf_start])
+      del buf[:end - buf_start]
+      buf_start = end
+
+  def _index_path(self) -> str | None:
+    return index_cache_path(self._fn) if not self._dat else None
+
+  def index(self) -> LogIndex:
+    if self._index is None:
+      path = self._index_path()
+      if self._ents is not None:
+        # already decoded, so index the events in memory instead of reading the file again. indices are into
+        # self._ents, which are sorted if sort_by_time, and there are no byte ranges
+        self._index = LogIndex.from_events((0, 0, _which_or_empty(ent), ent.logMonoTime) for ent in self._ents)
+      elif path is not None and os.path.exists(path):
+        self._index = LogIndex.load(path)
+      else:
+        self._index = LogIndex.from_events((offset, size, _which_or_empty(ent), ent.logMonoTime)
+                                           for offset, size, ent in self._stream_ents_with_offsets())
+        if path is not None:
+          self._index.save(path)
+          prune_cache(os.path.basename(path))
+    return self._index
+
+  def filter(self, msg_type: str, start_time: int | None = None, end_time: int | None = None) -> Iterator[CachedEventReader]:
+    """Events of msg_type with start_time <= logMonoTime < end_time, only the matching events are decoded"""
+    index = self.index()
+    idxs = index.select(msg_type, start_time, end_time)
+    if self._ents is not None:
+      yield from (self._ents[i] for i in idxs)
+      return
+
+    ranges = ((int(index.offsets[i]), int(index.offsets[i] + index.sizes[i])) for i in idxs)
+    ents = (CachedEventReader(next(capnp_log.Event.read_multiple_bytes(dat)), msg_type) for dat in self._read_ranges(ranges))
+    if self._sort_by_time:
+      yield from sorted(ents, key=lambda x: x.logMonoTime)
+    else:
+      yield from ents
 
-    self._ents = []
-    try:
-      for e in ents:
-        self._ents.append(CachedEventReader(e))
-    except capnp.KjException:
-      warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+  def first(self, msg_type: str) -> CachedEventReader | None:
+    """First event of msg_type, without an index it stops decoding there instead of building one"""
+    if self._index is not None or (self._ents is None and (path := self._index_path()) is not None and os.path.exists(path)):
+      return next(self.filter(msg_type), None)
 
-    if sort_by_time:
-      self._ents.sort(key=lambda x: x.logMonoTime)
+    if self._ents is not None:
+      ents = self._ents
+    elif self._sort_by_time:
+      ents = self._read_ents()
+    else:
+      ents = self._stream_ents()
+    return next((ent for ent in ents if _which_or_empty(ent) == msg_type), None)
 
   def __iter__(self) -> Iterator[capnp._DynamicStructReader]:
-    for ent in self._ents:
+    if self._ents is not None:
+      ents = self._ents
+    elif self._sort_by_time:
+      # sorting needs the whole file, but it is only held for the duration of the iteration
+      ents = self._read_ents()
+    else:
+      ents = self._stream_ents()
+
+    for ent in ents:
       if self._only_union_types:
         try:
           ent.which()
@@ -244,7 +422,8 @@ class LogReader:
     return identifiers
 
   def __init__(self, identifier: str | list[str], default_mode: ReadMode = ReadMode.RLOG,
-               sources: list[Source] | None = None, sort_by_time=False, only_union_types=False):
+               sources: list[Source] | None = None, sort_by_time=False, only_union_types=False, streaming=False,
+               prefetch=0):
     if sources is None:
       sources = [internal_source, comma_api_source, openpilotci_source, comma_car_segments_source]
 
@@ -256,18 +435,54 @@ class LogReader:
 
     self.sort_by_time = sort_by_time
     self.only_union_types = only_union_types
+    # segments are decoded on demand and released once iterated, keeping memory bounded for long routes
+    self.streaming = streaming
+    # number of upcoming segments to download and decode in the background while iterating
+    self.prefetch = prefetch
 
     self.__lrs: dict[int, _LogFileReader] = {}
     self.reset()
 
   def _get_lr(self, i):
-    if i not in self.__lrs:
-      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types)
-    return self.__lrs[i]
+    if i in self.__lrs:
+      return self.__lrs[i]
+
+    lr = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types,
+                        streaming=self.streaming)
+    if not self.streaming:
+      self.__lrs[i] = lr
+    return lr
+
+  def _prefetch_lr(self, i):
+    if i in self.__lrs:
+      return self.__lrs[i]
+
+    # prefetched segments are always fully decoded, streaming only controls whether they're kept afterwards
+    lr = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types)
+    if not self.streaming:
+      self.__lrs[i] = lr
+    return lr
 
   def __iter__(self):
-    for i in range(len(self.logreader_identifiers)):
-      yield from self._get_lr(i)
+    num_segs = len(self.logreader_identifiers)
+    if self.prefetch == 0:
+      for i in range(num_segs):
+        yield from self._get_lr(i)
+      return
+
+    # at most the current segment and the next self.prefetch segments are in flight
+    executor = ThreadPoolExecutor(max_workers=self.prefetch)
+    try:
+      futures = deque(executor.submit(self._prefetch_lr, i) for i in range(min(self.prefetch + 1, num_segs)))
+      for i in range(num_segs):
+        lr = futures.popleft().result()
+        yield from lr
+        del lr
+        # only once the current segment is done, so at most self.prefetch decoded segments wait besides it
+        if i + self.prefetch + 1 < num_segs:
+          futures.append(executor.submit(self._prefetch_lr, i + self.prefetch + 1))
+    finally:
+      executor.shutdown(wait=False, cancel_futures=True)
 
   def _run_on_segment(self, func, i):
     return func(self._get_lr(i))
@@ -289,15 +504,27 @@ class LogReader:
   def from_bytes(dat):
     return _LogFileReader("", dat=dat)
 
-  def filter(self, msg_type: str):
-    return (getattr(m, m.which()) for m in filter(lambda m: m.which() == msg_type, self))
+  def filter(self, msg_type: str, start_time: int | None = None, end_time: int | None = None):
+    """Messages of msg_type with start_time <= logMonoTime < end_time (ns). When streaming, a cached per-segment index means only matching events are decoded"""
+    for i in range(len(self.logreader_identifiers)):
+      for m in self._get_lr(i).filter(msg_type, start_time, end_time):
+        yield getattr(m, msg_type)
 
   def first(self, msg_type: str):
-    return next(self.filter(msg_type), None)
+    for i in range(len(self.logreader_identifiers)):
+      m = self._get_lr(i).first(msg_type)
+      if m is not None:
+        return getattr(m, msg_type)
+    return None
 
   @property
   def time_series(self):
-    return msgs_to_time_series(self)
+    # the time series of each segment are cached in the download cache
+    return merge_time_series([cached_time_series(fn, "log_time_series", partial(self._segment_time_series, i), (msgs_to_time_series.__module__,))
+                              for i, fn in enumerate(self.logreader_identifiers)])
+
+  def _segment_time_series(self, i):
+    return msgs_to_time_series(self._get_lr(i))
 
 
 if __name__ == "__main__":
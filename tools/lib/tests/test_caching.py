@@ -2,11 +2,13 @@ import http.server
 import os
 import shutil
 import socket
+import sqlite3
 import tempfile
 import pytest
 
 from openpilot.selfdrive.test.helpers import http_server_context
 from openpilot.system.hardware.hw import Paths
+from openpilot.tools.lib.cache_index import CacheIndex
 from openpilot.tools.lib.url_file import URLFile, prune_cache
 import openpilot.tools.lib.url_file as url_file_module
 
@@ -30,6 +32,34 @@ class CachingTestRequestHandler(http.server.BaseHTTPRequestHandler):
     self.end_headers()
 
 
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+  DATA = os.urandom(25_500)
+  requested_ranges: list[str] = []
+  head_requests = 0
+  failing_ranges: set[str] = set()
+
+  def do_GET(self):
+    data = self.DATA
+    if "Range" in self.headers:
+      self.requested_ranges.append(self.headers["Range"])
+      if self.headers["Range"] in self.failing_ranges:
+        self.send_response(500)
+        self.end_headers()
+        return
+      start, end = (int(x) for x in self.headers["Range"].removeprefix("bytes=").split("-"))
+      data = data[start:end + 1]
+    self.send_response(206 if "Range" in self.headers else 200)
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def do_HEAD(self):
+    RangeRequestHandler.head_requests += 1
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(self.DATA)))
+    self.end_headers()
+
+
 @pytest.fixture
 def host():
   with http_server_context(handler=CachingTestRequestHandler) as (host, port):
@@ -135,12 +165,77 @@ class TestFileDownload:
     assert length == 4
 
 
+  @pytest.mark.parametrize("read_ahead", [0, 3])
+  def test_concurrent_chunks(self, monkeypatch, read_ahead):
+    os.environ.pop("DISABLE_FILEREADER_CACHE", None)
+    monkeypatch.setattr(url_file_module, 'CHUNK_SIZE', 1000)
+    RangeRequestHandler.requested_ranges.clear()
+    data = RangeRequestHandler.DATA
+
+    with http_server_context(handler=RangeRequestHandler) as (host, port):
+      url = f"http://{host}:{port}/test.bin"
+      assert URLFile(url, read_ahead=read_ahead).read() == data
+
+      # every chunk is downloaded exactly once
+      assert len(RangeRequestHandler.requested_ranges) == len(set(RangeRequestHandler.requested_ranges)) == 26
+
+      for start, length in [(0, 0), (0, 1), (999, 2), (1500, 5000), (25_000, 1000), (30_000, 10)]:
+        f = URLFile(url, read_ahead=read_ahead)
+        f.seek(start)
+        assert f.read(length) == data[start:start + length]
+      assert len(RangeRequestHandler.requested_ranges) == 26
+
+      # sequential reads with read ahead
+      f = URLFile(url, cache=True, read_ahead=read_ahead)
+      shutil.rmtree(Paths.download_cache_root())
+      os.makedirs(Paths.download_cache_root())
+      assert b"".join(iter(lambda: f.read(700), b"")) == data
+
+  def test_read_cached_without_length(self, monkeypatch):
+    os.environ.pop("DISABLE_FILEREADER_CACHE", None)
+    monkeypatch.setattr(url_file_module, 'CHUNK_SIZE', 1000)
+    data = RangeRequestHandler.DATA
+
+    with tempfile.TemporaryDirectory() as tmpdir, http_server_context(handler=RangeRequestHandler) as (host, port):
+      monkeypatch.setattr(Paths, 'download_cache_root', staticmethod(lambda: tmpdir + "/"))
+      url = f"http://{host}:{port}/test.bin"
+      RangeRequestHandler.head_requests = 0
+      assert URLFile(url).read() == data
+      assert RangeRequestHandler.head_requests == 1
+
+      # reads of cached chunks don't need the length, even past the end of the file
+      os.remove(f"{tmpdir}/{url_file_module.hash_url(url)}_length")
+      for start, length in [(0, 100), (1500, 5000), (25_000, 1000)]:
+        f = URLFile(url)
+        f.seek(start)
+        assert f.read(length) == data[start:start + length]
+        assert f.tell() == min(start + length, len(data))
+      assert RangeRequestHandler.head_requests == 1
+
+  def test_read_ahead_error(self, monkeypatch, caplog):
+    os.environ.pop("DISABLE_FILEREADER_CACHE", None)
+    monkeypatch.setattr(url_file_module, 'CHUNK_SIZE', 1000)
+    data = RangeRequestHandler.DATA
+
+    with tempfile.TemporaryDirectory() as tmpdir, http_server_context(handler=RangeRequestHandler) as (host, port):
+      monkeypatch.setattr(Paths, 'download_cache_root', staticmethod(lambda: tmpdir + "/"))
+      monkeypatch.setattr(RangeRequestHandler, 'failing_ranges', {"bytes=1000-1999"})
+      f = URLFile(f"http://{host}:{port}/test.bin", read_ahead=1)
+      assert f.read(1000) == data[:1000]
+      # wait for the read ahead to fail
+      URLFile.executor().shutdown(wait=True)
+      URLFile.reset()
+      assert "Read ahead" in caplog.text
+      with pytest.raises(url_file_module.URLFileException):
+        f.read(1000)
+
+
 class TestCache:
   def test_prune_cache(self, monkeypatch):
     with tempfile.TemporaryDirectory() as tmpdir:
       monkeypatch.setattr(Paths, 'download_cache_root', staticmethod(lambda: tmpdir + "/"))
 
-      # setup test files and manifest
+      # setup test files and an old style manifest, which gets imported into the index
       manifest_lines = []
       for i in range(3):
         fname = f"hash_{i}"
@@ -151,17 +246,83 @@ class TestCache:
         f.write('\n'.join(manifest_lines))
 
       # under limit, shouldn't prune
-      assert len(os.listdir(tmpdir)) == 4
       prune_cache()
-      assert len(os.listdir(tmpdir)) == 4
+      assert {f"hash_{i}" for i in range(3)} <= set(os.listdir(tmpdir))
+      assert not os.path.exists(tmpdir + "/manifest.txt")
+      assert url_file_module.cache_index().size() == 3000
 
-      # set a tiny cache limit to force eviction (1.5 chunks worth)
-      monkeypatch.setattr(url_file_module, 'CACHE_SIZE', url_file_module.CHUNK_SIZE + url_file_module.CHUNK_SIZE // 2)
+      # set a tiny cache limit to force eviction (1.5 files worth)
+      monkeypatch.setattr(url_file_module, 'CACHE_SIZE', 1500)
 
       # prune_cache should evict oldest files to get under limit
       prune_cache()
       remaining = os.listdir(tmpdir)
-      # should have evicted at least one file + manifest
-      assert len(remaining) < 4
+      assert "hash_0" not in remaining and "hash_1" not in remaining
       # newest file should remain
-      assert manifest_lines[2].split()[0] in remaining
+      assert "hash_2" in remaining
+      assert url_file_module.cache_index().size() == 1000
+
+  def test_cache_index_lru(self, monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      monkeypatch.setattr(Paths, 'download_cache_root', staticmethod(lambda: tmpdir + "/"))
+      monkeypatch.setattr(url_file_module, 'CACHE_SIZE', 2500)
+
+      for i, size in enumerate((1000, 500, 1000)):
+        with open(f"{tmpdir}/hash_{i}", "wb") as f:
+          f.truncate(size)
+        prune_cache(f"hash_{i}")
+
+      # accessing the oldest entry makes hash_1 the least recently used one
+      index = url_file_module.cache_index()
+      index.record_access(["hash_0"], misses=2)
+      with open(f"{tmpdir}/hash_3", "wb") as f:
+        f.truncate(100)
+      prune_cache("hash_3")
+
+      assert not os.path.exists(f"{tmpdir}/hash_1")
+      assert all(os.path.exists(f"{tmpdir}/hash_{i}") for i in (0, 2, 3))
+      stats = index.stats()
+      assert stats["size"] == 2100
+      assert stats["entries"] == 3
+      assert stats["hits"] == 1 and stats["misses"] == 2 and stats["evictions"] == 1
+
+  def test_cache_index_evict_directory(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      index = CacheIndex(tmpdir)
+      os.makedirs(f"{tmpdir}/entry_0")
+      for fn in ("a", "b"):
+        with open(f"{tmpdir}/entry_0/{fn}", "wb") as f:
+          f.truncate(500)
+      index.add("entry_0", 1000)
+      with open(f"{tmpdir}/entry_1", "wb") as f:
+        f.truncate(1000)
+      index.add("entry_1", 1000)
+
+      index.evict(1000)
+      assert not os.path.exists(f"{tmpdir}/entry_0")
+      assert os.path.exists(f"{tmpdir}/entry_1")
+      assert index.size() == 1000
+
+  def test_cache_index_batched_access(self, monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      index = CacheIndex(tmpdir)
+      index.add("hash_0", 1000)
+      db = sqlite3.connect(f"{tmpdir}/{CacheIndex.DB_NAME}")
+      last_access = db.execute("SELECT last_access FROM entries").fetchone()[0]
+
+      # cached reads are only written once per FLUSH_INTERVAL
+      for _ in range(10):
+        index.record_access(["hash_0"])
+      assert db.execute("SELECT last_access FROM entries").fetchone()[0] == last_access
+      assert db.execute("SELECT value FROM stats WHERE key = 'hits'").fetchone()[0] == 0
+
+      monkeypatch.setattr(CacheIndex, "FLUSH_INTERVAL", 0)
+      index.record_access(["hash_0"])
+      assert db.execute("SELECT last_access FROM entries").fetchone()[0] > last_access
+      assert index.stats()["hits"] == 11
+
+  def test_cache_index_manifest_gone(self, monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      # imported by another process between the check and the import
+      monkeypatch.setattr(os.path, "exists", lambda path: True)
+      CacheIndex(tmpdir)
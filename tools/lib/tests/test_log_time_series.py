@@ -0,0 +1,113 @@
+import os
+import numpy as np
+import tempfile
+
+from cereal import log
+from openpilot.tools.lib.log_time_series import msgs_to_time_series, msgs_to_time_series_dicts
+from openpilot.tools.lib.logreader import LogReader
+from openpilot.tools.lib.time_series_cache import ARRAYS_NAME, LAYOUT_NAME, load_time_series, save_time_series
+
+
+def get_msgs(num_msgs=100):
+  msgs = []
+  for i in range(num_msgs):
+    msg = log.Event.new_message(logMonoTime=(num_msgs - i) * 10_000_000, valid=bool(i % 2))
+    if i % 2 == 0:
+      ds = msg.init('deviceState')
+      ds.freeSpacePercent = i / 2
+      ds.started = bool(i % 4)
+      ds.thermalStatus = 'red' if i % 3 else 'green'
+      ds.cpuTempC = [i, i + 1.5]
+      ds.networkInfo.technology = str(i)
+      ds.init('thermalZones', 2)
+      ds.thermalZones[1].temp = i
+    else:
+      msg.init('accelerometer').acceleration.v = [i, i + 1, i + 2]
+    msgs.append(log.Event.from_bytes(msg.to_bytes()).__enter__())
+  return msgs
+
+
+class TestLogTimeSeries:
+  def test_matches_reference(self):
+    msgs = get_msgs()
+    expected = msgs_to_time_series_dicts(msgs)
+    ts = msgs_to_time_series(msgs)
+
+    assert ts.keys() == expected.keys()
+    for typ in expected:
+      assert ts[typ].keys() == expected[typ].keys()
+      assert np.all(np.diff(ts[typ]['t']) > 0)
+      for field, values in expected[typ].items():
+        assert ts[typ][field].shape == values.shape, field
+        if values.dtype == object:
+          assert [str(v) for v in ts[typ][field]] == [str(v) for v in values], field
+        else:
+          np.testing.assert_array_equal(ts[typ][field], values, err_msg=field)
+          # the reference can't know the dtype of empty lists
+          assert values.size == 0 or ts[typ][field].dtype == values.dtype, field
+
+  def test_typed_columns(self):
+    ts = msgs_to_time_series(get_msgs())
+    assert ts['deviceState']['freeSpacePercent'].dtype == np.float64
+    assert ts['deviceState']['started'].dtype == np.bool_
+    assert ts['deviceState']['fanSpeedPercentDesired'].dtype == np.int64
+    assert ts['deviceState']['thermalZones'].dtype == object
+    assert ts['deviceState']['cpuTempC'].dtype == np.float64
+    assert ts['deviceState']['cpuTempC'].shape == (50, 2)
+
+  def test_fields(self):
+    msgs = get_msgs()
+    ts = msgs_to_time_series(msgs, fields=["deviceState/freeSpacePercent", "deviceState/networkInfo"])
+    assert list(ts.keys()) == ["deviceState"]
+    assert set(ts["deviceState"].keys()) == {"t", "_valid", "freeSpacePercent", "networkInfo/technology", "networkInfo/operator",
+                                             "networkInfo/band", "networkInfo/channel", "networkInfo/extra", "networkInfo/state"}
+    np.testing.assert_array_equal(ts["deviceState"]["freeSpacePercent"], msgs_to_time_series(msgs)["deviceState"]["freeSpacePercent"])
+
+    ts = msgs_to_time_series(msgs, fields=["accelerometer"])
+    assert ts.keys() == {"accelerometer"}
+    assert ts["accelerometer"]["acceleration/v"].shape == (50, 3)
+
+  def test_cached_time_series(self, mocker):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      fns = []
+      for seg in range(2):
+        fns.append(f"{tmpdir}/{seg}")
+        with open(fns[-1], "wb") as f:
+          f.write(b"".join(log.Event.new_message(logMonoTime=seg * 1000 + i, deviceState={"freeSpacePercent": i}).to_bytes() for i in range(100)))
+
+      expected = msgs_to_time_series(list(LogReader(fns)))
+      extract_mock = mocker.spy(LogReader, "_segment_time_series")
+      for num_extracted in (2, 2):
+        ts = LogReader(fns).time_series
+        assert extract_mock.call_count == num_extracted
+        assert ts.keys() == expected.keys()
+        for field, values in expected["deviceState"].items():
+          np.testing.assert_array_equal(ts["deviceState"][field], values, err_msg=field)
+
+  def test_save_load_objects(self):
+    ts = msgs_to_time_series(get_msgs())
+    ts["deviceState"]["ragged"] = np.array([np.arange(3), None, np.array([b"a", b"bc"])], dtype=object)
+    ts["start_time"] = 1.5
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = f"{tmpdir}/ts.ts"
+      assert save_time_series(path, ts) == sum(os.path.getsize(f"{path}/{fn}") for fn in (ARRAYS_NAME, LAYOUT_NAME))
+      # nothing is pickled
+      assert np.load(f"{path}/{ARRAYS_NAME}", allow_pickle=False).dtype == np.uint8
+      loaded = load_time_series(path)
+
+      assert loaded.keys() == ts.keys()
+      assert loaded["start_time"] == 1.5
+      for typ in ("deviceState", "accelerometer"):
+        assert loaded[typ].keys() == ts[typ].keys()
+        for field, values in ts[typ].items():
+          assert loaded[typ][field].dtype == values.dtype, field
+          assert loaded[typ][field].shape == values.shape, field
+          assert str(loaded[typ][field].tolist()) == str(values.tolist()), field
+          # numeric columns are read-only views of the memory mapped file
+          if values.dtype != object:
+            assert not loaded[typ][field].flags.writeable, field
+      assert isinstance(loaded["deviceState"]["t"].base, np.memmap)
+
+      # another process stored the entry first
+      assert save_time_series(path, ts) is None
+      assert not any(fn.startswith(".tmp_") for fn in os.listdir(tmpdir))
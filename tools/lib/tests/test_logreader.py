@@ -1,3 +1,4 @@
+import bz2
 import capnp
 import contextlib
 import io
@@ -6,12 +7,15 @@ import tempfile
 import os
 import pytest
 import requests
+import zstandard as zstd
+from concurrent.futures import ThreadPoolExecutor
 
 from openpilot.common.parameterized import parameterized
 
 from cereal import log as capnp_log
-from openpilot.tools.lib.logreader import LogsUnavailable, LogIterable, LogReader, parse_indirect, ReadMode
+from openpilot.tools.lib.logreader import LogsUnavailable, LogIterable, LogReader, _LogFileReader, parse_indirect, ReadMode
 from openpilot.tools.lib.file_sources import comma_api_source, InternalUnavailableException
+from openpilot.tools.lib.log_index import LogIndex
 from openpilot.tools.lib.route import SegmentRange
 from openpilot.tools.lib.url_file import URLFileException
 
@@ -261,3 +265,97 @@ class TestLogReader:
       msgs = list(LogReader(qlog.name, only_union_types=True))
       assert len(msgs) == num_msgs
       [m.which() for m in msgs]
+
+  @pytest.mark.parametrize("ext", ["", ".bz2", ".zst"])
+  def test_streaming(self, ext):
+    dat = b"".join(capnp_log.Event.new_message(logMonoTime=i, valid=bool(i % 2)).to_bytes() for i in range(5000))
+    if ext == ".bz2":
+      dat = bz2.compress(dat)
+    elif ext == ".zst":
+      dat = zstd.compress(dat)
+
+    with tempfile.NamedTemporaryFile(suffix=ext) as f:
+      f.write(dat)
+      f.flush()
+
+      msgs = list(LogReader(f.name))
+      lr = LogReader(f.name, streaming=True)
+      for _ in range(2):
+        streamed_msgs = list(lr)
+        assert [m.logMonoTime for m in streamed_msgs] == [m.logMonoTime for m in msgs] == list(range(5000))
+        assert [m.valid for m in streamed_msgs] == [m.valid for m in msgs]
+
+  @pytest.mark.parametrize("streaming", [True, False])
+  def test_filter_index(self, mocker, streaming):
+    with tempfile.NamedTemporaryFile(suffix=".zst") as f:
+      msgs = []
+      for i in range(1000):
+        msg = capnp_log.Event.new_message(logMonoTime=i)
+        if i % 10 == 0:
+          msg.init("carParams").carFingerprint = str(i)
+        else:
+          msg.init("carState").vEgo = i
+        msgs.append(msg.to_bytes())
+      f.write(zstd.compress(b"".join(msgs)))
+      f.flush()
+
+      # without an index, first() stops at the first match instead of building one
+      build_mock = mocker.spy(LogIndex, "from_events")
+      assert LogReader(f.name, streaming=streaming).first("carParams").carFingerprint == "0"
+      assert build_mock.call_count == 0
+
+      lr = LogReader(f.name, streaming=streaming)
+      read_mock = mocker.spy(_LogFileReader, "_stream_ents_with_offsets")
+      expected = [str(i) for i in range(0, 1000, 10)]
+      assert [m.carParams.carFingerprint for m in lr if m.which() == "carParams"] == expected
+      assert [cp.carFingerprint for cp in lr.filter("carParams")] == expected
+      assert [cp.carFingerprint for cp in lr.filter("carParams", start_time=100, end_time=200)] == expected[10:20]
+      assert lr.first("carParams").carFingerprint == "0"
+      assert lr.first("deviceState") is None
+      # decoded events are indexed in memory, the file is only decoded once
+      if not streaming:
+        assert read_mock.call_count == 1
+
+      # once built, the index is loaded from the download cache
+      build_mock.reset_mock()
+      assert [cp.carFingerprint for cp in LogReader(f.name, streaming=True).filter("carParams")] == expected
+      assert build_mock.call_count == (0 if streaming else 1)
+
+  def test_filter_sorted(self):
+    with tempfile.NamedTemporaryFile(suffix=".zst") as f:
+      times = [3, 1, 2, 0]
+      f.write(zstd.compress(b"".join(capnp_log.Event.new_message(logMonoTime=t, carParams={"carFingerprint": str(t)}).to_bytes() for t in times)))
+      f.flush()
+
+      for streaming in (True, False):
+        lr = LogReader(f.name, sort_by_time=True, streaming=streaming)
+        assert [cp.carFingerprint for cp in lr.filter("carParams")] == ["0", "1", "2", "3"]
+        assert lr.first("carParams").carFingerprint == "0"
+
+  @pytest.mark.parametrize("streaming", [True, False])
+  def test_prefetch(self, streaming, mocker):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      fns = []
+      for seg in range(5):
+        fn = os.path.join(tmpdir, f"{seg}.zst")
+        with open(fn, "wb") as f:
+          f.write(zstd.compress(b"".join(capnp_log.Event.new_message(logMonoTime=seg * 1000 + i).to_bytes() for i in range(1000))))
+        fns.append(fn)
+
+      expected = [m.logMonoTime for m in LogReader(fns)]
+      assert len(expected) == 5000
+      for prefetch in (1, 2, 10):
+        lr = LogReader(fns, streaming=streaming, prefetch=prefetch)
+        assert [m.logMonoTime for m in lr] == expected
+        assert [m.logMonoTime for m in lr] == expected
+
+      # the segment being read and at most prefetch more are submitted
+      submitted = []
+      class RecordingExecutor(ThreadPoolExecutor):
+        def submit(self, fn, i):
+          submitted.append(i)
+          return super().submit(fn, i)
+      mocker.patch("openpilot.tools.lib.logreader.ThreadPoolExecutor", RecordingExecutor)
+      for m in LogReader(fns, streaming=streaming, prefetch=2):
+        if m.logMonoTime % 1000 == 0:
+          assert max(submitted) <= m.logMonoTime // 1000 + 2
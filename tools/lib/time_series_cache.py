@@ -0,0 +1,172 @@
+import base64
+import hashlib
+import importlib
+import json
+import math
+import os
+import shutil
+import tempfile
+import numpy as np
+from collections.abc import Callable, Iterable
+from functools import cache
+
+from cereal import CEREAL_PATH
+from openpilot.common.swaglog import cloudlog
+from openpilot.system.hardware.hw import Paths
+from openpilot.tools.lib.log_index import file_cache_key
+from openpilot.tools.lib.url_file import prune_cache
+
+# bump when the cache format changes
+TIME_SERIES_CACHE_VERSION = 3
+KEY_SEP = ":"
+# a cache entry is a directory of the numeric arrays back to back in one .npy, which is memory mapped on load,
+# and a JSON file of where each array is, with the object arrays and scalars. nothing is pickled
+ARRAYS_NAME = "arrays.npy"
+LAYOUT_NAME = "layout.json"
+ALIGNMENT = 64
+
+
+@cache
+def extraction_version(modules: tuple[str, ...]) -> str:
+  """Changes whenever the cereal schema, the cache format or the source of the extraction modules does"""
+  h = hashlib.md5(str(TIME_SERIES_CACHE_VERSION).encode())
+  files = [os.path.join(CEREAL_PATH, fn) for fn in sorted(os.listdir(CEREAL_PATH)) if fn.endswith(".capnp")]
+  files += [importlib.import_module(m).__file__ for m in modules]
+  for fn in files:
+    with open(fn, "rb") as f:
+      h.update(hashlib.md5(f.read()).digest())
+  return h.hexdigest()[:16]
+
+
+def time_series_cache_path(fn: str, name: str, modules: Iterable[str] = ()) -> str | None:
+  """
+    Cache location of the time series extracted from a log file by extractor name, None if caching is disabled.
+    modules are the modules the extraction depends on, a change to their source invalidates the cache.
+  """
+  if not fn or int(os.environ.get("DISABLE_FILEREADER_CACHE", "0")) == 1:
+    return None
+
+  os.makedirs(Paths.download_cache_root(), exist_ok=True)
+  return os.path.join(Paths.download_cache_root(), f"{file_cache_key(fn)}_{name}_{extraction_version(tuple(modules))}.ts")
+
+
+def _encode_object(v):
+  """JSON compatible form of the values in object arrays (e.g. ragged lists, struct dicts, None padding)"""
+  if isinstance(v, np.ndarray) and v.dtype == object:
+    return {"__object_array__": [_encode_object(x) for x in v.ravel()], "shape": v.shape}
+  elif isinstance(v, (np.ndarray, np.generic)):
+    v = np.asarray(v)
+    return {"__array__": base64.b64encode(np.ascontiguousarray(v).tobytes()).decode(), "dtype": v.dtype.str, "shape": v.shape}
+  elif isinstance(v, bytes):
+    return {"__bytes__": base64.b64encode(v).decode()}
+  elif isinstance(v, dict):
+    return {k: _encode_object(x) for k, x in v.items()}
+  elif isinstance(v, (list, tuple)):
+    return [_encode_object(x) for x in v]
+  return v
+
+
+def _decode_object(v):
+  if isinstance(v, list):
+    return [_decode_object(x) for x in v]
+  elif not isinstance(v, dict):
+    return v
+  elif "__object_array__" in v:
+    arr = np.empty(len(v["__object_array__"]), dtype=object)
+    for i, x in enumerate(v["__object_array__"]):
+      arr[i] = _decode_object(x)
+    return arr.reshape(v["shape"])
+  elif "__array__" in v:
+    arr = np.frombuffer(base64.b64decode(v["__array__"]), dtype=np.dtype(v["dtype"])).reshape(v["shape"]).copy()
+    return arr[()] if arr.ndim == 0 else arr
+  elif "__bytes__" in v:
+    return base64.b64decode(v["__bytes__"])
+  return {k: _decode_object(x) for k, x in v.items()}
+
+
+def _flatten(d: dict, prefix: str = "") -> dict[str, np.ndarray]:
+  ret = {}
+  for k, v in d.items():
+    assert KEY_SEP not in k, f"unsupported key {k}"
+    if isinstance(v, dict):
+      ret.update(_flatten(v, prefix + k + KEY_SEP))
+    else:
+      ret[prefix + k] = np.asarray(v)
+  return ret
+
+
+def save_time_series(path: str, ts: dict) -> int | None:
+  """
+    Stores a nested dict of arrays and scalars in the directory path, see ARRAYS_NAME and LAYOUT_NAME. The numeric arrays
+    share one file, so loading a segment maps one file instead of one per field. Returns the size in bytes, None if
+    another process stored the entry first.
+  """
+  layout, chunks, offset = {}, [], 0
+  for key, v in _flatten(ts).items():
+    if v.dtype == object or v.ndim == 0:
+      layout[key] = {"json": _encode_object(v if v.dtype == object else v.item())}
+      continue
+
+    v = np.ascontiguousarray(v)
+    layout[key] = {"dtype": np.lib.format.dtype_to_descr(v.dtype), "shape": v.shape, "offset": offset}
+    padding = -v.nbytes % ALIGNMENT
+    chunks += [v.reshape(-1).view(np.uint8), np.zeros(padding, dtype=np.uint8)]
+    offset += v.nbytes + padding
+
+  # written next to the entry and renamed into place, so readers never see a partial entry
+  tmp = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=".tmp_")
+  try:
+    np.save(os.path.join(tmp, ARRAYS_NAME), np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint8))
+    with open(os.path.join(tmp, LAYOUT_NAME), "w") as f:
+      json.dump(layout, f)
+    size = sum(os.path.getsize(os.path.join(tmp, fn)) for fn in (ARRAYS_NAME, LAYOUT_NAME))
+    os.rename(tmp, path)
+    return size
+  except OSError:
+    shutil.rmtree(tmp, ignore_errors=True)
+    if os.path.isdir(path):
+      # stored by another process in the meantime
+      return None
+    raise
+
+
+def load_time_series(path: str) -> dict:
+  """The time series stored by save_time_series, numeric arrays are read-only views of the memory mapped file"""
+  with open(os.path.join(path, LAYOUT_NAME)) as f:
+    layout = json.load(f)
+  arrays = np.load(os.path.join(path, ARRAYS_NAME), mmap_mode="r", allow_pickle=False)
+
+  ret: dict = {}
+  for key, entry in layout.items():
+    *parents, name = key.split(KEY_SEP)
+    d = ret
+    for p in parents:
+      d = d.setdefault(p, {})
+    if "json" in entry:
+      d[name] = _decode_object(entry["json"])
+    else:
+      dtype = np.lib.format.descr_to_dtype(entry["dtype"])
+      nbytes = dtype.itemsize * math.prod(entry["shape"])
+      d[name] = arrays[entry["offset"]:entry["offset"] + nbytes].view(dtype).reshape(entry["shape"])
+  return ret
+
+
+def cached_time_series(fn: str, name: str, extract: Callable[[], dict], modules: Iterable[str] = ()) -> dict:
+  """
+    Returns the time series of a log file from the download cache, extracting and storing them on a miss.
+    modules are the modules whose source extract depends on, see time_series_cache_path.
+  """
+  path = time_series_cache_path(fn, name, modules)
+  if path is not None and os.path.exists(path):
+    try:
+      return load_time_series(path)
+    except (OSError, ValueError, KeyError):
+      cloudlog.exception(f"failed to load cached time series {path}")
+      shutil.rmtree(path, ignore_errors=True)
+
+  ts = extract()
+  if path is not None:
+    size = save_time_series(path, ts)
+    if size is not None:
+      prune_cache(os.path.basename(path), size)
+  return ts
@@ -2,13 +2,15 @@ import logging
 import os
 import re
 import socket
-import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from hashlib import md5
 from urllib3 import PoolManager, Retry
 from urllib3.response import BaseHTTPResponse
 from urllib3.util import Timeout
 
 from openpilot.common.utils import atomic_write
+from openpilot.tools.lib.cache_index import CacheIndex
 from openpilot.system.hardware.hw import Paths
 from urllib3.exceptions import MaxRetryError
 
@@ -16,39 +18,40 @@ from urllib3.exceptions import MaxRetryError
 K = 1000
 CHUNK_SIZE = 1000 * K
 CACHE_SIZE = 10 * 1024 * 1024 * 1024  # total cache size in GB
+DOWNLOAD_THREADS = 16  # concurrent chunk downloads
 
 logging.getLogger("urllib3").setLevel(logging.WARNING)
+logger = logging.getLogger("tools")
 
 
 def hash_url(link: str) -> str:
   return md5((link.split("?")[0]).encode('utf-8')).hexdigest()
 
 
-def prune_cache(new_entry: str | None = None) -> None:
-  """Evicts oldest cache files (LRU) until cache is under the size limit."""
-  # we use a manifest to avoid tons of os.stat syscalls (slow)
-  manifest = {}
-  manifest_path = Paths.download_cache_root() + "manifest.txt"
-  if os.path.exists(manifest_path):
-    with open(manifest_path) as f:
-      manifest = {parts[0]: int(parts[1]) for line in f if (parts := line.strip().split()) and len(parts) == 2}
+_cache_index: CacheIndex | None = None
+_cache_index_lock = threading.Lock()
 
-  if new_entry:
-    manifest[new_entry] = int(time.time())  # noqa: TID251
 
-  # evict the least recently used files until under limit
-  sorted_items = sorted(manifest.items(), key=lambda x: x[1])
-  while len(manifest) * CHUNK_SIZE > CACHE_SIZE and sorted_items:
-    key, _ = sorted_items.pop(0)
-    try:
-      os.remove(Paths.download_cache_root() + key)
-    except OSError:
-      pass
-    manifest.pop(key, None)
+def cache_index() -> CacheIndex:
+  """Index of the download cache, one connection per process and cache root"""
+  global _cache_index
+  root = Paths.download_cache_root()
+  with _cache_index_lock:
+    if _cache_index is None or _cache_index.root != root or _cache_index.pid != os.getpid():
+      os.makedirs(root, exist_ok=True)
+      _cache_index = CacheIndex(root)
+    return _cache_index
+
+
+def prune_cache(new_entry: str | None = None, size: int | None = None) -> None:
+  """Records a new cache entry and evicts the least recently used ones until the cache is under the size limit."""
+  index = cache_index()
+  if new_entry:
+    if size is None:
+      size = os.path.getsize(Paths.download_cache_root() + new_entry)
+    index.add(new_entry, size)
+  index.evict(CACHE_SIZE)
 
-  # write out manifest
-  with atomic_write(manifest_path, mode="w", overwrite=True) as f:
-    f.write('\n'.join(f"{k} {v}" for k, v in manifest.items()))
 
 class URLFileException(Exception):
   pass
@@ -56,10 +59,17 @@ class URLFileException(Exception):
 
 class URLFile:
   _pool_manager: PoolManager | None = None
+  _executor: ThreadPoolExecutor | None = None
+  # chunks currently being downloaded, shared so concurrent reads don't download the same chunk twice
+  _inflight: dict[str, Future] = {}
+  _inflight_lock = threading.Lock()
 
   @staticmethod
   def reset() -> None:
     URLFile._pool_manager = None
+    URLFile._executor = None
+    URLFile._inflight = {}
+    URLFile._inflight_lock = threading.Lock()
 
   @staticmethod
   def pool_manager() -> PoolManager:
@@ -69,8 +79,16 @@ class URLFile:
       URLFile._pool_manager = PoolManager(num_pools=10, maxsize=100, socket_options=socket_options, retries=retries)
     return URLFile._pool_manager
 
-  def __init__(self, url: str, timeout: int = 10, cache: bool | None = None):
+  @staticmethod
+  def executor() -> ThreadPoolExecutor:
+    if URLFile._executor is None:
+      URLFile._executor = ThreadPoolExecutor(max_workers=DOWNLOAD_THREADS)
+    return URLFile._executor
+
+  def __init__(self, url: str, timeout: int = 10, cache: bool | None = None, read_ahead: int = 0):
     self._url = url
+    # number of chunks after each read to start downloading in the background
+    self._read_ahead = read_ahead
     self._timeout = Timeout(connect=timeout, read=timeout)
     self._pos = 0
     self._length: int | None = None
@@ -118,38 +136,101 @@ class URLFile:
         file_length.write(str(self._length))
     return self._length
 
+  def _chunk_name(self, chunk_idx: int) -> str:
+    return hash_url(self._url) + "_" + str(float(chunk_idx))
+
+  def _download_chunk(self, chunk_idx: int) -> bytes:
+    data = self.get_multi_range([(chunk_idx * CHUNK_SIZE, (chunk_idx + 1) * CHUNK_SIZE)])[0]
+    file_name = self._chunk_name(chunk_idx)
+    with atomic_write(os.path.join(Paths.download_cache_root(), file_name), mode="wb", overwrite=True) as new_cached_file:
+      new_cached_file.write(data)
+    prune_cache(file_name, len(data))
+    return data
+
+  def _is_cached(self, chunk_idx: int) -> bool:
+    return os.path.exists(os.path.join(Paths.download_cache_root(), self._chunk_name(chunk_idx)))
+
+  def _fetch_chunk(self, chunk_idx: int) -> Future | None:
+    """Starts downloading a chunk in the background if it isn't cached yet, returns None if it is"""
+    file_name = self._chunk_name(chunk_idx)
+    with URLFile._inflight_lock:
+      future = URLFile._inflight.get(file_name)
+      if future is None:
+        if self._is_cached(chunk_idx):
+          return None
+        future = URLFile.executor().submit(self._download_chunk, chunk_idx)
+        URLFile._inflight[file_name] = future
+        future.add_done_callback(lambda _: URLFile._inflight.pop(file_name, None))
+    return future
+
+  def _log_read_ahead_error(self, future: Future) -> None:
+    # the chunk is downloaded again when it's read, which raises the error to the reader
+    if (e := future.exception()) is not None:
+      logger.warning(f"Read ahead of {self._url} failed: {e!r}")
+
+  def _read_chunk(self, chunk_idx: int, future: Future | None) -> bytes:
+    if future is not None:
+      return future.result()
+    try:
+      with open(os.path.join(Paths.download_cache_root(), self._chunk_name(chunk_idx)), "rb") as cached_file:
+        return cached_file.read()
+    except FileNotFoundError:
+      # evicted in the meantime
+      return self._download_chunk(chunk_idx)
+
   def read(self, ll: int | None = None) -> bytes:
     if self._force_download:
       return self.read_aux(ll=ll)
 
     file_begin = self._pos
-    file_end = self._pos + ll if ll is not None else self.get_length()
-    assert file_end != -1, f"Remote file is empty or doesn't exist: {self._url}"
-    #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_url(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(Paths.download_cache_root(), str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write(full_path, mode="wb", overwrite=True) as new_cached_file:
-          new_cached_file.write(data)
-        prune_cache(file_name)
-      else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
-
-      response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
-
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
+    length = None
+    if ll is None:
+      length = self.get_length()
+      assert length != -1, f"Remote file is empty or doesn't exist: {self._url}"
+      file_end = length
+    else:
+      file_end = self._pos + ll
+      if self._length is not None and self._length != -1:
+        file_end = min(file_end, self._length)
+    if file_end <= file_begin:
+      return b""
+
+    #  We have to align with chunks we store. All missing chunks are downloaded concurrently
+    first_chunk, last_chunk = file_begin // CHUNK_SIZE, (file_end - 1) // CHUNK_SIZE
+    if length is None and not all(self._is_cached(i) for i in range(first_chunk, last_chunk + 1)):
+      # only downloads need the length, so that no chunk past the end of the file is requested.
+      # Cached chunks end where the file does
+      length = self.get_length()
+      if length != -1:
+        file_end = min(file_end, length)
+        if file_end <= file_begin:
+          return b""
+        last_chunk = (file_end - 1) // CHUNK_SIZE
+
+    futures = {i: self._fetch_chunk(i) for i in range(first_chunk, last_chunk + 1)}
+    cache_index().record_access([self._chunk_name(i) for i, f in futures.items() if f is None], sum(f is not None for f in futures.values()))
+
+    # start downloading the following chunks for sequential access
+    for i in range(last_chunk + 1, last_chunk + 1 + self._read_ahead):
+      if self._is_cached(i):
+        continue
+      if length is None:
+        length = self.get_length()
+      if length == -1 or i * CHUNK_SIZE >= length:
+        break
+      future = self._fetch_chunk(i)
+      if future is not None:
+        future.add_done_callback(self._log_read_ahead_error)
+
+    parts = []
+    for i, future in futures.items():
+      position = i * CHUNK_SIZE
+      data = memoryview(self._read_chunk(i, future))
+      parts.append(data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)])
+
+    ret = b"".join(parts)
+    self._pos = file_begin + len(ret)
+    return ret
 
   def read_aux(self, ll: int | None = None) -> bytes:
     if ll is None: